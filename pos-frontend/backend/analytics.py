@@ -0,0 +1,616 @@
+"""Columnar snapshot of order lines for ad-hoc analysis: heatmaps, weekday profiles, item-by-hour.
+
+Every order line is one row, stored column by column in memory-mapped NumPy
+``.npy`` files. Each column is split into segments of ``SEGMENT_ROWS`` rows.
+The columns are: order id, business date, local hour and weekday, menu item
+id, quantity, amount (line subtotal less line discount), order type,
+cashier and discount type. The last three are small integer codes. A flags
+column marks paid, voided and dead rows.
+
+Each query refreshes the store first, under one lock:
+
+- lines with an id above the high-water mark are appended;
+- orders that the journal (journal.py) shows changing since the last
+  refresh get their rows marked dead, and their current lines appended.
+
+A refresh that finds nothing new costs three small queries. Reports are
+vectorized group-bys over the live rows, with no ORM rows and no Python
+loop over lines.
+
+Dead rows are compacted away once they pass ``COMPACT_RATIO``. The store is
+rebuilt from raw orders, archived ones included, when it is missing, when
+its format changes, or when the business-day settings change.
+
+    PUB_EXPRESS_ANALYTICS_DIR            store folder (default BASE_DIR/analytics)
+    PUB_EXPRESS_ANALYTICS_SEGMENT_ROWS   rows per segment file (default 262144)
+"""
+from sqlalchemy import select, distinct, func, cast, Integer
+from sqlalchemy.orm import Session
+from database import BASE_DIR, Order, OrderItem, MenuItem, OrderEvent
+from reports import line_revenue
+from datetime import datetime, timedelta
+from functools import lru_cache
+import archive, business_day, journal
+import numpy as np
+import json, logging, os, shutil, threading, time
+
+log = logging.getLogger("pub_express.analytics")
+
+ANALYTICS_DIR = os.environ.get("PUB_EXPRESS_ANALYTICS_DIR", os.path.join(BASE_DIR, "analytics"))
+SEGMENT_ROWS = int(os.environ.get("PUB_EXPRESS_ANALYTICS_SEGMENT_ROWS", 1 << 18))
+
+FORMAT = 1
+FETCH_CHUNK = 50_000
+IN_CHUNK = 900              # order ids per IN (...) when reloading changed orders
+COMPACT_RATIO = 0.25
+# Their lines reach the store through the line id high-water mark anyway
+APPEND_ACTIONS = ("created", "snapshot")
+
+COLUMNS = {
+    "order_id": np.int64,
+    "business_date": np.int32,
+    "hour": np.int8,
+    "weekday": np.int8,
+    "menu_item_id": np.int32,
+    "quantity": np.int32,
+    "amount": np.float64,
+    "order_type": np.int16,
+    "cashier": np.int16,
+    "discount_type": np.int16,
+    "flags": np.uint8,
+}
+CODED = ("order_type", "cashier", "discount_type")   # code 0 is "none"
+GROUP_KEYS = ("business_date", "hour", "weekday", "menu_item_id", *CODED)
+MEASURES = ("sales", "quantity", "lines", "orders")
+
+PAID, VOIDED, DEAD = 1, 2, 4
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+EPOCH = datetime(1970, 1, 1)
+QUARTER = 900               # seconds; every real UTC offset is a whole number of quarter-hours
+
+_lock = threading.Lock()
+_store = None
+
+
+# --- Line reads --- #
+
+
+def _line_select():
+    # UTC quarter-hour of created_at, computed by SQLite rather than parsing a datetime per line
+    quarter = cast(func.strftime("%s", Order.created_at), Integer) // QUARTER
+    return (
+        select(
+            OrderItem.id, OrderItem.order_id, Order.business_date, quarter,
+            OrderItem.menu_item_id, OrderItem.quantity, line_revenue(),
+            Order.type, Order.cashier, OrderItem.discount_person_type,
+            Order.is_paid, Order.cancel_reason.isnot(None),
+        )
+        .join(Order, Order.id == OrderItem.order_id)
+    )
+
+
+@lru_cache(maxsize=1 << 17)
+def _local_hour(quarter: int) -> int:
+    return business_day.to_local(EPOCH + timedelta(seconds=quarter * QUARTER)).hour
+
+
+def _local_hours(quarters) -> np.ndarray:
+    """Local clock hour of each UTC quarter-hour, converting each distinct one once."""
+    unique, inverse = np.unique(np.array(quarters, dtype=np.int64), return_inverse=True)
+    hours = np.array([_local_hour(int(quarter)) for quarter in unique], dtype=np.int8)
+    return hours[inverse]
+
+
+def _weekdays(days: np.ndarray) -> np.ndarray:
+    unique, inverse = np.unique(days, return_inverse=True)
+    weekdays = np.array([business_day.to_date(int(day)).weekday() for day in unique], dtype=np.int8)
+    return weekdays[inverse]
+
+
+def _chunks(ids: list):
+    for start in range(0, len(ids), IN_CHUNK):
+        yield ids[start:start + IN_CHUNK]
+
+
+# --- Store --- #
+
+
+class _Store:
+    """Segments of column memmaps plus ``store.json``, which says how many rows are real.
+
+    Rows past ``rows`` are ignored, so a crash mid-append loses nothing the
+    next refresh won't write again. A rebuild or compaction writes a new
+    generation folder, and the switch is the rename of ``store.json``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.segments = []
+        self.meta = self._read_meta()
+        if self.meta is not None:
+            self.segments = [self._open_segment(n) for n in range(len(self.meta["segment_days"]))]
+        self.refreshed_at = None
+        self.refresh_ms = None
+
+    # Files
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.path, "store.json")) as handle:
+                meta = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if meta.get("format") != FORMAT:
+            return None
+        meta["lookup"] = {name: {value: code for code, value in enumerate(values)}
+                          for name, values in meta["codes"].items()}
+        return meta
+
+    def _write_meta(self):
+        for segment in self.segments:
+            for column in segment.values():
+                column.flush()
+        meta = {key: value for key, value in self.meta.items() if key != "lookup"}
+        target = os.path.join(self.path, "store.json")
+        with open(target + ".tmp", "w") as handle:
+            json.dump(meta, handle)
+        os.replace(target + ".tmp", target)
+
+    def _segment_dir(self, n: int, generation: int = None) -> str:
+        generation = self.meta["generation"] if generation is None else generation
+        return os.path.join(self.path, f"gen{generation}", f"seg{n:05d}")
+
+    def _open_segment(self, n: int) -> dict:
+        folder = self._segment_dir(n)
+        return {name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r+") for name in COLUMNS}
+
+    def _new_segment(self, n: int) -> dict:
+        folder = self._segment_dir(n)
+        os.makedirs(folder, exist_ok=True)
+        return {
+            name: np.lib.format.open_memmap(
+                os.path.join(folder, f"{name}.npy"), mode="w+", dtype=dtype, shape=(self.meta["segment_rows"],),
+            )
+            for name, dtype in COLUMNS.items()
+        }
+
+    def _start_generation(self, last_line_id: int, last_seq: int, codes: dict = None):
+        """Point at an empty new generation; older ones stay on disk until ``_finish_generation``."""
+        old = self.meta["generation"] if self.meta else None
+        self.segments = []
+        codes = codes or {name: [None] for name in CODED}
+        self.meta = {
+            "format": FORMAT,
+            "signature": business_day.CONFIG_SIGNATURE,
+            "generation": (old or 0) + 1,
+            "segment_rows": SEGMENT_ROWS,
+            "rows": 0,
+            "dead": 0,
+            "last_line_id": last_line_id,
+            "last_seq": last_seq,
+            "segment_days": [],
+            "codes": codes,
+            "lookup": {name: {value: code for code, value in enumerate(values)} for name, values in codes.items()},
+        }
+        shutil.rmtree(os.path.join(self.path, f"gen{self.meta['generation']}"), ignore_errors=True)
+
+    def _finish_generation(self):
+        self._write_meta()
+        current = f"gen{self.meta['generation']}"
+        for name in os.listdir(self.path):
+            if name.startswith("gen") and name != current:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    # Writes
+
+    def _encode(self, name: str, values) -> np.ndarray:
+        lookup, codes = self.meta["lookup"][name], self.meta["codes"][name]
+        out = []
+        for value in values:
+            code = lookup.get(value or None)
+            if code is None:
+                code = lookup[value] = len(codes)
+                codes.append(value)
+            out.append(code)
+        return np.array(out, dtype=COLUMNS[name])
+
+    def _columns(self, rows) -> tuple:
+        """Line ids and the store columns for a batch of ``_line_select`` rows."""
+        (line_ids, order_ids, days, quarters, items, quantities, amounts,
+         types, cashiers, discounts, paid, voided) = zip(*rows)
+        days = np.array(days, dtype=np.int32)
+        flags = np.array(paid, dtype=bool) * PAID | np.array(voided, dtype=bool) * VOIDED
+        return np.array(line_ids, dtype=np.int64), {
+            "order_id": np.array(order_ids, dtype=np.int64),
+            "business_date": days,
+            "hour": _local_hours(quarters),
+            "weekday": _weekdays(days),
+            "menu_item_id": np.array([item or 0 for item in items], dtype=np.int32),
+            "quantity": np.array([quantity or 0 for quantity in quantities], dtype=np.int32),
+            "amount": np.array(amounts, dtype=np.float64),
+            "order_type": self._encode("order_type", types),
+            "cashier": self._encode("cashier", cashiers),
+            "discount_type": self._encode("discount_type", discounts),
+            "flags": flags.astype(np.uint8),
+        }
+
+    def _append(self, arrays: dict):
+        count = len(arrays["order_id"])
+        written, size = 0, self.meta["segment_rows"]
+        while written < count:
+            n, offset = divmod(self.meta["rows"], size)
+            if n == len(self.segments):
+                self.segments.append(self._new_segment(n))
+                self.meta["segment_days"].append(None)
+            take = min(count - written, size - offset)
+            segment = self.segments[n]
+            for name, column in segment.items():
+                column[offset:offset + take] = arrays[name][written:written + take]
+            days = arrays["business_date"][written:written + take]
+            low, high = int(days.min()), int(days.max())
+            seen = self.meta["segment_days"][n]
+            self.meta["segment_days"][n] = [min(low, seen[0]), max(high, seen[1])] if seen else [low, high]
+            self.meta["rows"] += take
+            written += take
+
+    def _kill(self, order_ids) -> int:
+        """Mark every live row of these orders dead. Returns how many."""
+        order_ids = np.asarray(sorted(order_ids), dtype=np.int64)
+        killed = 0
+        for segment, count in self.live_segments():
+            flags = segment["flags"][:count]
+            hit = np.isin(segment["order_id"][:count], order_ids) & (flags & DEAD == 0)
+            if hit.any():
+                flags[hit] |= DEAD
+                killed += int(hit.sum())
+        self.meta["dead"] += killed
+        return killed
+
+    def live_segments(self):
+        """(segment, rows used) for every segment."""
+        rows, size = self.meta["rows"], self.meta["segment_rows"]
+        for n, segment in enumerate(self.segments):
+            count = min(size, rows - n * size)
+            if count > 0:
+                yield segment, count
+
+    # Refresh
+
+    def _load(self, db: Session, *conditions):
+        """Stream the matching lines in chunks of (line ids, columns)."""
+        # Core rows on the session's connection; ORM row handling would cost more than the rest of a rebuild
+        result = db.connection().execute(
+            _line_select().where(*conditions).execution_options(yield_per=FETCH_CHUNK)
+        )
+        for rows in result.partitions():
+            yield self._columns(rows)
+
+    def rebuild(self, db: Session) -> int:
+        seq = journal.last_seq(db)
+        archive.include(db)
+        self._start_generation(0, seq)
+        for line_ids, arrays in self._load(db):
+            self._append(arrays)
+            self.meta["last_line_id"] = max(self.meta["last_line_id"], int(line_ids.max()))
+        self._finish_generation()
+        log.info("Analytics store rebuilt", extra={"rows": self.meta["rows"]})
+        return self.meta["rows"]
+
+    def compact(self) -> int:
+        """Copy the live rows into a new generation. Returns how many dead rows were dropped."""
+        dead = self.meta["dead"]
+        segments = list(self.live_segments())
+        self._start_generation(self.meta["last_line_id"], self.meta["last_seq"], self.meta["codes"])
+        for segment, count in segments:
+            keep = segment["flags"][:count] & DEAD == 0
+            if keep.any():
+                self._append({name: column[:count][keep] for name, column in segment.items()})
+        del segments
+        self._finish_generation()
+        log.info("Analytics store compacted", extra={"rows": self.meta["rows"], "dropped": dead})
+        return dead
+
+    def refresh(self, db: Session) -> dict:
+        t0 = time.perf_counter()
+        if self.meta is None or self.meta["signature"] != business_day.CONFIG_SIGNATURE:
+            self.rebuild(db)
+            return self._refreshed(t0, {"rebuilt": True})
+
+        seq = journal.last_seq(db)
+        changed = set()
+        if seq > self.meta["last_seq"]:
+            changed = set(db.execute(
+                select(distinct(OrderEvent.order_id)).where(
+                    OrderEvent.seq > self.meta["last_seq"],
+                    OrderEvent.seq <= seq,
+                    OrderEvent.action.notin_(APPEND_ACTIONS),
+                )
+            ).scalars())
+
+        appended = 0
+        last_line_id = self.meta["last_line_id"]
+        changed_ids = np.fromiter(changed, dtype=np.int64, count=len(changed))
+        for line_ids, arrays in self._load(db, OrderItem.id > self.meta["last_line_id"]):
+            last_line_id = max(last_line_id, int(line_ids.max()))
+            if changed:
+                # Changed orders are reloaded whole below
+                keep = ~np.isin(arrays["order_id"], changed_ids)
+                arrays = {name: column[keep] for name, column in arrays.items()}
+            if len(arrays["order_id"]):
+                self._append(arrays)
+                appended += len(arrays["order_id"])
+
+        killed = 0
+        if changed:
+            killed = self._kill(changed)
+            appended += self._reload(db, sorted(changed), seq)
+
+        self.meta["last_line_id"], self.meta["last_seq"] = last_line_id, seq
+        if appended or killed or changed:
+            self._write_meta()
+        if self.meta["dead"] > COMPACT_RATIO * self.meta["rows"] and self.meta["dead"] >= self.meta["segment_rows"]:
+            self.compact()
+        return self._refreshed(t0, {"appended": appended, "dead": killed, "orders_changed": len(changed)})
+
+    def _reload(self, db: Session, order_ids: list, seq: int) -> int:
+        """Append the current lines of changed orders, looking in the archive for any moved there since."""
+        found = set()
+        for chunk in _chunks(order_ids):
+            found.update(db.execute(select(Order.id).where(Order.id.in_(chunk))).scalars())
+        missing = sorted(set(order_ids) - found)
+        deleted = set()
+        for chunk in _chunks(missing):
+            deleted.update(db.execute(
+                select(distinct(OrderEvent.order_id)).where(
+                    OrderEvent.seq > self.meta["last_seq"], OrderEvent.seq <= seq,
+                    OrderEvent.action == "deleted", OrderEvent.order_id.in_(chunk),
+                )
+            ).scalars())
+        if set(missing) - deleted:
+            archive.include(db)
+
+        appended = 0
+        for chunk in _chunks(order_ids):
+            for _, arrays in self._load(db, OrderItem.order_id.in_(chunk)):
+                self._append(arrays)
+                appended += len(arrays["order_id"])
+        return appended
+
+    def _refreshed(self, t0: float, stats: dict) -> dict:
+        self.refreshed_at = business_day.utcnow()
+        self.refresh_ms = (time.perf_counter() - t0) * 1000
+        return {**stats, "ms": round(self.refresh_ms, 1)}
+
+    # Reads
+
+    def scan(self, start_day: int, end_day: int, filters: dict, columns):
+        """Yield the wanted columns of live, paid rows in the range that pass ``filters`` (column -> codes)."""
+        for n, (segment, count) in enumerate(self.live_segments()):
+            low, high = self.meta["segment_days"][n]
+            if high < start_day or low > end_day:
+                continue
+            days = segment["business_date"][:count]
+            mask = (days >= start_day) & (days <= end_day) & (segment["flags"][:count] & (PAID | DEAD) == PAID)
+            for name, codes in filters.items():
+                mask &= np.isin(segment[name][:count], codes)
+            if mask.any():
+                yield {name: segment[name][:count][mask] for name in columns}
+
+    def codes_for(self, filters: dict) -> dict:
+        """Filter values -> store codes. A value the store has never seen matches nothing."""
+        out = {}
+        for name, values in (filters or {}).items():
+            if values is None:
+                continue
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            if name in CODED:
+                lookup = self.meta["lookup"][name]
+                out[name] = np.array([lookup[value] for value in values if value in lookup], dtype=COLUMNS[name])
+            else:
+                out[name] = np.array(list(values), dtype=COLUMNS[name])
+        return out
+
+    def decode(self, name: str, codes) -> list:
+        if name not in CODED:
+            return [int(code) for code in codes]
+        values = self.meta["codes"][name]
+        return [values[code] for code in codes]
+
+
+def _get_store() -> _Store:
+    global _store
+    if _store is None or _store.path != ANALYTICS_DIR:
+        os.makedirs(ANALYTICS_DIR, exist_ok=True)
+        _store = _Store(ANALYTICS_DIR)
+    return _store
+
+
+def close():
+    """Drop the open memmaps (tests and benchmarks that move ANALYTICS_DIR)."""
+    global _store
+    with _lock:
+        _store = None
+
+
+def refresh(db: Session) -> dict:
+    with _lock:
+        return _get_store().refresh(db)
+
+
+def rebuild(db: Session) -> dict:
+    with _lock:
+        store = _get_store()
+        t0 = time.perf_counter()
+        store.rebuild(db)
+        return store._refreshed(t0, {"rebuilt": True, "rows": store.meta["rows"]})
+
+
+def status() -> dict:
+    with _lock:
+        store = _get_store()
+        if store.meta is None:
+            return {"built": False}
+        meta = store.meta
+        folder = os.path.join(store.path, f"gen{meta['generation']}")
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder) for name in names)
+        return {
+            "built": True,
+            "rows": meta["rows"],
+            "live_rows": meta["rows"] - meta["dead"],
+            "dead_rows": meta["dead"],
+            "segments": len(store.segments),
+            "bytes": size,
+            "last_line_id": meta["last_line_id"],
+            "last_seq": meta["last_seq"],
+            "refreshed_at": store.refreshed_at,
+            "refresh_ms": round(store.refresh_ms, 1) if store.refresh_ms is not None else None,
+        }
+
+
+# --- Reports --- #
+
+
+def _check_measure(measure: str):
+    if measure not in MEASURES:
+        raise ValueError(f"Unknown measure. Use one of: {', '.join(MEASURES)}")
+
+
+def _totals(store: _Store, start_day, end_day, filters, measure, keys, size) -> np.ndarray:
+    """Sum ``measure`` into ``size`` cells, where ``keys(columns)`` gives each row's cell."""
+    wanted = {"business_date", "hour", "weekday", "menu_item_id", "order_id", "quantity", "amount"}
+    codes = store.codes_for(filters)
+    if measure == "orders":
+        # An order's lines can straddle segments, so count distinct (order, cell) pairs at the end
+        pairs = [np.unique(columns["order_id"] * size + keys(columns))
+                 for columns in store.scan(start_day, end_day, codes, wanted)]
+        if not pairs:
+            return np.zeros(size, dtype=np.int64)
+        return np.bincount(np.unique(np.concatenate(pairs)) % size, minlength=size)
+
+    totals = np.zeros(size, dtype=np.float64)
+    for columns in store.scan(start_day, end_day, codes, wanted):
+        weights = {"sales": columns["amount"], "quantity": columns["quantity"], "lines": None}[measure]
+        totals += np.bincount(keys(columns), weights=weights, minlength=size)
+    return totals
+
+
+def _values(cells, measure: str) -> list:
+    return np.round(cells, 2).tolist() if measure == "sales" else np.rint(cells).astype(np.int64).tolist()
+
+
+def _hour_order() -> list:
+    """Clock hours in business-day order, starting at the rollover hour."""
+    return [(business_day.DAY_START_HOUR + n) % 24 for n in range(24)]
+
+
+def heatmap(db: Session, start_day: int, end_day: int, measure: str = "sales", filters: dict = None) -> dict:
+    """Paid ``measure`` per weekday and local hour, plus the weekday profile and hour profile.
+
+    Weekdays are of the business date, so a 1 AM Saturday sale counts
+    toward Friday night.
+    """
+    _check_measure(measure)
+    with _lock:
+        store = _get_store()
+        store.refresh(db)
+        cells = _totals(
+            store, start_day, end_day, filters, measure,
+            lambda columns: columns["weekday"].astype(np.int64) * 24 + columns["hour"], 7 * 24,
+        ).reshape(7, 24)
+    hours = _hour_order()
+    cells = cells[:, hours]
+    return {
+        "measure": measure,
+        "weekdays": list(WEEKDAYS),
+        "hours": [f"{hour:02d}:00" for hour in hours],
+        "data": [_values(row, measure) for row in cells],
+        "weekday_totals": _values(cells.sum(axis=1), measure),
+        "hour_totals": _values(cells.sum(axis=0), measure),
+    }
+
+
+def item_hour_matrix(db: Session, start_day: int, end_day: int, measure: str = "quantity",
+                     item_ids=None, filters: dict = None) -> dict:
+    """Paid ``measure`` per menu item per local hour, busiest items first."""
+    _check_measure(measure)
+    filters = dict(filters or {})
+    if item_ids:
+        filters["menu_item_id"] = list(item_ids)
+    with _lock:
+        store = _get_store()
+        store.refresh(db)
+        top_id = max((int(seg["menu_item_id"][:count].max()) for seg, count in store.live_segments()), default=0)
+        size = (top_id + 1) * 24
+        cells = _totals(
+            store, start_day, end_day, filters, measure,
+            lambda columns: columns["menu_item_id"].astype(np.int64) * 24 + columns["hour"], size,
+        ).reshape(top_id + 1, 24)
+
+    hours = _hour_order()
+    cells = cells[:, hours]
+    row_totals = cells.sum(axis=1)
+    ids = [int(item_id) for item_id in np.flatnonzero(row_totals)]
+    if item_ids:
+        ids = sorted(set(ids) | {item_id for item_id in item_ids if 0 < item_id <= top_id})
+    ids.sort(key=lambda item_id: -row_totals[item_id])
+    names = dict(db.query(MenuItem.id, MenuItem.name).filter(MenuItem.id.in_(ids)).all()) if ids else {}
+    return {
+        "measure": measure,
+        "labels": [f"{hour:02d}:00" for hour in hours],
+        "items": [
+            {"id": item_id, "name": names.get(item_id), "data": _values(cells[item_id], measure),
+             "total": _values(row_totals[item_id:item_id + 1], measure)[0]}
+            for item_id in ids
+        ],
+    }
+
+
+def group_by(db: Session, keys, start_day: int, end_day: int, measure: str = "sales", filters: dict = None) -> list:
+    """Paid ``measure`` for every combination of ``keys`` (any of ``GROUP_KEYS``) that has sales."""
+    _check_measure(measure)
+    keys = list(keys)
+    unknown = [key for key in keys if key not in GROUP_KEYS]
+    if not keys or unknown:
+        raise ValueError(f"Group by one or more of: {', '.join(GROUP_KEYS)}")
+    wanted = set(keys) | {"order_id", "quantity", "amount"}
+    with _lock:
+        store = _get_store()
+        store.refresh(db)
+        parts = list(store.scan(start_day, end_day, store.codes_for(filters), wanted))
+        if not parts:
+            return []
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in wanted}
+        del parts
+        # Dense codes per key, folded into one integer per row, so grouping is a 1-D unique
+        combined = np.zeros(len(columns["order_id"]), dtype=np.int64)
+        uniques = []
+        for key in keys:
+            unique, inverse = np.unique(columns[key], return_inverse=True)
+            combined = combined * len(unique) + inverse.reshape(-1)
+            uniques.append(unique)
+        group_codes, inverse = np.unique(combined, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        if measure == "orders":
+            span = int(columns["order_id"].max()) + 1
+            pairs = np.unique(inverse.astype(np.int64) * span + columns["order_id"])
+            values = np.bincount(pairs // span, minlength=len(group_codes))
+        else:
+            weights = {"sales": columns["amount"], "quantity": columns["quantity"], "lines": None}[measure]
+            values = np.bincount(inverse, weights=weights, minlength=len(group_codes))
+        groups = []
+        for unique in reversed(uniques):
+            group_codes, index = np.divmod(group_codes, len(unique))
+            groups.append(unique[index])
+        groups.reverse()
+        decoded = [store.decode(key, group) for key, group in zip(keys, groups)]
+
+    rows = []
+    for n, value in enumerate(_values(values, measure)):
+        row = {key: decoded[k][n] for k, key in enumerate(keys)}
+        if "business_date" in row:
+            row["business_date"] = business_day.iso(row["business_date"])
+        row[measure] = value
+        rows.append(row)
+    rows.sort(key=lambda row: -row[measure])
+    return rows
@@ -0,0 +1,507 @@
+"""Hot/cold archive: closed orders past a cut-off move to one SQLite file per year.
+
+Paid or voided orders whose business date is older than the cut-off are
+moved with their lines into ``ARCHIVE_DIR/orders_<year>.db``. The hot
+``orders`` and ``order_items`` tables stay small, so unbounded queries on
+them stop slowing down month by month. The daily rollups stay in the hot
+database, so summaries over archived days cost no more than before.
+
+Report code that reads raw orders calls ``include(db, start_day, end_day)``
+first. When the range reaches an archived year, the volume is ATTACHed to
+that session's connection. TEMP views named ``orders`` and ``order_items``
+then shadow the hot tables with a UNION ALL over hot and archived rows, so
+the same ORM queries run unchanged. The connection drops the views and
+detaches when it goes back to the pool.
+
+Moves are never lost half-way. Rows are first copied and committed to the
+archive. The hot copy is then deleted only if the order did not change in
+between. A crash leaves an order in both places, and ``repair`` keeps the
+hot copy. ``restore`` moves a single order back. Orders keep the business
+date they were archived with, even if the rollover settings change later.
+
+    PUB_EXPRESS_ARCHIVE_DIR          archive files (default BASE_DIR/archive)
+    PUB_EXPRESS_ARCHIVE_AFTER_DAYS   age in business days before a closed order is archived (default 365)
+    PUB_EXPRESS_ARCHIVE_BATCH        orders moved per transaction (default 2000)
+
+    python archive.py status
+    python archive.py run [DAYS]
+    python archive.py verify
+    python archive.py restore ORDER_ID
+"""
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+from database import BASE_DIR, Base, engine, Order, OrderItem, ArchiveVolume
+from migrations import _add_columns
+from log_config import configure_logging
+from datetime import timedelta
+import business_day
+import json, logging, os, re, sqlite3, sys, threading, time
+
+log = logging.getLogger("pub_express.archive")
+
+ARCHIVE_DIR = os.environ.get("PUB_EXPRESS_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive"))
+ARCHIVE_AFTER_DAYS = int(os.environ.get("PUB_EXPRESS_ARCHIVE_AFTER_DAYS", 365))
+BATCH_SIZE = int(os.environ.get("PUB_EXPRESS_ARCHIVE_BATCH", 2000))
+
+ORDER_COLUMNS = [column.name for column in Order.__table__.columns]
+ITEM_COLUMNS = [column.name for column in OrderItem.__table__.columns]
+# table -> (columns, column holding the order id)
+TABLES = {
+    "orders": (ORDER_COLUMNS, "id"),
+    "order_items": (ITEM_COLUMNS, "order_id"),
+}
+CLOSED = "(is_paid = 1 OR cancel_reason IS NOT NULL)"
+INFO_KEY = "archive_volumes"   # connection info: year -> attached schema name
+IDS = "(SELECT value FROM json_each(?))"
+
+_lock = threading.Lock()
+
+
+def volume_file(year: int) -> str:
+    return f"orders_{year}.db"
+
+
+def _schema(year: int) -> str:
+    return f"archive_{int(year)}"
+
+
+def _cols(columns) -> str:
+    return ", ".join(columns)
+
+
+def cutoff_day(older_than_days: int = None) -> int:
+    """Orders with a business date before this day are old enough to archive."""
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    return business_day.from_date(business_day.to_date(business_day.today()) - timedelta(days=days))
+
+
+# --- Reading through the archive --- #
+
+
+def _with_writes(raw, statements):
+    # Report connections are query_only; TEMP objects still count as writes
+    query_only = raw.execute("PRAGMA query_only").fetchone()[0]
+    if query_only:
+        raw.execute("PRAGMA query_only=OFF")
+    try:
+        for sql in statements:
+            raw.execute(sql)
+    finally:
+        if query_only:
+            raw.execute("PRAGMA query_only=ON")
+
+
+def _view_sql(raw, table: str, schemas) -> str:
+    columns, _ = TABLES[table]
+    parts = [f"SELECT {_cols(columns)} FROM main.{table}"]
+    for schema in schemas:
+        # Volumes written before a later migration lack its columns
+        present = {row[1] for row in raw.execute(f"PRAGMA {schema}.table_info({table})")}
+        selected = [name if name in present else f"NULL AS {name}" for name in columns]
+        parts.append(f"SELECT {_cols(selected)} FROM {schema}.{table}")
+    return f"CREATE TEMP VIEW {table} AS " + " UNION ALL ".join(parts)
+
+
+def include(db: Session, start_day: int = None, end_day: int = None) -> list:
+    """Let this session's ``orders``/``order_items`` also cover archived rows in the range.
+
+    Call before the session writes anything. Returns the archived years now
+    included; an empty list means the range is all hot.
+    """
+    query = select(ArchiveVolume.year, ArchiveVolume.file).where(ArchiveVolume.orders > 0)
+    if start_day is not None:
+        query = query.where(ArchiveVolume.last_day >= start_day)
+    if end_day is not None:
+        query = query.where(ArchiveVolume.first_day <= end_day)
+    volumes = dict(db.execute(query).all())
+    if not volumes:
+        return []
+
+    proxied = db.connection().connection
+    attached = proxied.info.setdefault(INFO_KEY, {})
+    missing = [year for year in volumes if year not in attached]
+    if missing:
+        raw = proxied.dbapi_connection
+        if raw.in_transaction:
+            raise RuntimeError("archive.include() must run before the session writes")
+        for year in missing:
+            raw.execute(f"ATTACH DATABASE ? AS {_schema(year)}", (os.path.join(ARCHIVE_DIR, volumes[year]),))
+            attached[year] = _schema(year)
+        schemas = sorted(attached.values())
+        _with_writes(raw, [
+            "DROP VIEW IF EXISTS temp.orders",
+            "DROP VIEW IF EXISTS temp.order_items",
+            _view_sql(raw, "orders", schemas),
+            _view_sql(raw, "order_items", schemas),
+        ])
+    return sorted(volumes)
+
+
+@event.listens_for(Pool, "checkin")
+def _detach(dbapi_connection, connection_record):
+    if connection_record is None or dbapi_connection is None:
+        return
+    attached = connection_record.info.pop(INFO_KEY, None)
+    if not attached:
+        return
+    try:
+        _with_writes(dbapi_connection, ["DROP VIEW IF EXISTS temp.orders", "DROP VIEW IF EXISTS temp.order_items"])
+        for schema in attached.values():
+            dbapi_connection.execute(f"DETACH DATABASE {schema}")
+    except sqlite3.Error:
+        # Never hand out a connection whose "orders" may still be a view
+        log.exception("Could not detach archive volumes; dropping the connection")
+        connection_record.invalidate()
+
+
+# --- Volumes --- #
+
+
+def _prepare(year: int) -> str:
+    """Create the year's file, or bring an older one up to the current columns. Returns its path."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, volume_file(year))
+    volume_engine = create_engine(f"sqlite:///{path}")
+    try:
+        with volume_engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        with volume_engine.begin() as conn:
+            Base.metadata.create_all(conn, tables=[Order.__table__, OrderItem.__table__])
+            _add_columns(conn, Order, ORDER_COLUMNS)
+            _add_columns(conn, OrderItem, ITEM_COLUMNS)
+    finally:
+        volume_engine.dispose()
+    return path
+
+
+def _attach(raw, year: int):
+    raw.execute(f"ATTACH DATABASE ? AS {_schema(year)}", (os.path.join(ARCHIVE_DIR, volume_file(year)),))
+
+
+def _volume_stats(raw, schema: str) -> dict:
+    orders, total, first_day, last_day = raw.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(total), 0), MIN(business_date), MAX(business_date) FROM {schema}.orders"
+    ).fetchone()
+    items = raw.execute(f"SELECT COUNT(*) FROM {schema}.order_items").fetchone()[0]
+    return {"orders": orders, "items": items, "total": round(total, 2), "first_day": first_day, "last_day": last_day}
+
+
+def _record(raw, year: int) -> dict:
+    """Store what the attached volume holds now in the hot registry."""
+    stats = _volume_stats(raw, _schema(year))
+    raw.execute(f"""
+        INSERT INTO main.{ArchiveVolume.__tablename__}
+            (year, file, first_day, last_day, orders, items, total, updated_at)
+        VALUES (:year, :file, :first_day, :last_day, :orders, :items, :total, :updated_at)
+        ON CONFLICT(year) DO UPDATE SET
+            file = excluded.file, first_day = excluded.first_day, last_day = excluded.last_day,
+            orders = excluded.orders, items = excluded.items, total = excluded.total,
+            updated_at = excluded.updated_at
+    """, {**stats, "year": year, "file": volume_file(year), "updated_at": business_day.utcnow().isoformat(" ")})
+    raw.commit()
+    return stats
+
+
+def _years(raw) -> list:
+    """Every year with a registered volume or a file on disk."""
+    years = {row[0] for row in raw.execute(f"SELECT year FROM main.{ArchiveVolume.__tablename__}")}
+    if os.path.isdir(ARCHIVE_DIR):
+        years.update(int(match.group(1)) for match in map(re.compile(r"^orders_(\d{4})\.db$").match,
+                                                           os.listdir(ARCHIVE_DIR)) if match)
+    return sorted(years)
+
+
+def _changed_ids(raw, schema: str, ids_json: str) -> set:
+    """Orders whose hot and archived rows (or lines) differ, in either direction."""
+    changed = set()
+    for table, (columns, order_column) in TABLES.items():
+        cols = _cols(columns)
+        for left, right in (("main", schema), (schema, "main")):
+            changed.update(row[0] for row in raw.execute(f"""
+                SELECT {order_column} FROM (
+                    SELECT {cols} FROM {left}.{table} WHERE {order_column} IN {IDS}
+                    EXCEPT
+                    SELECT {cols} FROM {right}.{table} WHERE {order_column} IN {IDS}
+                )
+            """, (ids_json, ids_json)))
+    return changed
+
+
+def _delete(raw, schema: str, ids_json: str):
+    raw.execute(f"DELETE FROM {schema}.order_items WHERE order_id IN {IDS}", (ids_json,))
+    raw.execute(f"DELETE FROM {schema}.orders WHERE id IN {IDS}", (ids_json,))
+
+
+def _copy(raw, source: str, target: str, ids_json: str):
+    for table, (columns, order_column) in TABLES.items():
+        cols = _cols(columns)
+        raw.execute(
+            f"INSERT OR REPLACE INTO {target}.{table} ({cols}) "
+            f"SELECT {cols} FROM {source}.{table} WHERE {order_column} IN {IDS}",
+            (ids_json,),
+        )
+
+
+def _move_batch(raw, schema: str, ids: list) -> tuple:
+    """Archive one batch of orders. Returns (moved, left hot because they changed meanwhile)."""
+    ids_json = json.dumps(ids)
+
+    # 1. Copy into the archive and commit it there
+    _copy(raw, "main", schema, ids_json)
+    raw.commit()
+
+    # 2. Delete the hot copies that still match, holding off writers while comparing
+    raw.execute("BEGIN IMMEDIATE")
+    try:
+        changed = _changed_ids(raw, schema, ids_json)
+        moved = [order_id for order_id in ids if order_id not in changed]
+        _delete(raw, "main", json.dumps(moved))
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+
+    # 3. Orders edited in between stay hot until the next run
+    if changed:
+        _delete(raw, schema, json.dumps(sorted(changed)))
+        raw.commit()
+    return len(moved), len(changed)
+
+
+# --- Archive / Restore / Verify --- #
+
+
+def archive_orders(older_than_days: int = None, bind=None, batch_size: int = None) -> dict:
+    """Move closed orders older than the cut-off into their year's volume.
+
+    Raises RuntimeError if another archive operation is running.
+    """
+    bind = bind or engine
+    batch_size = batch_size or BATCH_SIZE
+    cutoff = cutoff_day(older_than_days)
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("An archive operation is already running")
+
+    t0 = time.perf_counter()
+    stats = {"cutoff": business_day.iso(cutoff), "moved": 0, "kept_hot": 0, "volumes": {}}
+    proxied = bind.raw_connection()
+    raw = proxied.dbapi_connection
+    try:
+        _repair(raw)
+        # Row ids are not AUTOINCREMENT: keep the newest order and line hot so ids are never reused
+        newest_order = raw.execute("SELECT MAX(id) FROM main.orders").fetchone()[0] or 0
+        newest_line_order = raw.execute(
+            "SELECT order_id FROM main.order_items ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        keep = (newest_order, newest_line_order[0] if newest_line_order else newest_order)
+        due = f"business_date < ? AND {CLOSED} AND id NOT IN (?, ?)"
+        years = [row[0] for row in raw.execute(
+            f"SELECT DISTINCT business_date / 10000 FROM main.orders WHERE {due}", (cutoff, *keep)
+        )]
+
+        for year in years:
+            _prepare(year)
+            _attach(raw, year)
+            try:
+                last_id = 0
+                while True:
+                    ids = [row[0] for row in raw.execute(
+                        f"SELECT id FROM main.orders WHERE {due} AND business_date BETWEEN ? AND ? AND id > ? "
+                        f"ORDER BY id LIMIT ?",
+                        (cutoff, *keep, year * 10000, year * 10000 + 9999, last_id, batch_size),
+                    )]
+                    if not ids:
+                        break
+                    moved, changed = _move_batch(raw, _schema(year), ids)
+                    stats["moved"] += moved
+                    stats["kept_hot"] += changed
+                    last_id = ids[-1]
+                stats["volumes"][year] = _record(raw, year)
+            finally:
+                raw.execute(f"DETACH DATABASE {_schema(year)}")
+    finally:
+        proxied.close()
+        _lock.release()
+
+    stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    log.info("Archived %s order(s) before %s", stats["moved"], stats["cutoff"], extra={
+        "kept_hot": stats["kept_hot"], "ms": stats["ms"],
+    })
+    return stats
+
+
+def restore_order(order_id: int, bind=None) -> dict:
+    """Move one archived order (and its lines) back to the hot tables. Raises LookupError if not archived."""
+    bind = bind or engine
+    with _lock:
+        proxied = bind.raw_connection()
+        raw = proxied.dbapi_connection
+        try:
+            for year in reversed(_years(raw)):
+                schema = _schema(year)
+                _attach(raw, year)
+                try:
+                    if not raw.execute(f"SELECT 1 FROM {schema}.orders WHERE id = ?", (order_id,)).fetchone():
+                        continue
+                    ids_json = json.dumps([order_id])
+                    # Hot copy first; a crash before the archive delete leaves a duplicate, which repair resolves
+                    if not raw.execute("SELECT 1 FROM main.orders WHERE id = ?", (order_id,)).fetchone():
+                        _copy(raw, schema, "main", ids_json)
+                        raw.commit()
+                    _delete(raw, schema, ids_json)
+                    raw.commit()
+                    _record(raw, year)
+                    log.info("Restored order #%s from the %s archive", order_id, year)
+                    return {"order_id": order_id, "year": year}
+                finally:
+                    raw.execute(f"DETACH DATABASE {schema}")
+        finally:
+            proxied.close()
+    raise LookupError(f"Order #{order_id} is not in the archive")
+
+
+def _repair(raw) -> int:
+    """Drop archived copies of orders that are also hot (an interrupted move) and re-record every volume."""
+    removed = 0
+    for year in _years(raw):
+        if not os.path.exists(os.path.join(ARCHIVE_DIR, volume_file(year))):
+            # Keep the registry row as evidence; verify reports the missing file
+            log.error("Archive volume %s is missing", volume_file(year))
+            continue
+        _prepare(year)
+        _attach(raw, year)
+        schema = _schema(year)
+        try:
+            duplicates = [row[0] for row in raw.execute(
+                f"SELECT id FROM {schema}.orders WHERE id IN (SELECT id FROM main.orders)"
+            )]
+            if duplicates:
+                _delete(raw, schema, json.dumps(duplicates))
+                raw.commit()
+                removed += len(duplicates)
+                log.warning("Removed %s order(s) archived in %s but still hot", len(duplicates), year)
+            _record(raw, year)
+        finally:
+            raw.execute(f"DETACH DATABASE {schema}")
+    return removed
+
+
+def repair(bind=None) -> int:
+    """Startup check after a crash mid-move; see ``_repair``. Returns archived duplicates removed."""
+    with _lock:
+        proxied = (bind or engine).raw_connection()
+        try:
+            return _repair(proxied.dbapi_connection)
+        finally:
+            proxied.close()
+
+
+def verify(bind=None) -> dict:
+    """Check every volume's file and contents against the registry, without changing anything."""
+    volumes = []
+    with _lock:
+        proxied = (bind or engine).raw_connection()
+        raw = proxied.dbapi_connection
+        try:
+            registered = {row[0]: row for row in raw.execute(
+                f"SELECT year, file, orders, items, total FROM main.{ArchiveVolume.__tablename__}"
+            )}
+            for year in _years(raw):
+                problems = []
+                path = os.path.join(ARCHIVE_DIR, volume_file(year))
+                result = {"year": year, "file": volume_file(year)}
+                volumes.append(result)
+                if year not in registered:
+                    problems.append("file is not in the registry")
+                if not os.path.exists(path):
+                    result.update(ok=False, problems=problems + ["file is missing"])
+                    continue
+
+                check = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    integrity = check.execute("PRAGMA integrity_check").fetchone()[0]
+                finally:
+                    check.close()
+                if integrity != "ok":
+                    problems.append(f"integrity check failed: {integrity}")
+
+                schema = _schema(year)
+                _attach(raw, year)
+                try:
+                    stats = _volume_stats(raw, schema)
+                    result.update(stats)
+                    if year in registered:
+                        _, _, orders, items, total = registered[year]
+                        if (orders, items, round(total, 2)) != (stats["orders"], stats["items"], stats["total"]):
+                            problems.append(f"registry says {orders} orders / {items} lines / {total:.2f}, "
+                                            f"file has {stats['orders']} / {stats['items']} / {stats['total']:.2f}")
+                    checks = {
+                        "line(s) without their order": f"""SELECT COUNT(*) FROM {schema}.order_items
+                            WHERE order_id NOT IN (SELECT id FROM {schema}.orders)""",
+                        "order(s) also in the hot tables": f"""SELECT COUNT(*) FROM {schema}.orders
+                            WHERE id IN (SELECT id FROM main.orders)""",
+                        "open order(s)": f"SELECT COUNT(*) FROM {schema}.orders WHERE NOT {CLOSED}",
+                        "order(s) from another year": f"""SELECT COUNT(*) FROM {schema}.orders
+                            WHERE business_date / 10000 != {int(year)}""",
+                    }
+                    for label, sql in checks.items():
+                        count = raw.execute(sql).fetchone()[0]
+                        if count:
+                            problems.append(f"{count} {label}")
+                finally:
+                    raw.execute(f"DETACH DATABASE {schema}")
+                result.update(ok=not problems, problems=problems)
+        finally:
+            proxied.close()
+    return {"ok": all(volume["ok"] for volume in volumes), "volumes": volumes}
+
+
+def status(db: Session) -> dict:
+    volumes = db.query(ArchiveVolume).order_by(ArchiveVolume.year).all()
+    return {
+        "directory": ARCHIVE_DIR,
+        "after_days": ARCHIVE_AFTER_DAYS,
+        "cutoff": business_day.iso(cutoff_day()),
+        "volumes": [
+            {
+                "year": volume.year,
+                "file": volume.file,
+                "first_date": business_day.iso(volume.first_day) if volume.first_day else None,
+                "last_date": business_day.iso(volume.last_day) if volume.last_day else None,
+                "orders": volume.orders,
+                "items": volume.items,
+                "total": volume.total,
+                "bytes": os.path.getsize(os.path.join(ARCHIVE_DIR, volume.file))
+                         if os.path.exists(os.path.join(ARCHIVE_DIR, volume.file)) else None,
+            }
+            for volume in volumes
+        ],
+    }
+
+
+if __name__ == "__main__":
+    configure_logging()
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else (None, [])
+    if command == "status":
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            print(json.dumps(status(db), indent=2))
+        finally:
+            db.close()
+    elif command == "run" and len(args) <= 1:
+        result = archive_orders(int(args[0]) if args else None)
+        print(f"Archived {result['moved']} order(s) dated before {result['cutoff']}"
+              f" ({result['kept_hot']} changed during the run and stay hot)")
+    elif command == "verify" and not args:
+        result = verify()
+        for volume in result["volumes"]:
+            print(f"{volume['file']:<20} {'OK' if volume['ok'] else 'FAILED'}  {'; '.join(volume['problems'])}")
+        sys.exit(0 if result["ok"] else 1)
+    elif command == "restore" and len(args) == 1:
+        result = restore_order(int(args[0]))
+        print(f"Restored order #{result['order_id']} from {volume_file(result['year'])}")
+    else:
+        print(__doc__)
+        sys.exit(1)
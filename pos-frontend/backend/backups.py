@@ -0,0 +1,303 @@
+"""Online database backups through SQLite's backup API.
+
+Pages are copied in small batches with a short sleep in between, so cashier
+writes keep going while a backup runs. Every finished backup is checked with
+``PRAGMA quick_check`` before it replaces anything. You can gzip it and the
+old files are pruned per schedule.
+
+    python backups.py run [hourly|daily|monthly]
+    python backups.py list
+    python backups.py verify FILE
+    python backups.py restore FILE      (stop the app first)
+"""
+from database import BASE_DIR, DATABASE_URL
+from log_config import configure_logging
+from datetime import datetime
+import gzip, logging, os, re, shutil, sqlite3, sys, tempfile, threading, time
+
+BACKUP_DIR = os.environ.get("PUB_EXPRESS_BACKUP_DIR", os.path.join(BASE_DIR, "backups"))
+BACKUP_SCHEDULES = [s for s in os.environ.get("PUB_EXPRESS_BACKUP_SCHEDULES", "daily,monthly").split(",") if s]
+BACKUP_COMPRESS = os.environ.get("PUB_EXPRESS_BACKUP_COMPRESS", "0") == "1"
+PAGES_PER_STEP = int(os.environ.get("PUB_EXPRESS_BACKUP_PAGES", 256))
+STEP_SLEEP = float(os.environ.get("PUB_EXPRESS_BACKUP_SLEEP", 0.005))   # seconds between page batches
+CHECK_INTERVAL = 300                                                    # seconds between schedule checks
+MAX_RESTARTS = 3                                                        # stepped copies restarted by writes before copying in one step
+
+# schedule -> (file stamp format, how many files to keep)
+SCHEDULES = {
+    "hourly": ("%Y-%m-%d_%H", int(os.environ.get("PUB_EXPRESS_BACKUP_KEEP_HOURLY", 24))),
+    "daily": ("%Y-%m-%d", int(os.environ.get("PUB_EXPRESS_BACKUP_KEEP_DAILY", 14))),
+    "monthly": ("%Y-%m", int(os.environ.get("PUB_EXPRESS_BACKUP_KEEP_MONTHLY", 12))),
+}
+STAMP_PATTERNS = {
+    "hourly": r"\d{4}-\d{2}-\d{2}_\d{2}",
+    "daily": r"\d{4}-\d{2}-\d{2}",
+    "monthly": r"\d{4}-\d{2}",
+}
+
+log = logging.getLogger("pub_express.backups")
+
+# Last run per schedule, read by /backups/ and /metrics
+last_runs = {}
+_lock = threading.Lock()
+
+
+def database_path() -> str:
+    return DATABASE_URL.replace("sqlite:///", "", 1)
+
+
+def backup_filename(schedule: str, when: datetime = None) -> str:
+    stamp = (when or datetime.now()).strftime(SCHEDULES[schedule][0])
+    # Monthly files keep the old backup_YYYY-MM.db name
+    return f"backup_{stamp}.db"
+
+
+def _schedule_files(schedule: str) -> list:
+    pattern = re.compile(rf"^backup_{STAMP_PATTERNS[schedule]}\.db(\.gz)?$")
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(name for name in os.listdir(BACKUP_DIR) if pattern.match(name))
+
+
+def _existing(schedule: str, when: datetime = None):
+    name = backup_filename(schedule, when)
+    for candidate in (name, name + ".gz"):
+        if os.path.exists(os.path.join(BACKUP_DIR, candidate)):
+            return candidate
+    return None
+
+
+# --- Copy --- #
+
+
+class _Restarting(Exception):
+    pass
+
+
+def copy_database(source_path: str, target_path: str) -> int:
+    """Copy a live database page batch by page batch. Returns the page count."""
+    pages = {"total": 0, "remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        pages["total"] = total
+        if pages["remaining"] is not None and remaining > pages["remaining"]:
+            pages["restarts"] += 1
+            if pages["restarts"] > MAX_RESTARTS:
+                raise _Restarting()
+        pages["remaining"] = remaining
+        if remaining and STEP_SLEEP:
+            time.sleep(STEP_SLEEP)
+
+    source = sqlite3.connect(source_path, timeout=30, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    try:
+        if wal:
+            # Pin one read snapshot for the whole copy. WAL writers aren't blocked by it,
+            # and without it every committed order would restart the copy.
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        try:
+            source.backup(target, pages=PAGES_PER_STEP, progress=progress)
+        except _Restarting:
+            # Rollback-journal databases restart on every write; finish in one locked step
+            source.backup(target, pages=-1)
+    finally:
+        if wal:
+            source.execute("COMMIT")
+        target.close()
+        source.close()
+    return pages["total"]
+
+
+def _check(path: str):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise ValueError(f"integrity check failed: {result}")
+    return orders
+
+
+def run_backup(schedule: str, compress: bool = None, source_path: str = None) -> dict:
+    """Take one backup for a schedule, verify it, and prune that schedule's old files."""
+    compress = BACKUP_COMPRESS if compress is None else compress
+    source_path = source_path or database_path()
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    filename = backup_filename(schedule) + (".gz" if compress else "")
+    target = os.path.join(BACKUP_DIR, filename)
+
+    t0 = time.perf_counter()
+    fd, partial = tempfile.mkstemp(suffix=".part", dir=BACKUP_DIR)
+    os.close(fd)
+    try:
+        pages = copy_database(source_path, partial)
+        orders = _check(partial)
+        db_bytes = os.path.getsize(partial)
+        if compress:
+            with open(partial, "rb") as src, gzip.open(partial + ".gz", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(partial)
+            partial += ".gz"
+        os.replace(partial, target)
+        # A rerun in the other format replaces the earlier file for the same period
+        other = target[:-3] if compress else target + ".gz"
+        if os.path.exists(other):
+            os.remove(other)
+    except Exception:
+        for leftover in (partial, partial + ".gz"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+
+    stats = {
+        "schedule": schedule,
+        "file": filename,
+        "pages": pages,
+        "orders": orders,
+        "db_bytes": db_bytes,
+        "file_bytes": os.path.getsize(target),
+        "ms": round((time.perf_counter() - t0) * 1000, 1),
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    with _lock:
+        last_runs[schedule] = stats
+    pruned = prune(schedule)
+    log.info("Backup created: %s", filename, extra={
+        "bytes": stats["file_bytes"], "ms": stats["ms"], "pruned": len(pruned),
+    })
+    return stats
+
+
+def prune(schedule: str) -> list:
+    keep = SCHEDULES[schedule][1]
+    files = _schedule_files(schedule)
+    removed = files[:-keep] if keep > 0 else []
+    for name in removed:
+        os.remove(os.path.join(BACKUP_DIR, name))
+    return removed
+
+
+def run_due_backups(schedules=None) -> list:
+    """Take any scheduled backup whose file for the current period is missing."""
+    taken = []
+    for schedule in schedules or BACKUP_SCHEDULES:
+        if schedule not in SCHEDULES:
+            log.warning("Unknown backup schedule ignored: %s", schedule)
+            continue
+        if _existing(schedule):
+            continue
+        taken.append(run_backup(schedule))
+    return taken
+
+
+def _scheduler_loop(stop: threading.Event):
+    while not stop.wait(CHECK_INTERVAL):
+        try:
+            run_due_backups()
+        except Exception:
+            log.exception("Scheduled backup failed")
+
+
+def start_scheduler() -> threading.Event:
+    """Check the schedules every few minutes on a daemon thread. Set the returned event to stop it."""
+    stop = threading.Event()
+    threading.Thread(target=_scheduler_loop, args=(stop,), name="backup-scheduler", daemon=True).start()
+    return stop
+
+
+def list_backups() -> list:
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    files = []
+    for name in sorted(os.listdir(BACKUP_DIR)):
+        if not re.match(r"^backup_.+\.db(\.gz)?$", name):
+            continue
+        path = os.path.join(BACKUP_DIR, name)
+        files.append({
+            "file": name,
+            "bytes": os.path.getsize(path),
+            "modified": datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec="seconds"),
+        })
+    return files
+
+
+def backup_status() -> dict:
+    with _lock:
+        runs = {schedule: dict(stats) for schedule, stats in last_runs.items()}
+    return {
+        "directory": BACKUP_DIR,
+        "schedules": BACKUP_SCHEDULES,
+        "compress": BACKUP_COMPRESS,
+        "last_runs": runs,
+        "files": list_backups(),
+    }
+
+
+# --- Verify / Restore --- #
+
+
+def _resolve(path: str) -> str:
+    if os.path.exists(path):
+        return path
+    return os.path.join(BACKUP_DIR, path)
+
+
+def _unpacked(path: str):
+    """Path of a plain database file for a backup, decompressing .gz into a temp file."""
+    if not path.endswith(".gz"):
+        return path, False
+    fd, plain = tempfile.mkstemp(suffix=".db", prefix="pos_restore_")
+    with os.fdopen(fd, "wb") as dst, gzip.open(path, "rb") as src:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return plain, True
+
+
+def verify_backup(path: str) -> int:
+    """Integrity-check a backup file. Returns its order count; raises ValueError if damaged."""
+    plain, temporary = _unpacked(_resolve(path))
+    try:
+        return _check(plain)
+    finally:
+        if temporary:
+            os.remove(plain)
+
+
+def restore_backup(path: str, target_path: str = None) -> int:
+    """Verify a backup and copy it over the live database. Stop the app first."""
+    target_path = target_path or database_path()
+    plain, temporary = _unpacked(_resolve(path))
+    try:
+        orders = _check(plain)
+        # Keep what is being replaced, in case the wrong file was picked
+        if os.path.exists(target_path):
+            safety = os.path.join(BACKUP_DIR, f"pre_restore_{datetime.now():%Y-%m-%d_%H%M%S}.db")
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            copy_database(target_path, safety)
+            log.info("Current database saved as %s", safety)
+        copy_database(plain, target_path)
+    finally:
+        if temporary:
+            os.remove(plain)
+    return orders
+
+
+if __name__ == "__main__":
+    configure_logging()
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else (None, [])
+    if command == "run":
+        for schedule in args or BACKUP_SCHEDULES:
+            run_backup(schedule)
+    elif command == "list":
+        for backup in list_backups():
+            print(f"{backup['file']:<32} {backup['bytes']:>12}  {backup['modified']}")
+    elif command == "verify" and len(args) == 1:
+        print(f"OK: {verify_backup(args[0])} order(s)")
+    elif command == "restore" and len(args) == 1:
+        print(f"Restored {restore_backup(args[0])} order(s) from {args[0]}")
+    else:
+        print(__doc__)
+        sys.exit(1)
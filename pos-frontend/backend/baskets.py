@@ -0,0 +1,268 @@
+"""Market-basket co-occurrence: which menu items sell together, for bundle pricing.
+
+``daily_item_pairs`` is a sparse co-occurrence matrix per business date.
+For every paid, non-void order it holds:
+- one count for each pair of distinct items on the order;
+- one count on the diagonal for each item;
+- one count under (0, 0) for the order itself.
+
+``rollup_update`` (rollups.py) keeps it current. It diffs the order's
+basket before and after the change, so paying an order adds its pairs,
+canceling it takes them away, and an item added to a paid order only
+touches that item's pairs. ``rebuild`` recomputes the matrix from order
+history with at most ``MAX_PAIRS`` counts in memory at once. It runs day by
+day as part of ``rebuild_rollups``, and in one go with
+``python baskets.py rebuild``.
+
+``item_partners`` reads one row for each partner and day. For each
+partner it reports support, confidence and lift over any date range.
+
+    PUB_EXPRESS_BASKET_MAX_PAIRS   pair counts held in memory by a rebuild before they are written (default 200000)
+
+    python baskets.py rebuild [MAX_PAIRS]
+"""
+from sqlalchemy import select, func, delete, case, distinct, bindparam, and_, or_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, aliased
+from database import SessionLocal, Order, OrderItem, MenuItem, DailyItemPair
+from reports import rollups_ready, in_business_days, lines_in_business_days
+from itertools import combinations
+import archive, business_day
+import logging, os, sys, time
+
+log = logging.getLogger("pub_express.baskets")
+
+MAX_PAIRS = int(os.environ.get("PUB_EXPRESS_BASKET_MAX_PAIRS", 200_000))
+FETCH_CHUNK = 10_000
+SORTS = ("orders", "lift")
+
+
+# --- Maintenance --- #
+
+
+def basket_counts(business_date: int, items) -> dict:
+    """(item_a, item_b, business_date) -> 1 for every cell one basket adds to."""
+    items = sorted(items)
+    counts = {(0, 0, business_date): 1}
+    for item in items:
+        counts[(item, item, business_date)] = 1
+    for a, b in combinations(items, 2):
+        counts[(a, b, business_date)] = 1
+    return counts
+
+
+def _upsert(db: Session, counts: dict):
+    stmt = insert(DailyItemPair.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["item_a", "item_b", "business_date"],
+        set_={"orders": DailyItemPair.__table__.c.orders + stmt.excluded.orders},
+    )
+    db.execute(stmt, [
+        {"item_a": a, "item_b": b, "business_date": day, "orders": count}
+        for (a, b, day), count in counts.items()
+    ])
+
+
+def apply(db: Session, before, after):
+    """Move the matrix from one basket to another. Each is (business date, item ids) or None."""
+    if before == after:
+        return
+    delta = {}
+    for basket, sign in ((before, -1), (after, 1)):
+        if basket is not None:
+            for key in basket_counts(*basket):
+                delta[key] = delta.get(key, 0) + sign
+    delta = {key: count for key, count in delta.items() if count}
+    if not delta:
+        return
+    _upsert(db, delta)
+
+    emptied = [key for key, count in delta.items() if count < 0]
+    if emptied:
+        # Keep the matrix sparse: a cell no basket holds any more goes away
+        table = DailyItemPair.__table__
+        db.execute(
+            delete(table).where(
+                table.c.item_a == bindparam("a"), table.c.item_b == bindparam("b"),
+                table.c.business_date == bindparam("day"), table.c.orders <= 0,
+            ),
+            [{"a": a, "b": b, "day": day} for a, b, day in emptied],
+        )
+
+
+# --- Rebuild --- #
+
+
+def _paid_lines(db: Session, start_day: int = None, end_day: int = None):
+    query = (
+        select(Order.business_date, OrderItem.order_id, OrderItem.menu_item_id)
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(Order.is_paid == True, Order.cancel_reason.is_(None), OrderItem.menu_item_id.isnot(None))
+        .order_by(OrderItem.order_id)
+    )
+    if start_day is not None:
+        query = query.where(in_business_days(start_day, end_day), lines_in_business_days(db, start_day, end_day))
+    return db.execute(query, execution_options={"yield_per": FETCH_CHUNK})
+
+
+def rebuild(db: Session, max_pairs: int = None, start_day: int = None, end_day: int = None) -> dict:
+    """Recompute the matrix for a range of business dates (all of them by default),
+    archived orders included. Doesn't commit.
+
+    Lines are read in order id order, one basket at a time. Counts add up in
+    memory and are written out whenever ``max_pairs`` distinct cells are
+    held, so memory stays bounded however long the history is.
+    """
+    max_pairs = max_pairs or MAX_PAIRS
+    t0 = time.perf_counter()
+    archive.include(db, start_day, end_day)
+    cells = delete(DailyItemPair)
+    if start_day is not None:
+        cells = cells.where(DailyItemPair.business_date.between(start_day, end_day))
+    db.execute(cells)
+
+    counts, orders, flushes = {}, 0, 0
+
+    def add(business_date, items):
+        for key in basket_counts(business_date, items):
+            counts[key] = counts.get(key, 0) + 1
+
+    current, current_day, items = None, None, set()
+    for business_date, order_id, menu_item_id in _paid_lines(db, start_day, end_day):
+        if order_id != current:
+            if items:
+                add(current_day, items)
+                orders += 1
+            current, current_day, items = order_id, business_date, set()
+            if len(counts) >= max_pairs:
+                _upsert(db, counts)
+                counts.clear()
+                flushes += 1
+        items.add(menu_item_id)
+    if items:
+        add(current_day, items)
+        orders += 1
+    if counts:
+        _upsert(db, counts)
+        flushes += 1
+
+    stats = {"orders": orders, "cells": 0, "flushes": flushes, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+    if start_day is None:
+        stats["cells"] = db.query(func.count()).select_from(DailyItemPair).scalar()
+        log.info("Item pair matrix rebuilt", extra=stats)
+    return stats
+
+
+# --- Reports --- #
+
+
+def _counts_from_matrix(db: Session, item_id: int, start_day: int, end_day: int):
+    table = DailyItemPair
+    in_range = table.business_date.between(start_day, end_day)
+    partner = case((table.item_a == item_id, table.item_b), else_=table.item_a)
+    pairs = dict(
+        db.query(partner, func.sum(table.orders))
+        .filter(in_range, or_(table.item_a == item_id, table.item_b == item_id), table.item_a != table.item_b)
+        .group_by(partner)
+        .having(func.sum(table.orders) > 0)
+        .all()
+    )
+    wanted = [0, item_id, *pairs]
+    singles = dict(
+        db.query(table.item_a, func.sum(table.orders))
+        .filter(in_range, table.item_a.in_(wanted), table.item_b == table.item_a)
+        .group_by(table.item_a)
+        .all()
+    )
+    return singles.pop(0, 0) or 0, singles, pairs
+
+
+def _counts_from_orders(db: Session, item_id: int, start_day: int, end_day: int):
+    """The same counts straight from order lines, for before the rollups are ready."""
+    archive.include(db, start_day, end_day)
+    valid = and_(
+        Order.is_paid == True, Order.cancel_reason.is_(None), in_business_days(start_day, end_day),
+        OrderItem.menu_item_id.isnot(None),
+    )
+    baskets = (
+        db.query(func.count(distinct(OrderItem.order_id)))
+        .join(Order, Order.id == OrderItem.order_id).filter(valid).scalar()
+    )
+    other = aliased(OrderItem)
+    pairs = dict(
+        db.query(other.menu_item_id, func.count(distinct(other.order_id)))
+        .select_from(OrderItem)
+        .join(Order, Order.id == OrderItem.order_id)
+        .join(other, and_(other.order_id == OrderItem.order_id, other.menu_item_id != item_id))
+        .filter(valid, OrderItem.menu_item_id == item_id, other.menu_item_id.isnot(None))
+        .group_by(other.menu_item_id)
+        .all()
+    )
+    singles = dict(
+        db.query(OrderItem.menu_item_id, func.count(distinct(OrderItem.order_id)))
+        .join(Order, Order.id == OrderItem.order_id)
+        .filter(valid, OrderItem.menu_item_id.in_([item_id, *pairs]))
+        .group_by(OrderItem.menu_item_id)
+        .all()
+    )
+    return baskets or 0, singles, pairs
+
+
+def item_partners(db: Session, item_id: int, start_day: int, end_day: int,
+                  limit: int = 10, sort: str = "orders", min_orders: int = 1) -> dict:
+    """Top ``limit`` items bought with ``item_id`` in the range, by co-occurring orders or by lift.
+
+    support = orders with both / all orders; confidence = orders with both /
+    orders with the item; lift = confidence / the partner's own support.
+    """
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort. Use one of: {', '.join(SORTS)}")
+    counts = _counts_from_matrix if rollups_ready.is_set() else _counts_from_orders
+    baskets, singles, pairs = counts(db, item_id, start_day, end_day)
+
+    item_orders = singles.get(item_id, 0)
+    partners = []
+    for partner_id, together in pairs.items():
+        if together < min_orders:
+            continue
+        confidence = together / item_orders if item_orders else 0.0
+        partner_support = singles.get(partner_id, 0) / baskets if baskets else 0.0
+        partners.append({
+            "id": partner_id,
+            "orders": together,
+            "support": round(together / baskets, 4) if baskets else 0.0,
+            "confidence": round(confidence, 4),
+            "lift": round(confidence / partner_support, 3) if partner_support else 0.0,
+        })
+    partners.sort(key=lambda partner: (-partner[sort], -partner["orders"], partner["id"]))
+    partners = partners[:limit]
+
+    names = dict(db.query(MenuItem.id, MenuItem.name).filter(MenuItem.id.in_([item_id, *(p["id"] for p in partners)])))
+    for partner in partners:
+        partner["name"] = names.get(partner["id"])
+    return {
+        "item": {
+            "id": item_id,
+            "name": names.get(item_id),
+            "orders": item_orders,
+            "support": round(item_orders / baskets, 4) if baskets else 0.0,
+        },
+        "orders": baskets,
+        "start_date": business_day.iso(start_day),
+        "end_date": business_day.iso(end_day),
+        "partners": partners,
+    }
+
+
+if __name__ == "__main__":
+    if not sys.argv[1:] or sys.argv[1] != "rebuild" or len(sys.argv) > 3:
+        print("Usage: python baskets.py rebuild [MAX_PAIRS]")
+        sys.exit(1)
+    db = SessionLocal()
+    try:
+        stats = rebuild(db, int(sys.argv[2]) if len(sys.argv) == 3 else None)
+        db.commit()
+        print(f"Rebuilt item pairs from {stats['orders']} order(s): {stats['cells']} cell(s), "
+              f"{stats['flushes']} write(s), {stats['ms']:.0f}ms")
+    finally:
+        db.close()
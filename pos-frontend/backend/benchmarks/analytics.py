@@ -0,0 +1,176 @@
+"""Columnar analytics store vs the equivalent SQL: heatmap, item-by-hour and group-by reports.
+
+Run from the backend folder:  python -m benchmarks.analytics --orders 300000 --days 365
+
+Seeds a throwaway database and builds the analytics store from it. Then it
+times three reports over the whole range and over the last 30 days, each
+answered two ways:
+
+- the hour x weekday heatmap of paid sales;
+- the item x hour matrix of paid quantity;
+- paid sales grouped by cashier and order type.
+
+The SQL side groups in SQLite by business date and UTC quarter-hour (or by
+item and quarter-hour) and folds the rows into local hours in Python, the
+way _paid_by_hour does. Both sides must give the same numbers. Finally it
+takes ``--new-orders`` orders through create_order and pays half of them,
+then times the incremental refresh that picks them up.
+"""
+from sqlalchemy import select, func, cast, Integer
+from database import Order, OrderItem
+from reports import line_revenue
+from schemas import OrderCreate, OrderItemCreate, PayData
+from benchmarks.seed import make_session_factory, seed, remove_database
+from datetime import timedelta
+import analytics, business_day
+import argparse, random, shutil, statistics, tempfile, time
+
+QUARTER = cast(func.strftime("%s", Order.created_at), Integer) // analytics.QUARTER
+
+
+def _local(quarter):
+    return business_day.to_local(analytics.EPOCH + timedelta(seconds=quarter * analytics.QUARTER))
+
+
+def sql_heatmap(db, start_day, end_day):
+    rows = db.execute(
+        select(Order.business_date, QUARTER, func.sum(line_revenue()))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.is_paid == True, Order.business_date.between(start_day, end_day))
+        .group_by(Order.business_date, QUARTER)
+    )
+    cells = [[0.0] * 24 for _ in range(7)]
+    for day, quarter, sales in rows:
+        cells[business_day.to_date(day).weekday()][_local(quarter).hour] += sales or 0.0
+    hours = analytics._hour_order()
+    return [[round(row[hour], 2) for hour in hours] for row in cells]
+
+
+def sql_item_hours(db, start_day, end_day):
+    rows = db.execute(
+        select(OrderItem.menu_item_id, QUARTER, func.sum(OrderItem.quantity))
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(Order.is_paid == True, Order.business_date.between(start_day, end_day))
+        .group_by(OrderItem.menu_item_id, QUARTER)
+    )
+    items = {}
+    for item_id, quarter, quantity in rows:
+        items.setdefault(item_id, [0] * 24)[_local(quarter).hour] += quantity
+    hours = analytics._hour_order()
+    return {item_id: [row[hour] for hour in hours] for item_id, row in items.items()}
+
+
+def sql_group(db, start_day, end_day):
+    rows = db.execute(
+        select(Order.cashier, Order.type, func.sum(line_revenue()))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.is_paid == True, Order.business_date.between(start_day, end_day))
+        .group_by(Order.cashier, Order.type)
+    )
+    return {(cashier, order_type): round(sales, 2) for cashier, order_type, sales in rows}
+
+
+def store_heatmap(db, start_day, end_day):
+    return analytics.heatmap(db, start_day, end_day)["data"]
+
+
+def store_item_hours(db, start_day, end_day):
+    return {item["id"]: item["data"] for item in analytics.item_hour_matrix(db, start_day, end_day)["items"]}
+
+
+def store_group(db, start_day, end_day):
+    return {(row["cashier"], row["order_type"]): row["sales"]
+            for row in analytics.group_by(db, ["cashier", "order_type"], start_day, end_day)}
+
+
+def same(a, b):
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return abs(a - b) < 0.01
+
+
+def timed(session_factory, fn, args, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        db = session_factory()
+        try:
+            t0 = time.perf_counter()
+            result = fn(db, *args)
+            samples.append(time.perf_counter() - t0)
+        finally:
+            db.close()
+    return statistics.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=300_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--new-orders", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    import main as app_main
+
+    engine, session_factory, path = make_session_factory()
+    analytics.ANALYTICS_DIR = tempfile.mkdtemp(prefix="pos_analytics_")
+    try:
+        start_day, end_day = seed(engine, orders=args.orders, days=args.days)
+        month_start = business_day.from_date(business_day.to_date(end_day) - timedelta(days=29))
+
+        db = session_factory()
+        try:
+            stats = analytics.rebuild(db)
+        finally:
+            db.close()
+        print(f"{args.orders} orders over {args.days} days: built {stats['rows']} rows in {stats['ms']:.0f}ms, "
+              f"{analytics.status()['bytes'] / 1e6:.1f} MB on disk")
+
+        reports = {
+            "heatmap": (sql_heatmap, store_heatmap),
+            "item x hour": (sql_item_hours, store_item_hours),
+            "group by": (sql_group, store_group),
+        }
+        print(f"{'report':>12}  {'range':>6}  {'sql':>9}  {'store':>9}  {'speedup':>7}  {'same':>4}")
+        for label, (first, last) in (("all", (start_day, end_day)), ("30d", (month_start, end_day))):
+            for name, (sql_fn, store_fn) in reports.items():
+                sql_ms, sql_result = timed(session_factory, sql_fn, (first, last), args.repeat)
+                store_ms, store_result = timed(session_factory, store_fn, (first, last), args.repeat)
+                print(f"{name:>12}  {label:>6}  {sql_ms:>7.1f}ms  {store_ms:>7.1f}ms  {sql_ms / store_ms:>6.1f}x  "
+                      f"{'yes' if same(sql_result, store_result) else 'NO':>4}")
+
+        app_main.menu_cache.invalidate()
+        rng = random.Random(5)
+        for n in range(args.new_orders):
+            db = session_factory()
+            try:
+                order = app_main.create_order(OrderCreate(items=[
+                    OrderItemCreate(menu_item_id=rng.randint(1, 60), quantity=rng.randint(1, 3)) for _ in range(3)
+                ]), db)
+                if n % 2 == 0:
+                    app_main.mark_order_paid(order.id, PayData(paid=10_000), db)
+            finally:
+                db.close()
+
+        db = session_factory()
+        try:
+            stats = analytics.refresh(db)
+        finally:
+            db.close()
+        _, idle_ms = timed(session_factory, lambda db: analytics.refresh(db)["ms"], (), args.repeat)
+        print(f"refresh after {args.new_orders} new orders: {stats['appended']} rows appended, "
+              f"{stats['dead']} marked dead in {stats['ms']:.1f}ms; with nothing new {idle_ms:.1f}ms")
+        sql_result = timed(session_factory, sql_heatmap, (start_day, end_day + 1), 1)[1]
+        store_result = timed(session_factory, store_heatmap, (start_day, end_day + 1), 1)[1]
+        print("heatmap after refresh:", "same" if same(sql_result, store_result) else "DIFFERENT")
+    finally:
+        analytics.close()
+        engine.dispose()
+        remove_database(path)
+        shutil.rmtree(analytics.ANALYTICS_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Hot-table query times before and after archiving, and the cost of reading through the archive.
+
+Run from the backend folder:  python -m benchmarks.archive_tiering --orders 300000 --days 1095
+
+Seeds a throwaway database spread over ``--days`` days and times a few
+queries: the unfiltered order count and first page from get_orders, the
+orphan scan from cleanup_orphan_order_items, a summary of the last 30
+days, and a raw summary of the oldest year. The last one has to ATTACH the
+archive once it has been moved. Everything older than ``--keep-days`` is
+then archived and the same queries run again. The summaries must come out
+identical before and after.
+"""
+from sqlalchemy import func
+from database import Order, OrderItem, MenuItem
+from reports import summarize_orders
+from benchmarks.seed import make_session_factory, seed, remove_database
+import archive, business_day, order_payloads
+import argparse, shutil, statistics, tempfile, time
+
+
+def timed(session_factory, fn, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        db = session_factory()
+        try:
+            t0 = time.perf_counter()
+            result = fn(db)
+            samples.append(time.perf_counter() - t0)
+        finally:
+            db.close()
+    return statistics.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=300_000)
+    parser.add_argument("--days", type=int, default=1095)
+    parser.add_argument("--keep-days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine, session_factory, path = make_session_factory()
+    archive.ARCHIVE_DIR = tempfile.mkdtemp(prefix="pos_archive_")
+    try:
+        start_day, end_day = seed(engine, orders=args.orders, days=args.days)
+        recent_day = business_day.from_date(business_day.to_date(end_day).replace(day=1))
+        oldest_year_end = business_day.to_date(start_day).year * 10000 + 1231
+
+        queries = {
+            "order count": lambda db: db.query(func.count(Order.id)).scalar(),
+            "first page": lambda db: len(order_payloads.list_orders(db, [], "summary", 50)[0]),
+            "orphan scan": lambda db: db.query(func.count(OrderItem.id))
+                .filter(~OrderItem.menu_item_id.in_(db.query(MenuItem.id))).scalar(),
+            "last month": lambda db: summarize_orders(db, recent_day, end_day),
+            "oldest year": lambda db: summarize_orders(db, start_day, oldest_year_end),
+        }
+
+        before = {name: timed(session_factory, fn, args.repeat) for name, fn in queries.items()}
+        moved = archive.archive_orders(args.keep_days, bind=engine)
+        after = {name: timed(session_factory, fn, args.repeat) for name, fn in queries.items()}
+
+        print(f"{args.orders} orders over {args.days} days; archived {moved['moved']} older than "
+              f"{moved['cutoff']} in {moved['ms']:.0f}ms")
+        print(f"{'query':>12}  {'before':>9}  {'after':>9}  {'same result':>11}")
+        for name in queries:
+            (ms_before, result_before), (ms_after, result_after) = before[name], after[name]
+            same = "yes" if result_before == result_after else "no"
+            if name in ("order count", "orphan scan"):
+                same = "-"  # these are meant to shrink
+            print(f"{name:>12}  {ms_before:>7.1f}ms  {ms_after:>7.1f}ms  {same:>11}")
+        print("verify:", "ok" if archive.verify(bind=engine)["ok"] else "FAILED")
+    finally:
+        engine.dispose()
+        remove_database(path)
+        shutil.rmtree(archive.ARCHIVE_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
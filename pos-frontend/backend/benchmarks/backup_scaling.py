@@ -0,0 +1,59 @@
+"""Backup duration and size as the database grows, with cashier writes running alongside.
+
+Run from the backend folder:  python -m benchmarks.backup_scaling --sizes 10000 50000 200000
+"""
+from sqlalchemy import insert
+from database import Order
+from benchmarks.seed import make_session_factory, seed, remove_database
+from datetime import datetime
+import argparse, os, shutil, tempfile, threading, time
+import backups
+
+
+def write_while(engine, done: threading.Event):
+    """Insert orders one commit at a time until done; returns per-write latencies."""
+    samples = []
+    while not done.is_set():
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(insert(Order), {"created_at": datetime.now(), "total": 100.0, "status": "held"})
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 200_000])
+    args = parser.parse_args()
+
+    backups.BACKUP_DIR = tempfile.mkdtemp(prefix="pos_backups_")
+    print(f"{'orders':>8}  {'db MB':>7}  {'backup ms':>9}  {'gz MB':>6}  {'gz ms':>7}  {'writes':>6}  {'max write ms':>12}")
+    try:
+        for size in args.sizes:
+            engine, _, path = make_session_factory()
+            try:
+                seed(engine, orders=size)
+
+                done = threading.Event()
+                samples = []
+                writer = threading.Thread(target=lambda: samples.extend(write_while(engine, done)))
+                writer.start()
+                plain = backups.run_backup("daily", compress=False, source_path=path)
+                done.set()
+                writer.join()
+
+                packed = backups.run_backup("monthly", compress=True, source_path=path)
+                print(f"{size:>8}  {plain['db_bytes'] / 1e6:>7.1f}  {plain['ms']:>9.0f}  "
+                      f"{packed['file_bytes'] / 1e6:>6.1f}  {packed['ms']:>7.0f}  "
+                      f"{len(samples):>6}  {max(samples, default=0) * 1000:>12.1f}")
+                for name in os.listdir(backups.BACKUP_DIR):
+                    os.remove(os.path.join(backups.BACKUP_DIR, name))
+            finally:
+                engine.dispose()
+                remove_database(path)
+    finally:
+        shutil.rmtree(backups.BACKUP_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Item-pair report: co-occurrence matrix vs a self-join over order lines.
+
+Run from the backend folder:  python -m benchmarks.baskets --orders 300000 --days 365
+
+Seeds a throwaway database and rebuilds the pair matrix twice: once with
+the default ``--max-pairs`` and once with a small one. For each it reports
+the peak Python memory (tracemalloc) and how many writes it took. Then it
+answers "what sells with item X" for a few items, over the last 30 days
+and over the whole range. Each answer comes from baskets.item_partners on
+the matrix and from the self-join fallback, and both must agree. Finishes
+with the mark_order_paid p50, which now includes updating the matrix.
+"""
+from schemas import OrderCreate, OrderItemCreate, PayData
+from benchmarks.seed import make_session_factory, seed, remove_database
+from reports import rollups_ready
+from datetime import timedelta
+import baskets, business_day
+import argparse, random, statistics, time, tracemalloc
+
+
+def rebuild(session_factory, max_pairs):
+    db = session_factory()
+    try:
+        tracemalloc.start()
+        stats = baskets.rebuild(db, max_pairs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        db.commit()
+    finally:
+        db.close()
+    return stats, peak
+
+
+def partners(session_factory, item_id, start_day, end_day, from_matrix, repeat):
+    if from_matrix:
+        rollups_ready.set()
+    else:
+        rollups_ready.clear()
+    samples, result = [], None
+    for _ in range(repeat):
+        db = session_factory()
+        try:
+            t0 = time.perf_counter()
+            result = baskets.item_partners(db, item_id, start_day, end_day, limit=10)
+            samples.append(time.perf_counter() - t0)
+        finally:
+            db.close()
+    return statistics.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=300_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--max-pairs", type=int, default=baskets.MAX_PAIRS)
+    parser.add_argument("--small-max-pairs", type=int, default=5_000)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--pays", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import main as app_main
+
+    engine, session_factory, path = make_session_factory()
+    try:
+        start_day, end_day = seed(engine, orders=args.orders, days=args.days)
+        month_start = business_day.from_date(business_day.to_date(end_day) - timedelta(days=29))
+
+        print(f"{args.orders} orders over {args.days} days")
+        print(f"{'max pairs':>10}  {'cells':>9}  {'writes':>6}  {'rebuild':>9}  {'peak':>8}")
+        for max_pairs in (args.max_pairs, args.small_max_pairs):
+            stats, peak = rebuild(session_factory, max_pairs)
+            print(f"{max_pairs:>10}  {stats['cells']:>9}  {stats['flushes']:>6}  {stats['ms']:>7.0f}ms  "
+                  f"{peak / 1e6:>6.1f}MB")
+
+        print(f"{'item':>5}  {'range':>6}  {'self-join':>10}  {'matrix':>9}  {'speedup':>7}  {'same':>4}")
+        for item_id in random.Random(3).sample(range(1, 61), args.items):
+            for label, first in (("all", start_day), ("30d", month_start)):
+                join_ms, join_result = partners(session_factory, item_id, first, end_day, False, args.repeat)
+                matrix_ms, matrix_result = partners(session_factory, item_id, first, end_day, True, args.repeat)
+                print(f"{item_id:>5}  {label:>6}  {join_ms:>8.1f}ms  {matrix_ms:>7.1f}ms  "
+                      f"{join_ms / matrix_ms:>6.1f}x  {'yes' if join_result == matrix_result else 'NO':>4}")
+
+        app_main.menu_cache.invalidate()
+        rng = random.Random(5)
+        samples = []
+        for _ in range(args.pays):
+            db = session_factory()
+            try:
+                order = app_main.create_order(OrderCreate(items=[
+                    OrderItemCreate(menu_item_id=rng.randint(1, 60), quantity=1) for _ in range(4)
+                ]), db)
+                t0 = time.perf_counter()
+                app_main.mark_order_paid(order.id, PayData(paid=10_000), db)
+                samples.append(time.perf_counter() - t0)
+            finally:
+                db.close()
+        print(f"mark_order_paid p50 with the pair matrix: {statistics.median(samples) * 1000:.2f}ms")
+    finally:
+        engine.dispose()
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
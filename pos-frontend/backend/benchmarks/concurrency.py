@@ -0,0 +1,87 @@
+"""Checkout latency while a long orders-xlsx export runs, legacy vs tuned engine profile.
+
+Run from the backend folder:  python -m benchmarks.concurrency --orders 100000 --writers 4
+
+For each profile this seeds a fresh database, starts the export of the
+whole range (one long read transaction), and has several threads post
+orders through create_order until the export finishes.
+"""
+from sqlalchemy.exc import OperationalError
+from schemas import OrderCreate, OrderItemCreate
+from exports import write_orders_xlsx
+from benchmarks.seed import make_session_factory, seed, remove_database
+import argparse, statistics, tempfile, threading, time
+
+
+def run_profile(profile, orders, writers, lines):
+    import main as app_main
+    app_main.menu_cache.invalidate()
+
+    engine, session_factory, path = make_session_factory(profile=profile)
+    try:
+        start, end = seed(engine, orders=orders)
+        payload = OrderCreate(items=[OrderItemCreate(menu_item_id=n + 1, quantity=1) for n in range(lines)])
+        latencies, errors = [], []
+        export_done = threading.Event()
+        export_time = []
+
+        def export():
+            db = session_factory()
+            try:
+                t0 = time.perf_counter()
+                with tempfile.TemporaryFile() as handle:
+                    write_orders_xlsx(db, start, end, handle)
+                export_time.append(time.perf_counter() - t0)
+            finally:
+                db.close()
+                export_done.set()
+
+        def writer():
+            while not export_done.is_set():
+                db = session_factory()
+                t0 = time.perf_counter()
+                try:
+                    app_main.create_order(payload, db)
+                    latencies.append(time.perf_counter() - t0)
+                except OperationalError as e:
+                    db.rollback()
+                    errors.append(str(e.orig))
+                finally:
+                    db.close()
+
+        threads = [threading.Thread(target=export)] + [threading.Thread(target=writer) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        latencies.sort()
+        return {
+            "export_s": export_time[0] if export_time else float("nan"),
+            "orders": len(latencies),
+            "errors": len(errors),
+            "p50_ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else float("nan"),
+            "max_ms": latencies[-1] * 1000 if latencies else float("nan"),
+        }
+    finally:
+        engine.dispose()
+        remove_database(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'profile':>8}  {'export':>8}  {'orders':>7}  {'errors':>6}  {'p50':>9}  {'p95':>9}  {'max':>9}")
+    for profile in ("legacy", "tuned"):
+        r = run_profile(profile, args.orders, args.writers, args.lines)
+        print(f"{profile:>8}  {r['export_s']:>7.1f}s  {r['orders']:>7}  {r['errors']:>6}  "
+              f"{r['p50_ms']:>7.1f}ms  {r['p95_ms']:>7.1f}ms  {r['max_ms']:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
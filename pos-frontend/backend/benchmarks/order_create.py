@@ -0,0 +1,68 @@
+"""Per-order latency of create_order at 1, 10 and 50 lines, old loop vs batched path.
+
+Run from the backend folder:  python -m benchmarks.order_create --orders 200
+"""
+from database import MenuItem, Order, OrderItem
+from schemas import OrderCreate, OrderItemCreate
+from benchmarks.seed import make_session_factory, seed, remove_database
+import argparse, statistics, time
+
+
+def legacy_create_order(order_data, db):
+    total = 0
+    order = Order(notes=order_data.notes, type=order_data.type,
+                  discount=order_data.discount or 0.0, cashier=order_data.cashier)
+    db.add(order)
+    db.flush()
+    for item in order_data.items:
+        menu_item = db.query(MenuItem).filter(MenuItem.id == item.menu_item_id).first()
+        total += menu_item.price * item.quantity
+        db.add(OrderItem(order_id=order.id, menu_item_id=menu_item.id, quantity=item.quantity))
+    order.total = total
+    order.paid = order_data.paid_amount or 0.0
+    order.is_paid = order.paid >= total - (order_data.discount or 0.0)
+    db.commit()
+    db.refresh(order)
+    return order
+
+
+def measure(create, session_factory, lines, orders):
+    payload = OrderCreate(items=[
+        OrderItemCreate(menu_item_id=(n % 60) + 1, quantity=1) for n in range(lines)
+    ])
+    samples = []
+    for _ in range(orders):
+        db = session_factory()
+        try:
+            t0 = time.perf_counter()
+            create(payload, db)
+            samples.append(time.perf_counter() - t0)
+        finally:
+            db.close()
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=200)
+    args = parser.parse_args()
+
+    import main as app_main
+
+    engine, session_factory, path = make_session_factory()
+    try:
+        seed(engine, orders=1000)
+        print(f"{'lines':>5}  {'legacy p50':>11}  {'legacy p95':>11}  {'batched p50':>11}  {'batched p95':>11}")
+        for lines in (1, 10, 50):
+            old_p50, old_p95 = measure(legacy_create_order, session_factory, lines, args.orders)
+            new_p50, new_p95 = measure(app_main.create_order, session_factory, lines, args.orders)
+            print(f"{lines:>5}  {old_p50 * 1000:>9.2f}ms  {old_p95 * 1000:>9.2f}ms  "
+                  f"{new_p50 * 1000:>9.2f}ms  {new_p95 * 1000:>9.2f}ms")
+    finally:
+        engine.dispose()
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Time to build the /orders/ JSON body: ORM + OrderOut validation vs Core rows + orjson.
+
+Run from the backend folder:  python -m benchmarks.order_serialization --sizes 1000 10000 100000
+"""
+from pydantic import TypeAdapter
+from sqlalchemy.orm import selectinload, joinedload
+from database import Order, OrderItem
+from schemas import OrderOut
+from benchmarks.seed import make_session_factory, seed, remove_database
+from json_response import dumps
+from typing import List
+import argparse, gzip, json, time
+import order_payloads
+
+ORDERS_ADAPTER = TypeAdapter(List[OrderOut])
+
+
+def legacy_body(db) -> bytes:
+    """What the response_model path did: hydrate ORM objects, validate, then json.dumps."""
+    orders = (
+        db.query(Order)
+        .options(selectinload(Order.items).joinedload(OrderItem.menu_item))
+        .order_by(Order.created_at.desc(), Order.id.desc())
+        .all()
+    )
+    data = ORDERS_ADAPTER.dump_python(ORDERS_ADAPTER.validate_python(orders, from_attributes=True), mode="json")
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_body(db) -> bytes:
+    orders, _ = order_payloads.list_orders(db, [], "full")
+    return dumps(orders)
+
+
+def timed(build, session_factory, runs):
+    best, body = None, b""
+    for _ in range(runs):
+        db = session_factory()
+        try:
+            t0 = time.perf_counter()
+            body = build(db)
+            elapsed = time.perf_counter() - t0
+        finally:
+            db.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'orders':>8}  {'legacy ms':>10}  {'fast ms':>8}  {'speedup':>7}  {'body MB':>8}  {'gzip MB':>8}")
+    for size in args.sizes:
+        engine, session_factory, path = make_session_factory()
+        try:
+            seed(engine, orders=size)
+            old_s, old_body = timed(legacy_body, session_factory, args.runs)
+            new_s, new_body = timed(fast_body, session_factory, args.runs)
+            if json.loads(old_body) != json.loads(new_body):
+                raise SystemExit(f"payloads differ at {size} orders")
+            print(f"{size:>8}  {old_s * 1000:>10.0f}  {new_s * 1000:>8.0f}  {old_s / new_s:>6.1f}x  "
+                  f"{len(new_body) / 1e6:>8.2f}  {len(gzip.compress(new_body, compresslevel=5)) / 1e6:>8.2f}")
+        finally:
+            engine.dispose()
+            remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Orders priced per second: compiled rule book vs querying the rules for every line.
+
+Run from the backend folder:  python -m benchmarks.pricing --orders 2000 --lines 50
+
+Seeds a throwaway database with the menu, the default person rules, a
+batch of coupons and a promo plus a happy hour for every category, then
+prices ``--lines``-line orders (a mix of plain, senior, coupon and manual
+lines) two ways: the compiled RuleBook from pricing.get_rule_book, and a
+naive pricer that loads the menu price and candidate rules from the
+database line by line. Both must agree to the cent. Finishes with the
+create_order p50 for the same orders.
+"""
+from database import MenuItem, DiscountRule
+from schemas import OrderCreate, OrderItemCreate
+from benchmarks.seed import make_session_factory, seed, remove_database
+from migrations import DEFAULT_DISCOUNT_RULES
+import business_day, pricing
+from types import SimpleNamespace
+import argparse, random, statistics, time
+
+
+def seed_rules(session_factory, categories, coupons):
+    db = session_factory()
+    try:
+        db.add_all(DiscountRule(**rule) for rule in DEFAULT_DISCOUNT_RULES)
+        db.add_all(
+            DiscountRule(name=f"Coupon {n}", kind="coupon", match=f"SAVE{n}", amount=5.0 + n % 20)
+            for n in range(coupons)
+        )
+        for category in categories:
+            db.add(DiscountRule(name=f"{category} promo", kind="promo", category=category, percent=5.0))
+            db.add(DiscountRule(name=f"{category} happy hour", kind="promo", category=category, percent=15.0,
+                                start_time="16:00", end_time="19:00", weekdays="01234"))
+        db.commit()
+    finally:
+        db.close()
+
+
+def make_orders(count, lines, coupons, rng):
+    orders = []
+    for _ in range(count):
+        items = []
+        for _ in range(lines):
+            roll = rng.random()
+            extra = {}
+            if roll < 0.1:
+                extra = {"discount_person_type": "Senior Citizen", "discount_person_name": "Bench"}
+            elif roll < 0.15:
+                extra = {"discount_person_type": "Coupon", "discount_person_id": f"SAVE{rng.randrange(coupons)}"}
+            elif roll < 0.2:
+                extra = {"manual_discount_type": "percent", "manual_discount_value": 10}
+            items.append(OrderItemCreate(menu_item_id=rng.randint(1, 60), quantity=rng.randint(1, 3), **extra))
+        orders.append(OrderCreate(items=items, paid_amount=1_000_000))
+    return orders
+
+
+def naive_price_order(db, items, at):
+    """What pricing looks like without a compiled book: rule queries for every line."""
+    context = pricing.pricing_context(pricing.RuleBook(None, {}, {}, {}, {}, ()), at)
+    lines = []
+    for item in items:
+        menu_item = db.query(MenuItem).filter(MenuItem.id == item.menu_item_id).one()
+        menu = SimpleNamespace(prices={menu_item.id: menu_item.price}, categories={menu_item.id: menu_item.category})
+        book = pricing.compile_rules(
+            db.query(DiscountRule).filter(DiscountRule.active == True).order_by(DiscountRule.id).all(), menu,
+        )
+        promos = {}
+        for rule in book.promos:
+            if rule.live(context.minute, context.weekday, context.day):
+                promos.setdefault(rule.category, []).append(rule)
+        lines.append(pricing.price_line(book, context._replace(promos=promos), item))
+    return lines
+
+
+def rate(fn, orders):
+    t0 = time.perf_counter()
+    results = [fn(order) for order in orders]
+    return len(orders) / (time.perf_counter() - t0), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=50)
+    parser.add_argument("--coupons", type=int, default=200)
+    parser.add_argument("--naive-orders", type=int, default=50)
+    parser.add_argument("--create-orders", type=int, default=200)
+    args = parser.parse_args()
+
+    import main as app_main
+
+    engine, session_factory, path = make_session_factory()
+    try:
+        seed(engine, orders=1000)
+        seed_rules(session_factory, [f"Category {n}" for n in range(8)], args.coupons)
+        app_main.menu_cache.invalidate()
+        pricing.invalidate()
+
+        rng = random.Random(11)
+        orders = make_orders(args.orders, args.lines, args.coupons, rng)
+        at = business_day.utcnow()
+
+        db = session_factory()
+        try:
+            t0 = time.perf_counter()
+            book = pricing.get_rule_book(db)
+            compile_ms = (time.perf_counter() - t0) * 1000
+            compiled, compiled_lines = rate(lambda order: pricing.price_order(book, order.items, at), orders)
+            naive_orders = orders[:args.naive_orders]
+            naive, naive_lines = rate(lambda order: naive_price_order(db, order.items, at), naive_orders)
+        finally:
+            db.close()
+
+        same = all(
+            (a["line_discount"], a["discount_rule_id"]) == (b["line_discount"], b["discount_rule_id"])
+            for compiled_order, naive_order in zip(compiled_lines, naive_lines)
+            for a, b in zip(compiled_order, naive_order)
+        )
+        discounted = sum(1 for order in compiled_lines for line in order if line["line_discount"])
+        print(f"rule book: {len(book.people)} person, {len(book.coupons)} coupon, {len(book.promos)} promo rules; "
+              f"compiled in {compile_ms:.1f}ms")
+        print(f"{args.lines}-line orders, {discounted / len(orders):.1f} discounted lines per order")
+        print(f"{'pricer':>9}  {'orders/s':>10}  {'lines/s':>10}")
+        for name, orders_per_second in (("compiled", compiled), ("naive", naive)):
+            print(f"{name:>9}  {orders_per_second:>10.0f}  {orders_per_second * args.lines:>10.0f}")
+        print(f"speedup: {compiled / naive:.0f}x; same discounts: {'yes' if same else 'NO'}")
+
+        samples = []
+        for order in orders[:args.create_orders]:
+            db = session_factory()
+            try:
+                t0 = time.perf_counter()
+                app_main.create_order(order, db)
+                samples.append(time.perf_counter() - t0)
+            finally:
+                db.close()
+        print(f"create_order p50 at {args.lines} lines: {statistics.median(samples) * 1000:.2f}ms")
+    finally:
+        engine.dispose()
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Check that every report query uses an index instead of scanning orders/order_items.
+
+Run from the backend folder:  python -m benchmarks.query_plans
+Exits non-zero when a report query falls back to a full table scan. The
+reports are planned twice: on the daily rollups, and with rollups_ready
+cleared, as they run while the rollups are being rebuilt.
+"""
+from sqlalchemy import event
+from database import Order
+from migrations import run_migrations
+from reports import (
+    summarize_range, top_items, discount_usage,
+    sales_series, item_sales_matrix, rollups_ready,
+)
+from baskets import item_partners
+from benchmarks.seed import make_session_factory, seed, remove_database
+from datetime import timedelta
+import argparse, re, sys
+import business_day
+
+FULL_SCAN = re.compile(r"^SCAN (orders|order_items)\b(?!.*USING)")
+
+
+def report_calls(db, start, end):
+    return {
+        "/summary/range": lambda: summarize_range(db, start, end),
+        "/reports/top-items": lambda: top_items(db, start, end),
+        "/dashboard/discount-usage": lambda: discount_usage(db, start, end),
+        "/reports/sales-series": lambda: sales_series(db, start, end, "day"),
+        "/reports/item-sales-matrix": lambda: item_sales_matrix(db, start, end, [1, 2, 3]),
+        "/reports/item-pairs": lambda: item_partners(db, 1, start, end),
+        "/orders/?status=held": lambda: db.query(Order).filter(Order.status == "held", Order.is_paid == False).all(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=20_000)
+    parser.add_argument("--range-days", type=int, default=7)
+    args = parser.parse_args()
+
+    engine, session_factory, path = make_session_factory()
+    failures = 0
+    try:
+        _, end = seed(engine, orders=args.orders)
+        run_migrations(engine)
+        start = business_day.from_date(business_day.to_date(end) - timedelta(days=args.range_days))
+
+        captured = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not statement.startswith("EXPLAIN"):
+                captured.append((statement, parameters))
+
+        db = session_factory()
+        try:
+            # The rollup tables are empty here; only the plans matter
+            for mode, ready in (("rollups", True), ("raw", False)):
+                rollups_ready.set() if ready else rollups_ready.clear()
+                for name, call in report_calls(db, start, end).items():
+                    captured.clear()
+                    call()
+                    statements = list(captured)
+                    print(f"== {name} ({mode})")
+                    for statement, parameters in statements:
+                        plan = db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+                        for row in plan:
+                            detail = row[-1]
+                            flagged = bool(FULL_SCAN.match(detail))
+                            failures += flagged
+                            print(f"   {'FULL SCAN ' if flagged else ''}{detail}")
+        finally:
+            db.close()
+    finally:
+        rollups_ready.clear()
+        engine.dispose()
+        remove_database(path)
+
+    print("OK: all report queries use indexes" if not failures else f"FAILED: {failures} full scan(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
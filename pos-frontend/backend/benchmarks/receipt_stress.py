@@ -0,0 +1,67 @@
+"""Fire parallel /orders/{id}/pay calls and check receipt numbers are unique and gap-free.
+
+Run from the backend folder:  python -m benchmarks.receipt_stress --orders 400 --workers 32
+Exits non-zero if any payment fails or the numbers have duplicates or gaps.
+"""
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from concurrent.futures import ThreadPoolExecutor
+from database import MenuItem, Order
+from benchmarks.seed import make_session_factory, remove_database
+from receipts import receipt_prefix
+import argparse, sys, time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    import main as app_main
+
+    engine, session_factory, path = make_session_factory()
+
+    def bench_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app_main.app.dependency_overrides[app_main.get_db] = bench_db
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(MenuItem), [{"id": 1, "name": "Beer", "category": "Drinks", "price": 100.0}])
+            conn.execute(insert(Order), [{"id": i, "total": 100.0} for i in range(1, args.orders + 1)])
+
+        client = TestClient(app_main.app)  # no lifespan: skip the startup maintenance hooks
+
+        def pay(order_id):
+            return client.post(f"/orders/{order_id}/pay", json={"paid": 100.0})
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            responses = list(pool.map(pay, range(1, args.orders + 1)))
+        elapsed = time.perf_counter() - t0
+
+        failed = [r for r in responses if r.status_code != 200]
+        receipts = [r.json()["receipt_number"] for r in responses if r.status_code == 200]
+        prefix = receipt_prefix()
+        numbers = sorted(int(receipt[len(prefix):]) for receipt in receipts)
+        duplicates = len(numbers) - len(set(numbers))
+        gaps = sorted(set(range(1, len(numbers) + 1)) - set(numbers))
+
+        print(f"{args.orders} payments with {args.workers} workers in {elapsed:.2f}s")
+        print(f"failed: {len(failed)}  duplicates: {duplicates}  gaps: {len(gaps)}")
+        ok = not failed and not duplicates and not gaps and len(numbers) == args.orders
+        print("OK: receipt numbers are unique and gap-free" if ok else "FAILED")
+        sys.exit(0 if ok else 1)
+    finally:
+        app_main.app.dependency_overrides.clear()
+        engine.dispose()
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
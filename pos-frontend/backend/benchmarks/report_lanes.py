@@ -0,0 +1,121 @@
+"""Checkout latency while heavy reports run, with and without the report lane.
+
+Run from the backend folder:  python -m benchmarks.report_lanes --orders 200000 --report-clients 48
+
+Seeds a throwaway database, then for each mode drives the ASGI app in
+process: ``--report-clients`` loops request year-sized summaries, CSV
+exports and item matrices while ``--cashiers`` loops post paid orders to
+/orders/. "shared" runs reports in Starlette's thread pool as before;
+"lane" routes them through lanes.report_lane. Prints checkout latency
+percentiles and how many reports finished or were turned away (503).
+"""
+from sqlalchemy.orm import sessionmaker
+from database import make_engine
+from benchmarks.seed import make_session_factory, seed, remove_database
+import argparse, asyncio, random, statistics, time
+import business_day
+import httpx
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else float("nan")
+
+
+async def run_mode(app, lane, enabled, args, start_date, end_date):
+    lane.enabled = enabled
+    lane.rejected = lane.completed = 0
+    checkout_times, report_counts = [], {"done": 0, "rejected": 0, "failed": 0}
+    deadline = time.perf_counter() + args.seconds
+    report_urls = [
+        f"/summary/range?start_date={start_date}&end_date={end_date}",
+        f"/reports/orders-csv?start_date={start_date}&end_date={end_date}",
+        f"/reports/item-sales-matrix?start_date={start_date}&end_date={end_date}",
+    ]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        async def reporter(n):
+            rng = random.Random(n)
+            while time.perf_counter() < deadline:
+                response = await client.get(rng.choice(report_urls))
+                if response.status_code == 200:
+                    report_counts["done"] += 1
+                elif response.status_code == 503:
+                    report_counts["rejected"] += 1
+                    await asyncio.sleep(0.5)
+                else:
+                    report_counts["failed"] += 1
+
+        async def cashier(n):
+            rng = random.Random(1000 + n)
+            while time.perf_counter() < deadline:
+                items = [{"menu_item_id": rng.randint(1, 60), "quantity": rng.randint(1, 3)} for _ in range(3)]
+                t0 = time.perf_counter()
+                response = await client.post("/orders/", json={"items": items, "paid_amount": 10_000})
+                if response.status_code == 200:
+                    checkout_times.append(time.perf_counter() - t0)
+                await asyncio.sleep(args.think_ms / 1000)
+
+        await asyncio.gather(
+            *(reporter(n) for n in range(args.report_clients)),
+            *(cashier(n) for n in range(args.cashiers)),
+        )
+
+    checkout_times.sort()
+    return {
+        "checkouts": len(checkout_times),
+        "p50": statistics.median(checkout_times) * 1000 if checkout_times else float("nan"),
+        "p95": percentile(checkout_times, 0.95),
+        "p99": percentile(checkout_times, 0.99),
+        "max": checkout_times[-1] * 1000 if checkout_times else float("nan"),
+        **report_counts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--report-clients", type=int, default=48)
+    parser.add_argument("--cashiers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--think-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    import main as app_main
+    from lanes import report_lane
+
+    engine, session_factory, path = make_session_factory()
+    report_engine = make_engine(f"sqlite:///{path}", read_only=True)
+    try:
+        start_day, end_day = seed(engine, orders=args.orders, days=args.days)
+        start_date, end_date = business_day.iso(start_day), business_day.iso(end_day)
+
+        def get_bench_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app_main.app.dependency_overrides[app_main.get_db] = get_bench_db
+        report_lane.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=report_engine)
+        app_main.menu_cache.invalidate()
+
+        print(f"{args.orders} orders over {args.days} days; {args.report_clients} report clients, "
+              f"{args.cashiers} cashiers, {args.seconds:g}s per mode")
+        print(f"{'mode':>7}  {'checkouts':>9}  {'p50':>9}  {'p95':>9}  {'p99':>9}  {'max':>9}  "
+              f"{'reports':>7}  {'503s':>5}  {'failed':>6}")
+        for mode, enabled in (("shared", False), ("lane", True)):
+            r = asyncio.run(run_mode(app_main.app, report_lane, enabled, args, start_date, end_date))
+            print(f"{mode:>7}  {r['checkouts']:>9}  {r['p50']:>7.1f}ms  {r['p95']:>7.1f}ms  {r['p99']:>7.1f}ms  "
+                  f"{r['max']:>7.1f}ms  {r['done']:>7}  {r['rejected']:>5}  {r['failed']:>6}")
+    finally:
+        app_main.app.dependency_overrides.clear()
+        report_engine.dispose()
+        engine.dispose()
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+from database import Base, MenuItem, Order, OrderItem, make_engine, DB_PROFILE
+import business_day
+from datetime import datetime, timedelta
+import os, random, tempfile
+
+CHUNK = 10_000
+
+
+def make_session_factory(path=None, profile=DB_PROFILE):
+    """Create a throwaway SQLite database with the app schema."""
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".db", prefix="pos_bench_")
+        os.close(fd)
+    engine = make_engine(f"sqlite:///{path}", profile)
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine), path
+
+
+def seed(engine, orders=500_000, days=90, menu_items=60, max_lines=4, seed_value=42):
+    """Bulk insert a realistic spread of orders and order lines ending now.
+
+    Returns the first and last business dates covered.
+    """
+    rng = random.Random(seed_value)
+    end = business_day.utcnow().replace(second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    span = int((end - start).total_seconds())
+
+    with engine.begin() as conn:
+        conn.execute(insert(MenuItem), [
+            {"id": i, "name": f"Item {i}", "category": f"Category {i % 8}",
+             "price": round(rng.uniform(40, 400), 2)}
+            for i in range(1, menu_items + 1)
+        ])
+
+    order_id = 0
+    line_id = 0
+    while order_id < orders:
+        order_rows, line_rows = [], []
+        for _ in range(min(CHUNK, orders - order_id)):
+            order_id += 1
+            created = start + timedelta(seconds=rng.randrange(span))
+            canceled = rng.random() < 0.03
+            paid = not canceled and rng.random() < 0.92
+            total = 0.0
+            for _ in range(rng.randint(1, max_lines)):
+                line_id += 1
+                qty = rng.randint(1, 3)
+                total += qty * 100.0
+                line_rows.append({
+                    "id": line_id, "order_id": order_id,
+                    "menu_item_id": rng.randint(1, menu_items), "quantity": qty,
+                    "unit_price": 100.0, "line_subtotal": qty * 100.0, "line_discount": 0.0,
+                    "discount_person_type": rng.choice([None] * 8 + ["Senior", "PWD"]),
+                })
+            order_rows.append({
+                "id": order_id, "created_at": created, "total": total,
+                "discount": rng.choice([0.0] * 9 + [round(total * 0.2, 2)]),
+                "paid": total if paid else 0.0, "is_paid": paid,
+                "type": rng.choice(["dine-in", "take-out"]),
+                "cancel_reason": "Canceled by user" if canceled else None,
+                "status": "void" if canceled else ("paid" if paid else "held"),
+                "cashier": rng.choice(["Ana", "Ben", "Cris"]),
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(Order), order_rows)
+            conn.execute(insert(OrderItem), line_rows)
+
+    return business_day.business_date_for(start), business_day.business_date_for(end)
+
+
+def remove_database(path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
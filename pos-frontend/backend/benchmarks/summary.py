@@ -0,0 +1,76 @@
+"""Compare the single-pass summary engine with the old row-loading summary.
+
+Run from the backend folder:  python -m benchmarks.summary --orders 500000
+"""
+from database import Order
+from reports import summarize_orders
+from benchmarks.seed import make_session_factory, seed, remove_database
+import argparse, time
+
+
+def legacy_summary(db, start_day, end_day):
+    in_range = Order.business_date.between(start_day, end_day)
+    orders_paid = db.query(Order).filter(Order.is_paid == True, in_range).all()
+    orders_unpaid = db.query(Order).filter(Order.is_paid == False, in_range).all()
+    dine_in = [o for o in orders_paid if (o.type or "").lower() == "dine-in"]
+    take_out = [o for o in orders_paid if (o.type or "").lower() == "take-out"]
+    void_orders = db.query(Order).filter(
+        Order.is_paid == True, Order.cancel_reason.isnot(None), in_range
+    ).count()
+    return {
+        "total_paid": sum(o.total for o in orders_paid),
+        "total_unpaid": sum(o.total for o in orders_unpaid),
+        "orders_paid": len(orders_paid),
+        "orders_unpaid": len(orders_unpaid),
+        "total_discount": sum(o.discount or 0 for o in orders_paid),
+        "dine_in_count": len(dine_in),
+        "dine_in_sales": sum(o.total for o in dine_in),
+        "take_out_count": len(take_out),
+        "take_out_sales": sum(o.total for o in take_out),
+        "void_orders": void_orders,
+    }
+
+
+def timed(fn, session_factory, start, end, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        db = session_factory()
+        try:
+            t0 = time.perf_counter()
+            result = fn(db, start, end)
+            elapsed = time.perf_counter() - t0
+        finally:
+            db.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=500_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine, session_factory, path = make_session_factory()
+    try:
+        t0 = time.perf_counter()
+        start, end = seed(engine, orders=args.orders, days=args.days)
+        print(f"Seeded {args.orders} orders in {time.perf_counter() - t0:.1f}s ({path})")
+
+        legacy_time, legacy = timed(legacy_summary, session_factory, start, end, args.repeat)
+        engine_time, summary = timed(summarize_orders, session_factory, start, end, args.repeat)
+
+        for key, value in legacy.items():
+            assert abs(summary[key] - value) < 0.01, f"{key}: {summary[key]} != {value}"
+
+        print(f"legacy  : {legacy_time * 1000:9.1f} ms")
+        print(f"engine  : {engine_time * 1000:9.1f} ms")
+        print(f"speed-up: {legacy_time / engine_time:9.1f}x")
+    finally:
+        engine.dispose()
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Bytes shipped to head office: whole-file copy vs journal delta sync.
+
+Run from the backend folder:  python -m benchmarks.sync_delta --orders 100000 --new-orders 500
+
+Seeds a throwaway branch database, pushes it once to a throwaway SQLite
+head-office store (the first push journals every existing order as a
+snapshot), then takes ``--new-orders`` orders through main.create_order and
+a quantity change on every tenth one, and pushes again. Compares each push
+with the size of the database file, then consolidates and checks that
+hq_orders agrees with the branch.
+"""
+from sqlalchemy import select, func
+from database import Order, OrderItem
+from schemas import OrderCreate, OrderItemCreate, UpdateQuantity
+from benchmarks.seed import make_session_factory, seed, remove_database
+import sync
+import argparse, json, os, random, tempfile, time
+
+
+def database_bytes(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--new-orders", type=int, default=500)
+    args = parser.parse_args()
+
+    import main as app_main
+
+    engine, session_factory, path = make_session_factory()
+    fd, store_path = tempfile.mkstemp(suffix=".db", prefix="pos_hq_")
+    os.close(fd)
+    store_url = f"sqlite:///{store_path}"
+    try:
+        seed(engine, orders=args.orders, days=args.days)
+        app_main.menu_cache.invalidate()
+
+        print(f"{'push':>8}  {'events':>7}  {'raw':>10}  {'sent':>10}  {'db file':>10}  {'sent/db':>8}  {'time':>8}")
+
+        def report(label, stats):
+            db_size = database_bytes(path)
+            print(f"{label:>8}  {stats['events']:>7}  {stats['raw_bytes']:>10}  {stats['sent_bytes']:>10}  "
+                  f"{db_size:>10}  {stats['sent_bytes'] / db_size:>7.2%}  {stats['ms']:>6.0f}ms")
+
+        report("initial", sync.push(store_url, "bench", sessions=session_factory))
+        t0 = time.perf_counter()
+        applied = sync.consolidate(store_url)["bench"]
+        print(f"consolidated {applied} event(s) in {(time.perf_counter() - t0) * 1000:.0f}ms")
+
+        rng = random.Random(7)
+        for n in range(args.new_orders):
+            db = session_factory()
+            try:
+                order = app_main.create_order(OrderCreate(items=[
+                    OrderItemCreate(menu_item_id=rng.randint(1, 60), quantity=rng.randint(1, 3)) for _ in range(3)
+                ], paid_amount=10_000), db)
+                if n % 10 == 0:
+                    app_main.update_order_item_quantity(order.id, order.items[0].id, UpdateQuantity(quantity=5), db)
+            finally:
+                db.close()
+
+        report("delta", sync.push(store_url, "bench", sessions=session_factory))
+        t0 = time.perf_counter()
+        applied = sync.consolidate(store_url)["bench"]
+        print(f"consolidated {applied} event(s) in {(time.perf_counter() - t0) * 1000:.0f}ms")
+
+        with engine.connect() as conn:
+            branch = conn.execute(select(func.count(Order.id), func.round(func.sum(Order.total), 2))).one()
+            lines = conn.execute(select(func.count(OrderItem.id))).scalar()
+        with sync.store_engine(store_url).connect() as conn:
+            hq = conn.execute(select(
+                func.count(sync.hq_orders.c.order_id), func.round(func.sum(sync.hq_orders.c.total), 2),
+            ).where(sync.hq_orders.c.deleted == False)).one()
+            hq_lines = sum(len(json.loads(lines)) for lines in conn.execute(
+                select(sync.hq_orders.c.lines).where(sync.hq_orders.c.deleted == False)
+            ).scalars())
+        match = tuple(branch) == tuple(hq) and lines == hq_lines
+        print(f"branch: {branch[0]} orders, {lines} lines, total {branch[1]}")
+        print(f"hq:     {hq[0]} orders, {hq_lines} lines, total {hq[1]}  ->  {'match' if match else 'MISMATCH'}")
+    finally:
+        engine.dispose()
+        for url, store in list(sync._engines.items()):
+            store.dispose()
+            del sync._engines[url]
+        remove_database(path)
+        remove_database(store_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Business dates: which trading day an order belongs to.
+
+``created_at`` is stored in UTC. A business date is the local calendar date
+after shifting back by the day-rollover hour, so with the default 4 AM
+rollover a 1:30 AM sale counts toward the previous night. It is stored on
+each order as an integer ``YYYYMMDD`` so reports can filter and group on an
+indexed column.
+
+    PUB_EXPRESS_DAY_START_HOUR   rollover hour, 0-23 (default 4)
+    PUB_EXPRESS_TIMEZONE         IANA name such as "Asia/Manila" (default: system local time)
+"""
+from datetime import date, datetime, time, timedelta, timezone
+import logging, os
+
+log = logging.getLogger("pub_express.business_day")
+
+DAY_START_HOUR = int(os.environ.get("PUB_EXPRESS_DAY_START_HOUR", 4))
+TIMEZONE_NAME = os.environ.get("PUB_EXPRESS_TIMEZONE", "")
+
+TIMEZONE = None
+if TIMEZONE_NAME:
+    try:
+        from zoneinfo import ZoneInfo
+        TIMEZONE = ZoneInfo(TIMEZONE_NAME)
+    except Exception as e:  # unknown name, or no tz database on this machine
+        log.warning("Timezone %s unavailable (%s); using system local time", TIMEZONE_NAME, e)
+        TIMEZONE_NAME = ""
+
+# Stored with the data; when it changes, existing business dates are recomputed
+CONFIG_SIGNATURE = f"{DAY_START_HOUR}|{TIMEZONE_NAME or 'local'}"
+
+
+def utcnow() -> datetime:
+    """Naive UTC, the same form SQLite's CURRENT_TIMESTAMP stores."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def to_local(created_at: datetime) -> datetime:
+    """Naive UTC timestamp -> naive local wall-clock time."""
+    aware = created_at.replace(tzinfo=timezone.utc)
+    return (aware.astimezone(TIMEZONE) if TIMEZONE else aware.astimezone()).replace(tzinfo=None)
+
+
+def from_date(day: date) -> int:
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def to_date(day: int) -> date:
+    return date(day // 10000, day // 100 % 100, day % 100)
+
+
+def iso(day: int) -> str:
+    return to_date(day).isoformat()
+
+
+def parse(value: str) -> int:
+    """"YYYY-MM-DD" -> business date. Raises ValueError on a bad date."""
+    return from_date(datetime.strptime(value, "%Y-%m-%d").date())
+
+
+def business_date_for(created_at: datetime) -> int:
+    return from_date((to_local(created_at) - timedelta(hours=DAY_START_HOUR)).date())
+
+
+def today() -> int:
+    return business_date_for(utcnow())
+
+
+def days_between(start_day: int, end_day: int) -> list:
+    """Every business date from start_day to end_day inclusive."""
+    first, last = to_date(start_day), to_date(end_day)
+    return [from_date(first + timedelta(days=n)) for n in range((last - first).days + 1)]
+
+
+def local_opening(day: int) -> datetime:
+    """Local wall-clock time the business day opens."""
+    return datetime.combine(to_date(day), time(DAY_START_HOUR))
+
+
+def column_default(context) -> int:
+    """SQLAlchemy default for Order.business_date, derived from the row's created_at."""
+    created_at = context.get_current_parameters().get("created_at")
+    return business_date_for(created_at or utcnow())
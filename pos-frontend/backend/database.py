@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, DateTime, Boolean
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.sql import func
@@ -6,6 +6,7 @@ from passlib.context import CryptContext
 from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional
+import business_day
 import os, sys
 
 # Database URL (SQLite)
@@ -17,14 +18,60 @@ else:
 os.makedirs(BASE_DIR, exist_ok=True)
 DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'pub_express.db')}"
 
+# Engine profiles: "tuned" runs SQLite in WAL mode so report reads don't block
+# cashier writes; "legacy" keeps SQLite's stock rollback-journal settings.
+ENGINE_PROFILES = {
+    "legacy": {
+        "pragmas": {},
+        "pool": {},
+    },
+    "tuned": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -32000,        # KiB, i.e. ~32 MB page cache per connection
+            "mmap_size": 268435456,      # 256 MB
+            "busy_timeout": 5000,        # ms
+            "temp_store": "MEMORY",
+        },
+        "pool": {
+            "pool_size": int(os.environ.get("PUB_EXPRESS_DB_POOL_SIZE", 10)),
+            "max_overflow": int(os.environ.get("PUB_EXPRESS_DB_MAX_OVERFLOW", 20)),
+            "pool_timeout": 30,
+            "pool_pre_ping": False,
+        },
+    },
+}
+DB_PROFILE = os.environ.get("PUB_EXPRESS_DB_PROFILE", "tuned")
+
+def make_engine(url: str, profile: str = DB_PROFILE, read_only: bool = False):
+    settings = ENGINE_PROFILES[profile]
+    new_engine = create_engine(url, connect_args={"check_same_thread": False}, **settings["pool"])
+
+    pragmas = dict(settings["pragmas"])
+    if read_only:
+        pragmas["query_only"] = "ON"
+    if pragmas:
+        @event.listens_for(new_engine, "connect")
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return new_engine
+
 # Create engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = make_engine(DATABASE_URL)
+# Read-only connections for report and export work (see lanes.py)
+report_engine = make_engine(DATABASE_URL, read_only=True)
 
 # Define Base class for ORM models
 Base = declarative_base()
 
 # Create database session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReportSession = sessionmaker(autocommit=False, autoflush=False, bind=report_engine)
 
 # Hashing settings
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -49,7 +96,9 @@ class Order(Base):
     __tablename__ = "orders"
 
     id = Column(Integer, primary_key=True, index=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=business_day.utcnow, server_default=func.now())
+    # Integer YYYYMMDD trading day, derived from created_at on insert (see business_day.py)
+    business_date = Column(Integer, default=business_day.column_default)
     total = Column(Float, default=0.0)
     discount = Column(Float, default=0.0)
     paid = Column(Float, default=0.0)
@@ -63,6 +112,15 @@ class Order(Base):
 
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
+    # Reports filter on paid state + business date; order lists filter on status + paid state.
+    __table_args__ = (
+        Index("ix_orders_created_at", "created_at"),
+        Index("ix_orders_is_paid_created_at", "is_paid", "created_at"),
+        Index("ix_orders_business_date", "business_date"),
+        Index("ix_orders_is_paid_business_date", "is_paid", "business_date"),
+        Index("ix_orders_status_is_paid", "status", "is_paid"),
+    )
+
 class OrderItem(Base):
     __tablename__ = "order_items"
 
@@ -71,6 +129,15 @@ class OrderItem(Base):
     menu_item_id = Column(Integer, ForeignKey("menu_items.id"))
     quantity = Column(Integer, default=1)
 
+    # Priced at the moment of sale (see pricing.py), so menu edits don't rewrite history
+    unit_price = Column(Float, nullable=True)
+    line_subtotal = Column(Float, nullable=True)
+    line_discount = Column(Float, default=0.0)
+    # Discount rule that set line_discount; None when it came from the manual fields or there is none
+    discount_rule_id = Column(Integer, nullable=True)
+    # Cashier marked the line VAT-exempt; its discount comes off the VAT-less price
+    vat_applied = Column(Boolean, default=False)
+
     discount_person_name = Column(String, nullable=True)
     discount_person_id = Column(String, nullable=True)
     discount_person_type = Column(String, nullable=True)
@@ -83,6 +150,11 @@ class OrderItem(Base):
     order = relationship("Order", back_populates="items")
     menu_item = relationship("MenuItem") 
 
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+        Index("ix_order_items_menu_item_id", "menu_item_id"),
+    )
+
 class Supervisor(Base):
     __tablename__ = "supervisors"
 
@@ -104,4 +176,135 @@ class Setting(Base):
     key = Column(String, unique=True, nullable=False)
     value = Column(String, nullable=True)
 
-Base.metadata.create_all(bind=engine)
+
+# --- Discount Rules (compiled by pricing.py) --- #
+
+class DiscountRule(Base):
+    __tablename__ = "discount_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    kind = Column(String, nullable=False)              # "person", "coupon" or "promo"
+    match = Column(String, nullable=True)              # person: discount type; coupon: the code
+    category = Column(String, nullable=True)           # promo: menu category, None for every item
+    percent = Column(Float, default=0.0)
+    amount = Column(Float, default=0.0)                # off per unit
+    vat_exempt = Column(Boolean, default=False)        # take VAT out before the percentage (senior/PWD)
+    start_time = Column(String, nullable=True)         # "HH:MM" local; with end_time, a happy-hour window
+    end_time = Column(String, nullable=True)
+    weekdays = Column(String, nullable=True)           # e.g. "01234" with Monday = 0; None for every day
+    valid_from = Column(Integer, nullable=True)        # business dates, inclusive
+    valid_to = Column(Integer, nullable=True)
+    active = Column(Boolean, default=True)
+
+
+# --- Receipt Numbering (see receipts.py) --- #
+
+class ReceiptSequence(Base):
+    __tablename__ = "receipt_sequences"
+
+    prefix = Column(String, primary_key=True)  # e.g. PX-2025-
+    last_number = Column(Integer, nullable=False, default=0)
+
+class ReceiptBlock(Base):
+    __tablename__ = "receipt_blocks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    terminal = Column(String, nullable=False)
+    prefix = Column(String, nullable=False)
+    start_number = Column(Integer, nullable=False)
+    end_number = Column(Integer, nullable=False)
+    next_number = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_receipt_blocks_terminal_prefix", "terminal", "prefix"),
+    )
+
+# --- Daily Rollups (maintained by rollups.py) --- #
+
+class DailySalesRollup(Base):
+    __tablename__ = "daily_sales_rollup"
+
+    business_date = Column(Integer, primary_key=True)  # YYYYMMDD
+    total_paid = Column(Float, default=0.0)
+    orders_paid = Column(Integer, default=0)
+    total_discount = Column(Float, default=0.0)
+    dine_in_count = Column(Integer, default=0)
+    dine_in_sales = Column(Float, default=0.0)
+    take_out_count = Column(Integer, default=0)
+    take_out_sales = Column(Float, default=0.0)
+    void_orders = Column(Integer, default=0)
+    valid_sales = Column(Float, default=0.0)
+    valid_discount = Column(Float, default=0.0)
+    valid_orders = Column(Integer, default=0)
+    canceled_orders = Column(Integer, default=0)
+
+class DailyItemRollup(Base):
+    __tablename__ = "daily_item_rollup"
+
+    business_date = Column(Integer, primary_key=True)
+    menu_item_id = Column(Integer, primary_key=True)
+    quantity = Column(Integer, default=0)
+    revenue = Column(Float, default=0.0)     # line subtotals less line discounts
+
+class DailyDiscountRollup(Base):
+    __tablename__ = "daily_discount_rollup"
+
+    business_date = Column(Integer, primary_key=True)
+    discount_type = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+# Paid, non-void orders per day holding both items (item_a < item_b); see baskets.py.
+# item_a == item_b counts the orders holding that item, and (0, 0) counts every order.
+class DailyItemPair(Base):
+    __tablename__ = "daily_item_pairs"
+    __table_args__ = (
+        Index("ix_daily_item_pairs_item_b", "item_b", "business_date"),
+        {"sqlite_with_rowid": False},
+    )
+
+    item_a = Column(Integer, primary_key=True)
+    item_b = Column(Integer, primary_key=True)
+    business_date = Column(Integer, primary_key=True)
+    orders = Column(Integer, default=0)
+
+
+# Change counter per business date, bumped whenever an order on that day
+# changes (business_date 0 counts menu changes); see export_jobs.py.
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    business_date = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+# --- Order Event Journal (see journal.py and sync.py) --- #
+
+class OrderEvent(Base):
+    __tablename__ = "order_events"
+    # AUTOINCREMENT: sequence numbers are never reused, even after the newest row is gone
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True)
+    order_id = Column(Integer, nullable=False, index=True)
+    action = Column(String, nullable=False)
+    created_at = Column(DateTime, default=business_day.utcnow)
+    payload = Column(String, nullable=False)
+
+
+# --- Order Archive (see archive.py) --- #
+
+# One row per archive file; the counts are what archive.py last wrote there
+# and what ``archive.verify`` checks the file against.
+class ArchiveVolume(Base):
+    __tablename__ = "archive_volumes"
+
+    year = Column(Integer, primary_key=True)   # business-date year of every order in the file
+    file = Column(String, nullable=False)
+    first_day = Column(Integer, nullable=True)
+    last_day = Column(Integer, nullable=True)
+    orders = Column(Integer, nullable=False, default=0)
+    items = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=business_day.utcnow)
@@ -0,0 +1,180 @@
+"""In-process change feed for terminals and the dashboard, streamed at /events/stream.
+
+Endpoints queue events on their session (``order_changed``, and
+``rollup_update`` queues dashboard deltas through ``totals_changed``); they
+are published only once the session commits, so a rolled-back change never
+reaches a client. Every published event gets an id ``<epoch>-<seq>``. A
+client that reconnects with ``Last-Event-ID`` (or ``?since=``) is replayed
+what it missed from a bounded buffer; when that is no longer possible
+(buffer overrun, server restart) it gets a ``reset`` event and re-fetches.
+
+    PUB_EXPRESS_EVENT_BUFFER      events kept for replay (default 1000)
+    PUB_EXPRESS_EVENT_KEEPALIVE   seconds between keepalive comments (default 15)
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from collections import deque
+from json_response import dumps
+import asyncio, logging, os, threading, time
+
+log = logging.getLogger("pub_express.events")
+
+BUFFER_SIZE = int(os.environ.get("PUB_EXPRESS_EVENT_BUFFER", 1000))
+KEEPALIVE_SECONDS = float(os.environ.get("PUB_EXPRESS_EVENT_KEEPALIVE", 15))
+
+# Order columns carried by "order" events; enough to update a list row in place
+ORDER_EVENT_FIELDS = (
+    "id", "status", "is_paid", "total", "discount", "paid",
+    "cancel_reason", "type", "receipt_number", "business_date",
+)
+
+# Rollup day fields behind the /dashboard/today-summary cards, by response key
+DASHBOARD_FIELDS = {
+    "total_sales": "valid_sales",
+    "total_discount": "valid_discount",
+    "total_orders": "valid_orders",
+    "void_orders": "canceled_orders",
+}
+
+
+class EventBus:
+    def __init__(self, size: int = BUFFER_SIZE):
+        # Distinguishes this process's sequence numbers from a previous run's
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.seq = 0
+        self.buffer = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.subscribers = set()     # (loop, asyncio.Event) per open stream
+
+    def publish(self, kind: str, data: dict) -> int:
+        with self.lock:
+            self.seq += 1
+            self.buffer.append((self.seq, kind, data))
+            subscribers = list(self.subscribers)
+            seq = self.seq
+        for loop, wakeup in subscribers:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:  # loop already closed
+                pass
+        return seq
+
+    def last_id(self) -> str:
+        return f"{self.epoch}-{self.seq}"
+
+    def resume_point(self, last_event_id: str):
+        """Sequence number to replay after, or None when the client must re-fetch."""
+        epoch, _, seq = (last_event_id or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self.lock:
+            oldest = self.buffer[0][0] if self.buffer else self.seq + 1
+            if seq > self.seq or seq < oldest - 1:
+                return None
+        return seq
+
+    def since(self, seq: int) -> list:
+        with self.lock:
+            if not self.buffer or self.buffer[-1][0] <= seq:
+                return []
+            return [entry for entry in self.buffer if entry[0] > seq]
+
+
+bus = EventBus()
+
+
+# --- Queued on the session, published on commit --- #
+
+
+def _pending(db: Session) -> dict:
+    return db.info.setdefault("pending_events", {"orders": [], "totals": {}})
+
+
+def order_changed(db: Session, action: str, order) -> None:
+    """Queue an "order" event; ``order`` may be deleted, only its columns are read."""
+    payload = {name: getattr(order, name) for name in ORDER_EVENT_FIELDS}
+    _pending(db)["orders"].append({"action": action, "order": payload})
+
+
+def totals_changed(db: Session, before, after) -> None:
+    """Queue the dashboard delta between two rollup contributions (see rollups.order_contribution)."""
+    totals = _pending(db)["totals"]
+    for contribution, sign in ((before, -1), (after, 1)):
+        if contribution is None:
+            continue
+        business_date, day = contribution[0], contribution[1]
+        delta = totals.setdefault(business_date, dict.fromkeys(DASHBOARD_FIELDS, 0))
+        for key, field in DASHBOARD_FIELDS.items():
+            delta[key] += sign * day[field]
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(db: Session):
+    pending = db.info.pop("pending_events", None)
+    if not pending:
+        return
+    for change in pending["orders"]:
+        bus.publish("order", change)
+    for business_date, delta in pending["totals"].items():
+        if any(delta.values()):
+            bus.publish("dashboard", {"business_date": business_date,
+                                      **{key: round(value, 2) for key, value in delta.items()}})
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(db: Session):
+    db.info.pop("pending_events", None)
+
+
+# --- Server-Sent Events --- #
+
+
+def _frame(seq: int, kind: str, data: dict) -> bytes:
+    return b"id: %s-%d\nevent: %s\ndata: %s\n\n" % (bus.epoch.encode(), seq, kind.encode(), dumps(data))
+
+
+async def stream(last_event_id: str = None, is_disconnected=None):
+    """SSE body: replay after ``last_event_id``, then follow new events until the client leaves."""
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    subscriber = (loop, wakeup)
+    with bus.lock:
+        bus.subscribers.add(subscriber)
+    try:
+        seq = bus.resume_point(last_event_id) if last_event_id else None
+        if seq is None:
+            with bus.lock:
+                seq = bus.seq
+            kind = "reset" if last_event_id else "hello"
+            yield f"id: {bus.epoch}-{seq}\nevent: {kind}\ndata: {{}}\n\n".encode()
+
+        # Ask the browser to wait a little before reconnecting after a drop
+        yield b"retry: 2000\n\n"
+        while True:
+            wakeup.clear()
+            entries = bus.since(seq)
+            if entries and entries[0][0] > seq + 1:
+                # Fell behind further than the buffer reaches
+                seq = entries[-1][0]
+                yield f"id: {bus.epoch}-{seq}\nevent: reset\ndata: {{}}\n\n".encode()
+                continue
+            for entry_seq, kind, data in entries:
+                seq = entry_seq
+                yield _frame(entry_seq, kind, data)
+            if entries:
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    break
+                yield b": keepalive\n\n"
+    finally:
+        with bus.lock:
+            bus.subscribers.discard(subscriber)
+
+
+def subscriber_count() -> int:
+    with bus.lock:
+        return len(bus.subscribers)
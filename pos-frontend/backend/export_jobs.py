@@ -0,0 +1,258 @@
+"""Background order exports: submit, poll or follow progress, then download.
+
+``submit`` returns a job straight away; a small worker pool builds the file
+on a read-only session, reporting progress on the job and as "export"
+events on /events/stream. Finished files are kept in ``EXPORT_DIR`` under a
+key made of the export parameters and a data-version stamp, so the same
+export is served from disk until an order in its range (or the menu)
+changes. Least recently used files are pruned past the disk cap.
+
+    PUB_EXPRESS_EXPORT_DIR        artifact folder (default BASE_DIR/exports)
+    PUB_EXPRESS_EXPORT_CACHE_MB   disk cap for cached artifacts (default 256)
+    PUB_EXPRESS_EXPORT_WORKERS    exports built at once (default 1)
+"""
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from concurrent.futures import ThreadPoolExecutor
+from database import BASE_DIR, ReportSession, DataVersion
+import exports, events, business_day
+import hashlib, json, logging, os, threading, time, uuid
+
+log = logging.getLogger("pub_express.export_jobs")
+
+EXPORT_DIR = os.environ.get("PUB_EXPRESS_EXPORT_DIR", os.path.join(BASE_DIR, "exports"))
+CACHE_BYTES = int(float(os.environ.get("PUB_EXPRESS_EXPORT_CACHE_MB", 256)) * 1024 * 1024)
+WORKERS = int(os.environ.get("PUB_EXPRESS_EXPORT_WORKERS", 1))
+
+FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+}
+MAX_JOBS = 200              # finished jobs remembered for polling
+PROGRESS_INTERVAL = 0.5     # seconds between "export" progress events
+MENU_VERSION_KEY = 0
+
+
+# --- Data versions --- #
+
+
+def bump_data_version(db: Session, business_date: int) -> None:
+    """Mark cached exports of ``business_date`` stale (MENU_VERSION_KEY for the menu); call before commit."""
+    stmt = insert(DataVersion).values(business_date=business_date, version=1)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["business_date"], set_={"version": DataVersion.version + 1},
+    ))
+
+
+def data_stamp(db: Session, start_day: int, end_day: int) -> int:
+    """Grows whenever an order in the range or the menu changes; versions only go up."""
+    return db.query(func.coalesce(func.sum(DataVersion.version), 0)).filter(
+        or_(DataVersion.business_date.between(start_day, end_day), DataVersion.business_date == MENU_VERSION_KEY)
+    ).scalar()
+
+
+# --- Jobs --- #
+
+
+class ExportJob:
+    def __init__(self, fmt: str, start_day: int, end_day: int, filters: dict):
+        self.id = uuid.uuid4().hex
+        self.format = fmt
+        self.start_day = start_day
+        self.end_day = end_day
+        self.filters = filters
+        self.status = "queued"
+        self.key = None
+        self.rows_done = 0
+        self.rows_total = None
+        self.path = None
+        self.cached = False
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._last_event = 0.0
+
+    @property
+    def filename(self) -> str:
+        return (f"PubExpress_Sales_Report_{business_day.iso(self.start_day)}"
+                f"_to_{business_day.iso(self.end_day)}.{self.format}")
+
+    def cache_key(self, stamp: int) -> str:
+        params = [self.format, self.start_day, self.end_day, sorted(self.filters.items()),
+                  business_day.CONFIG_SIGNATURE, stamp]
+        return hashlib.sha1(json.dumps(params).encode()).hexdigest()
+
+    def to_dict(self) -> dict:
+        if self.status == "done":
+            progress = 1.0
+        elif self.rows_total:
+            progress = round(min(1.0, self.rows_done / self.rows_total), 3)
+        else:
+            progress = 0.0
+        return {
+            "id": self.id,
+            "format": self.format,
+            "start_date": business_day.iso(self.start_day),
+            "end_date": business_day.iso(self.end_day),
+            "filters": self.filters,
+            "status": self.status,
+            "progress": progress,
+            "rows_done": self.rows_done,
+            "rows_total": self.rows_total,
+            "cached": self.cached,
+            "error": self.error,
+            "download_url": f"/exports/{self.id}/download" if self.status == "done" else None,
+        }
+
+    def advance(self, rows_done: int):
+        self.rows_done = rows_done
+        now = time.monotonic()
+        if now - self._last_event >= PROGRESS_INTERVAL:
+            self._last_event = now
+            events.bus.publish("export", self.to_dict())
+
+
+_jobs = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="export")
+
+
+def _artifact_path(job: ExportJob, key: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{key}.{job.format}")
+
+
+def _remember(job: ExportJob):
+    with _lock:
+        _jobs[job.id] = job
+        finished = [j for j in _jobs.values() if j.status in ("done", "failed")]
+        for old in sorted(finished, key=lambda j: j.created)[:max(0, len(_jobs) - MAX_JOBS)]:
+            del _jobs[old.id]
+
+
+def _finish_cached(job: ExportJob, path: str):
+    os.utime(path)  # mark as recently used for pruning
+    job.path = path
+    job.cached = True
+    job.status = "done"
+    job.finished = time.time()
+
+
+def submit(fmt: str, start_day: int, end_day: int, filters: dict = None) -> ExportJob:
+    """Queue an export, or answer from the cache / an identical job already in progress."""
+    job = ExportJob(fmt, start_day, end_day, {k: v for k, v in (filters or {}).items() if v})
+    db = ReportSession()
+    try:
+        key = job.cache_key(data_stamp(db, start_day, end_day))
+    finally:
+        db.close()
+
+    path = _artifact_path(job, key)
+    with _lock:
+        for other in _jobs.values():
+            if other.status in ("queued", "running") and other.key == key:
+                return other
+    if os.path.exists(path):
+        _finish_cached(job, path)
+        _remember(job)
+        return job
+
+    job.key = key
+    _remember(job)
+    _executor.submit(_run, job)
+    return job
+
+
+def get_job(job_id: str):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def _run(job: ExportJob):
+    job.status = "running"
+    events.bus.publish("export", job.to_dict())
+    t0 = time.perf_counter()
+    db = ReportSession()
+    partial = None
+    try:
+        # Stamp and rows come from the same read transaction, so the key matches the content
+        key = job.cache_key(data_stamp(db, job.start_day, job.end_day))
+        path = _artifact_path(job, key)
+        if os.path.exists(path):
+            _finish_cached(job, path)
+            return
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        job.rows_total = exports.count_rows(db, job.start_day, job.end_day, job.filters)
+        partial = f"{path}.{job.id}.part"
+        if job.format == "xlsx":
+            with open(partial, "wb") as handle:
+                exports.write_orders_xlsx(db, job.start_day, job.end_day, handle, job.filters, job.advance)
+        else:
+            with open(partial, "w", encoding="utf-8", newline="") as handle:
+                exports.write_orders_csv(db, job.start_day, job.end_day, handle, job.filters, job.advance)
+        os.replace(partial, path)
+        partial = None
+
+        job.rows_done = job.rows_total
+        job.path = path
+        job.status = "done"
+        job.finished = time.time()
+        log.info("Export %s built", job.id, extra={
+            "format": job.format, "rows": job.rows_total, "ms": round((time.perf_counter() - t0) * 1000, 1),
+        })
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        job.finished = time.time()
+        log.exception("Export %s failed", job.id)
+    finally:
+        db.close()
+        if partial and os.path.exists(partial):
+            os.remove(partial)
+        events.bus.publish("export", job.to_dict())
+        prune()
+
+
+def prune(max_bytes: int = None) -> int:
+    """Drop least recently used artifacts until the folder fits the cap. Returns files removed."""
+    max_bytes = CACHE_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(EXPORT_DIR):
+        return 0
+    files = []
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        if name.endswith(".part"):  # still being written
+            continue
+        stat = os.stat(path)
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    # Newest first is kept; the most recent artifact always survives
+    for _, size, path in sorted(files)[:-1]:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:  # being downloaded on Windows, or already gone
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def status() -> dict:
+    """Recent jobs, newest first, and what the artifact cache holds."""
+    files = [os.path.join(EXPORT_DIR, name) for name in os.listdir(EXPORT_DIR)] if os.path.isdir(EXPORT_DIR) else []
+    with _lock:
+        jobs = sorted(_jobs.values(), key=lambda job: job.created, reverse=True)
+    return {
+        "jobs": [job.to_dict() for job in jobs],
+        "cache": {
+            "dir": EXPORT_DIR,
+            "files": len(files),
+            "bytes": sum(os.path.getsize(path) for path in files),
+            "max_bytes": CACHE_BYTES,
+        },
+    }
@@ -0,0 +1,221 @@
+"""Streaming order exports (XLSX and CSV) for /reports/orders-xlsx and /reports/orders-csv.
+
+Rows come from one flat Order/OrderItem/MenuItem query read in chunks, so
+memory stays flat no matter how long the range is. ``filters`` narrows the
+rows by the columns in ``FILTER_COLUMNS``; ``progress`` is called with the
+running row count every ``CHUNK_SIZE`` rows (see export_jobs.py).
+"""
+from sqlalchemy import func, cast, String
+from sqlalchemy.orm import Session
+from database import Order, OrderItem, MenuItem
+import archive, business_day
+import csv, io, tempfile
+
+CHUNK_SIZE = 1000
+STREAM_BLOCK = 64 * 1024
+
+HEADERS = [
+    "Date", "Order #", "Order Type", "Order Item", "Comments",
+    "Quantity Sold", "Discount Type", "Discount Name", "Discount ID",
+    "Total Discount", "Total Amount", "Net Total", "Cashier"
+]
+
+FILTER_COLUMNS = {"type": Order.type, "cashier": Order.cashier}
+
+
+def _filtered(query, start_day: int, end_day: int, filters: dict = None):
+    query = query.filter(Order.business_date.between(start_day, end_day))
+    for name, value in (filters or {}).items():
+        query = query.filter(FILTER_COLUMNS[name] == value)
+    return query
+
+
+def _line_query(db: Session, start_day: int, end_day: int, filters: dict = None):
+    archive.include(db, start_day, end_day)
+    return _filtered(
+        db.query(
+            Order.id, Order.created_at, Order.type, Order.total, Order.discount, Order.cashier,
+            MenuItem.name, OrderItem.notes, OrderItem.quantity,
+            OrderItem.discount_person_type, OrderItem.discount_person_name, OrderItem.discount_person_id,
+        )
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(MenuItem, MenuItem.id == OrderItem.menu_item_id),
+        start_day, end_day, filters,
+    ).order_by(Order.id, OrderItem.id)
+
+
+def count_rows(db: Session, start_day: int, end_day: int, filters: dict = None) -> int:
+    archive.include(db, start_day, end_day)
+    query = _filtered(
+        db.query(func.count(OrderItem.id))
+        .select_from(Order)
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(MenuItem, MenuItem.id == OrderItem.menu_item_id),
+        start_day, end_day, filters,
+    )
+    return query.scalar()
+
+
+def export_rows(db: Session, start_day: int, end_day: int, item_totals: dict = None,
+                filters: dict = None, progress=None):
+    """Yield one report row per order line; only the first line of an order carries order fields."""
+    last_order_id = None
+    for count, (order_id, created_at, order_type, total, discount, cashier,
+                name, notes, quantity, discount_type, discount_name, discount_id) in enumerate(
+            _line_query(db, start_day, end_day, filters).yield_per(CHUNK_SIZE), 1):
+        if progress is not None and count % CHUNK_SIZE == 0:
+            progress(count)
+        total = float(total or 0)
+        discount = float(discount or 0)
+        first_row = order_id != last_order_id
+        last_order_id = order_id
+
+        if item_totals is not None:
+            item_totals[name] = item_totals.get(name, 0) + quantity
+
+        discount_type = discount_type or ""
+        discount_name = discount_name or ""
+        discount_id = discount_id or ""
+
+        # For coupons/vouchers, reflect type as "Coupon", use code as ID
+        if discount_type.lower() in ["coupon", "voucher"]:
+            discount_type = "Coupon"
+            discount_id = discount_id or "Code"
+
+        yield [
+            business_day.to_local(created_at).strftime("%Y-%m-%d %H:%M") if first_row else "",
+            order_id if first_row else "",
+            order_type or "N/A" if first_row else "",
+            name,
+            notes or "",
+            quantity,
+            discount_type if first_row else "",
+            discount_name if first_row else "",
+            discount_id if first_row else "",
+            discount if first_row else "",
+            total if first_row else "",
+            total - discount if first_row else "",
+            cashier or "" if first_row else "",
+        ]
+
+
+def _column_widths(db: Session, start_day: int, end_day: int, filters: dict = None) -> list:
+    """Size every column from one MAX(LENGTH(...)) pass.
+
+    Write-only sheets emit their column widths before the first row, so they
+    can't be measured while the rows are written.
+    """
+    def longest(column):
+        return func.coalesce(func.max(func.length(cast(column, String))), 0)
+
+    archive.include(db, start_day, end_day)
+    row = _filtered(
+        db.query(
+            longest(Order.id), longest(Order.type), longest(MenuItem.name), longest(OrderItem.notes),
+            longest(OrderItem.quantity), longest(OrderItem.discount_person_type),
+            longest(OrderItem.discount_person_name), longest(OrderItem.discount_person_id),
+            longest(Order.discount), longest(Order.total), longest(Order.total), longest(Order.cashier),
+        )
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(MenuItem, MenuItem.id == OrderItem.menu_item_id),
+        start_day, end_day, filters,
+    ).one()
+    data_lengths = [len("YYYY-MM-DD HH:MM"), *row]
+    return [max(len(header), length or 0) + 2 for header, length in zip(HEADERS, data_lengths)]
+
+
+def _header_cells(ws, headers, color):
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+
+    thin_border = Border(
+        left=Side(style="thin"), right=Side(style="thin"),
+        top=Side(style="thin"), bottom=Side(style="thin")
+    )
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        cell.alignment = Alignment(horizontal="center")
+        cell.border = thin_border
+        cells.append(cell)
+    return cells
+
+
+def _stream_file(handle):
+    handle.seek(0)
+    while True:
+        block = handle.read(STREAM_BLOCK)
+        if not block:
+            break
+        yield block
+
+
+def write_orders_xlsx(db: Session, start_day: int, end_day: int, target, filters: dict = None, progress=None):
+    """Write the two-sheet orders workbook to a binary file object."""
+    # openpyxl is slow to import and only needed here, so keep it off the startup path
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+
+    wb = openpyxl.Workbook(write_only=True)
+
+    # === Sheet 1: Orders Report ===
+    ws = wb.create_sheet("Orders Report")
+    for col_num, width in enumerate(_column_widths(db, start_day, end_day, filters), 1):
+        ws.column_dimensions[get_column_letter(col_num)].width = width
+    ws.append(_header_cells(ws, HEADERS, "df4444"))
+
+    item_totals = {}
+    for row in export_rows(db, start_day, end_day, item_totals, filters, progress):
+        ws.append(row)
+
+    # === Sheet 2: Item Totals ===
+    ws2 = wb.create_sheet("Item Totals")
+    item_headers = ["Item", "Total Quantity Sold"]
+    name_width = max([len(item_headers[0])] + [len(str(name)) for name in item_totals])
+    qty_width = max([len(item_headers[1])] + [len(str(qty)) for qty in item_totals.values()])
+    ws2.column_dimensions["A"].width = name_width + 2
+    ws2.column_dimensions["B"].width = qty_width + 2
+    ws2.append(_header_cells(ws2, item_headers, "1dbfc1"))
+    for item_name, total_qty in item_totals.items():
+        ws2.append([item_name, total_qty])
+
+    wb.save(target)
+
+
+def stream_orders_xlsx(session_factory, start_day: int, end_day: int):
+    """Build the workbook through a temp file and stream it out in blocks."""
+    db = session_factory()
+    try:
+        with tempfile.TemporaryFile() as handle:
+            write_orders_xlsx(db, start_day, end_day, handle)
+            db.close()
+            yield from _stream_file(handle)
+    finally:
+        db.close()
+
+
+def write_orders_csv(db: Session, start_day: int, end_day: int, target, filters: dict = None, progress=None):
+    """Write the orders report as CSV to a text file object."""
+    writer = csv.writer(target)
+    writer.writerow(HEADERS)
+    writer.writerows(export_rows(db, start_day, end_day, filters=filters, progress=progress))
+
+
+def stream_orders_csv(session_factory, start_day: int, end_day: int):
+    """Yield the orders report as CSV text, one chunk of rows at a time."""
+    db = session_factory()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(HEADERS)
+        for count, row in enumerate(export_rows(db, start_day, end_day), 1):
+            writer.writerow(row)
+            if count % CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        db.close()
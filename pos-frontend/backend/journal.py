@@ -0,0 +1,95 @@
+"""Append-only journal of order changes, shipped to head office by sync.py.
+
+Every order mutation in main.py appends one ``OrderEvent`` in the same
+transaction as the change. The event carries the order's full state after
+the change (its lines included), so applying a branch's events in sequence
+order rebuilds its orders exactly. A deleted order only carries its id.
+``seed`` journals a "snapshot" of orders that predate the journal.
+"""
+from sqlalchemy import select, insert, exists
+from sqlalchemy.orm import Session
+from database import Order, OrderItem, MenuItem, OrderEvent
+from json_response import dumps
+import logging
+
+log = logging.getLogger("pub_express.journal")
+
+ORDER_FIELDS = (
+    "id", "created_at", "business_date", "status", "is_paid", "total", "discount", "paid",
+    "type", "cashier", "receipt_number", "cancel_reason", "notes",
+)
+LINE_FIELDS = (
+    "id", "menu_item_id", "quantity", "unit_price", "line_subtotal", "line_discount", "discount_rule_id", "vat_applied",
+    "discount_person_type", "discount_person_name", "discount_person_id",
+    "manual_discount_type", "manual_discount_value", "notes",
+)
+SEED_CHUNK = 2000
+
+
+def _lines(db: Session, order_ids: list) -> dict:
+    """order id -> its lines, each with the menu item name as sold."""
+    stmt = (
+        select(OrderItem.order_id, *(getattr(OrderItem, name) for name in LINE_FIELDS), MenuItem.name)
+        .outerjoin(MenuItem, MenuItem.id == OrderItem.menu_item_id)
+        .where(OrderItem.order_id.in_(order_ids))
+        .order_by(OrderItem.id)
+    )
+    lines = {}
+    for row in db.execute(stmt):
+        line = dict(zip(LINE_FIELDS, row[1:-1]))
+        line["name"] = row[-1]
+        lines.setdefault(row[0], []).append(line)
+    return lines
+
+
+def _payload(order: dict, lines: list) -> str:
+    return dumps({"order": order, "items": lines}).decode()
+
+
+def append(db: Session, action: str, order: Order) -> None:
+    """Journal ``order`` as it stands now; call after the change, before commit."""
+    if action == "deleted":
+        payload = _payload({"id": order.id}, [])
+    else:
+        db.flush()
+        state = {name: getattr(order, name) for name in ORDER_FIELDS}
+        payload = _payload(state, _lines(db, [order.id]).get(order.id, []))
+    db.execute(insert(OrderEvent), {"order_id": order.id, "action": action, "payload": payload})
+
+
+def seed(db: Session) -> int:
+    """Journal a "snapshot" of every order that has no event yet. Returns how many."""
+    unjournaled = ~exists().where(OrderEvent.order_id == Order.id)
+    columns = [getattr(Order, name) for name in ORDER_FIELDS]
+    seeded, last_id = 0, 0
+    while True:
+        rows = db.execute(
+            select(*columns).where(unjournaled, Order.id > last_id).order_by(Order.id).limit(SEED_CHUNK)
+        ).all()
+        if not rows:
+            break
+        lines = _lines(db, [row.id for row in rows])
+        db.execute(insert(OrderEvent), [
+            {"order_id": row.id, "action": "snapshot",
+             "payload": _payload(dict(zip(ORDER_FIELDS, row)), lines.get(row.id, []))}
+            for row in rows
+        ])
+        db.commit()
+        seeded += len(rows)
+        last_id = rows[-1].id
+    if seeded:
+        log.info("Journaled a snapshot of %s existing order(s)", seeded)
+    return seeded
+
+
+def events_after(db: Session, seq: int, limit: int) -> list:
+    return db.execute(
+        select(OrderEvent.seq, OrderEvent.order_id, OrderEvent.action, OrderEvent.created_at, OrderEvent.payload)
+        .where(OrderEvent.seq > seq)
+        .order_by(OrderEvent.seq)
+        .limit(limit)
+    ).all()
+
+
+def last_seq(db: Session) -> int:
+    return db.query(OrderEvent.seq).order_by(OrderEvent.seq.desc()).limit(1).scalar() or 0
@@ -0,0 +1,59 @@
+"""JSON responses built from plain dicts and lists, skipping response_model validation.
+
+Uses orjson when it is installed (stdlib json otherwise). Bodies over
+``COMPRESS_MIN_BYTES`` are compressed with brotli or gzip, whichever the
+client accepts (brotli only when the package is installed).
+"""
+from fastapi import Request, Response
+from datetime import date, datetime
+import gzip, json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = 32 * 1024
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def json_response(request: Request, payload, headers: dict = None, status_code: int = 200) -> Response:
+    body = dumps(payload)
+    headers = dict(headers or {})
+
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = _accepted_encodings(request)
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
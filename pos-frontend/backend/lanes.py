@@ -0,0 +1,150 @@
+"""Execution lanes: report and export work runs apart from order taking.
+
+Sync endpoints share Starlette's thread pool (anyio's default limiter).
+Report and export endpoints instead go through ``report_lane``. That lane
+runs at most ``PUB_EXPRESS_REPORT_WORKERS`` jobs at once, each on a
+read-only session. A request that cannot start within
+``PUB_EXPRESS_REPORT_QUEUE_SECONDS``, or that finds
+``PUB_EXPRESS_REPORT_QUEUE`` requests already waiting, gets 503 with
+Retry-After. So however many reports are asked for, the default pool's
+threads stay free for the cashier endpoints.
+
+Set ``PUB_EXPRESS_REPORT_LANE=0`` to run reports in the shared pool as before.
+"""
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from database import ReportSession
+import anyio, asyncio, logging, math, os, time
+
+log = logging.getLogger("pub_express.lanes")
+
+REPORT_WORKERS = int(os.environ.get("PUB_EXPRESS_REPORT_WORKERS", 2))
+REPORT_QUEUE = int(os.environ.get("PUB_EXPRESS_REPORT_QUEUE", 16))
+REPORT_QUEUE_SECONDS = float(os.environ.get("PUB_EXPRESS_REPORT_QUEUE_SECONDS", 20))
+REPORT_LANE_ENABLED = os.environ.get("PUB_EXPRESS_REPORT_LANE", "1") != "0"
+
+_END = object()
+
+
+class Lane:
+    def __init__(self, name: str, workers: int, queue_limit: int, queue_seconds: float,
+                 session_factory, enabled: bool = True):
+        self.name = name
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.queue_seconds = queue_seconds
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+        self.completed = 0
+        self.queued_seconds = 0.0
+        self._limiters = None     # (event loop, admission limiter, thread limiter)
+
+    def _limiters_for_loop(self):
+        # anyio limiters belong to the event loop they were first used on
+        loop = asyncio.get_running_loop()
+        if self._limiters is None or self._limiters[0] is not loop:
+            self._limiters = (loop, anyio.CapacityLimiter(self.workers), anyio.CapacityLimiter(self.workers))
+        return self._limiters[1], self._limiters[2]
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        log.warning("%s lane rejected a request: %s", self.name, reason,
+                    extra={"lane": self.name, "running": self.running, "waiting": self.waiting})
+        raise HTTPException(
+            status_code=503,
+            detail=f"Reports are busy ({reason}). Try again shortly.",
+            headers={"Retry-After": str(max(1, math.ceil(self.queue_seconds / 2)))},
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the lane's workers, waiting at most ``queue_seconds`` for it."""
+        admission, _ = self._limiters_for_loop()
+        if self.waiting >= self.queue_limit:
+            self._reject(f"{self.waiting} waiting")
+        self.waiting += 1
+        t0 = time.perf_counter()
+        try:
+            with anyio.fail_after(self.queue_seconds):
+                await admission.acquire()
+        except TimeoutError:
+            self._reject(f"waited {self.queue_seconds:g}s")
+        finally:
+            self.waiting -= 1
+            self.queued_seconds += time.perf_counter() - t0
+
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.completed += 1
+            admission.release()
+
+    def _call(self, fn, args, kwargs):
+        db = self.session_factory()
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+
+    async def run(self, fn, *args, **kwargs):
+        """``fn(db, *args, **kwargs)`` on a fresh session of this lane, off the shared thread pool."""
+        if not self.enabled:
+            return await run_in_threadpool(self._call, fn, args, kwargs)
+        async with self.slot():
+            _, threads = self._limiters_for_loop()
+            return await anyio.to_thread.run_sync(self._call, fn, args, kwargs, limiter=threads)
+
+    def streaming_response(self, make_iterator, **kwargs) -> StreamingResponse:
+        """Stream ``make_iterator(session_factory)``; the whole download holds one worker."""
+        if not self.enabled:
+            return StreamingResponse(make_iterator(self.session_factory), **kwargs)
+        return _LaneStreamingResponse(self, make_iterator, **kwargs)
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "completed": self.completed,
+        }
+
+
+class _LaneStreamingResponse(StreamingResponse):
+    def __init__(self, lane: Lane, make_iterator, **kwargs):
+        self.lane = lane
+        self.make_iterator = make_iterator
+        super().__init__(self._chunks(), **kwargs)
+
+    async def _chunks(self):
+        _, threads = self.lane._limiters_for_loop()
+        iterator = self.make_iterator(self.lane.session_factory)
+        try:
+            while True:
+                chunk = await anyio.to_thread.run_sync(next, iterator, _END, limiter=threads)
+                if chunk is _END:
+                    break
+                yield chunk
+        finally:
+            # Runs the generator's cleanup (closing its session) on a worker thread
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(iterator.close, limiter=threads)
+
+    async def __call__(self, scope, receive, send):
+        # Admission happens before the response starts, so a full lane can still answer 503
+        async with self.lane.slot():
+            await super().__call__(scope, receive, send)
+
+
+report_lane = Lane(
+    "reports", REPORT_WORKERS, REPORT_QUEUE, REPORT_QUEUE_SECONDS,
+    ReportSession, enabled=REPORT_LANE_ENABLED,
+)
@@ -0,0 +1,57 @@
+"""Logging setup for the backend.
+
+Modules log through ``logging.getLogger("pub_express.<module>")`` with
+%-style arguments and ``extra={...}`` fields, so a disabled level costs one
+level check. ``PUB_EXPRESS_LOG_LEVEL`` sets the level (INFO by default), and
+``PUB_EXPRESS_LOG_FORMAT=json`` switches to one JSON object per line.
+"""
+import json, logging, os, sys
+
+LOG_LEVEL = os.environ.get("PUB_EXPRESS_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("PUB_EXPRESS_LOG_FORMAT", "text")
+
+# Attributes every LogRecord has; anything else came in through extra={...}
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def _fields(record) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Attach one stderr handler to the "pub_express" logger. Safe to call more than once."""
+    logger = logging.getLogger("pub_express")
+    logger.setLevel(level)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        logger.addHandler(handler)
+    for handler in logger.handlers:
+        handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    return logger
@@ -1,16 +1,35 @@
-from fastapi import FastAPI, Depends, HTTPException, Body, Query
+from startup import boot
+from fastapi import FastAPI, Depends, HTTPException, Body, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from sqlalchemy import func, update
+from fastapi.responses import StreamingResponse, FileResponse
+from sqlalchemy import func, update, insert, tuple_, literal, String
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from database import *
 from schemas import *
-from typing import List, Optional
-from datetime import date as dt_date, datetime, time
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from openpyxl.utils import get_column_letter
-import csv, io, shutil, os, openpyxl
+from reports import (
+    summarize_range, sales_series, item_sales_matrix, top_items, discount_usage, discount_amounts, line_revenue,
+    rollups_ready, SERIES_BUCKETS, MATRIX_MAX_DAYS,
+)
+from rollups import rollup_update, ensure_rollups, rebuild_rollups
+from migrations import run_migrations, ensure_business_dates
+from exports import stream_orders_xlsx, stream_orders_csv
+from receipts import next_receipt_number, reserve_block
+from json_response import json_response
+from lanes import report_lane
+import order_payloads
+import menu_cache, backups, metrics, business_day, events, export_jobs, journal, sync, archive, pricing, analytics, baskets
+from log_config import configure_logging
+from typing import List, Optional, Union
+from datetime import date as dt_date, datetime
+import base64, logging, os, sqlite3
+
+boot.mark("imports")
+
+configure_logging()
+log = logging.getLogger("pub_express.main")
+metrics.instrument_engine(engine)
+metrics.instrument_engine(report_engine)
 
 app = FastAPI()
 
@@ -20,10 +39,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag"],
 )
 
-# ✅ Create the tables
-Base.metadata.create_all(bind=engine)
+# Outermost, so latency covers CORS handling and streamed bodies
+app.add_middleware(metrics.MetricsMiddleware)
 
 # ✅ Dependency to get the DB session
 def get_db():
@@ -38,397 +58,424 @@ def read_root():
     return {"message": "Hello, FastAPI!"}
 
 
+# --- Startup --- #
+
+
+@app.on_event("startup")
+def run_startup():
+    # ✅ Only what requests depend on runs before serving
+    with boot.phase("create tables"):
+        Base.metadata.create_all(bind=engine)
+    with boot.phase("migrations"):
+        run_migrations(engine)
+    with boot.phase("supervisor pin"):
+        ensure_supervisor_pin_exists()
+    boot.serving()
+
+    # ✅ Heavy maintenance runs in the background
+    boot.start_background([
+        ("cleanup orphan order items", cleanup_orphan_order_items),
+        ("rollups", backfill_rollups),
+        ("scheduled backups", backups.run_due_backups),
+        ("prune export cache", export_jobs.prune),
+        ("archive repair", archive.repair),
+        ("analytics refresh", refresh_analytics),
+    ])
+    backups.start_scheduler()
+    sync.start_scheduler()
+
+@app.get("/health/ready")
+def readiness():
+    return boot.status()
+
+@app.get("/metrics")
+def get_metrics():
+    backup_runs = backups.backup_status()["last_runs"]
+    gauges = [
+        ("pub_express_db_pool_checked_out", "Pooled connections in use.",
+         [("", engine.pool.checkedout())]),
+        ("pub_express_event_subscribers", "Open /events/stream connections.",
+         [("", events.subscriber_count())]),
+        ("pub_express_report_lane_running", "Report and export jobs running.",
+         [("", report_lane.running)]),
+        ("pub_express_report_lane_waiting", "Report and export jobs waiting for a worker.",
+         [("", report_lane.waiting)]),
+        ("pub_express_report_lane_rejected", "Report and export requests turned away with 503 since start.",
+         [("", report_lane.rejected)]),
+        ("pub_express_backup_last_duration_seconds", "Duration of the last backup per schedule.",
+         [(f'schedule="{name}"', run["ms"] / 1000) for name, run in backup_runs.items()]),
+        ("pub_express_backup_last_size_bytes", "File size of the last backup per schedule.",
+         [(f'schedule="{name}"', run["file_bytes"]) for name, run in backup_runs.items()]),
+    ]
+    return Response(content=metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+# --- Live Events --- #
+
+
+@app.get("/events/stream")
+async def event_stream(request: Request, since: Optional[str] = None):
+    # Browsers resend the last id they saw when EventSource reconnects
+    last_event_id = request.headers.get("last-event-id") or since
+    return StreamingResponse(
+        events.stream(last_event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Head-Office Sync --- #
+
+
+@app.get("/sync/status")
+def get_sync_status():
+    return sync.status()
+
+@app.post("/sync/push")
+def push_sync():
+    try:
+        return sync.push()
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=502, detail=f"Head-office store unavailable: {e.__class__.__name__}")
+
+
+# --- Order Archive --- #
+
+
+@app.get("/archive/")
+def get_archive_status(db: Session = Depends(get_db)):
+    return archive.status(db)
+
+@app.post("/archive/run")
+def run_archive(older_than_days: Optional[int] = Query(None, ge=0)):
+    try:
+        return archive.archive_orders(older_than_days)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/archive/verify")
+def verify_archive():
+    return archive.verify()
+
+@app.post("/archive/orders/{order_id}/restore")
+def restore_archived_order(order_id: int):
+    try:
+        return archive.restore_order(order_id)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 # --- Admin Sales Report --- #
 
 
-@app.get("/summary/range", response_model=SalesSummary)
-def get_sales_summary_range(
-    start_date: str,
-    end_date: str,
-    db: Session = Depends(get_db),
-):
+def _parse_day(value: str) -> int:
+    """A YYYY-MM-DD query parameter as a business date (see business_day.py)."""
     try:
-        start_dt = datetime.combine(datetime.strptime(start_date, "%Y-%m-%d"), time.min)
-        end_dt = datetime.combine(datetime.strptime(end_date, "%Y-%m-%d"), time.max)
+        return business_day.parse(value)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
 
-    # --- Paid Orders ---
-    orders_paid = db.query(Order).filter(
-        Order.is_paid == True,
-        Order.created_at >= start_dt,
-        Order.created_at <= end_dt
-    ).all()
-
-    # --- Unpaid Orders ---
-    orders_unpaid = db.query(Order).filter(
-        Order.is_paid == False,
-        Order.created_at >= start_dt,
-        Order.created_at <= end_dt
-    ).all()
-
-    # --- Total Sales ---
-    total_paid = sum(order.total for order in orders_paid)
-    total_unpaid = sum(order.total for order in orders_unpaid)
-
-    # --- Dine-in ---
-    dine_in_orders = [o for o in orders_paid if (o.type or "").lower() == "dine-in"]
-    dine_in_count = len(dine_in_orders)
-    dine_in_sales = sum(o.total for o in dine_in_orders)
-
-    # --- Take-out ---
-    take_out_orders = [o for o in orders_paid if (o.type or "").lower() == "take-out"]
-    take_out_count = len(take_out_orders)
-    take_out_sales = sum(o.total for o in take_out_orders)
-    
-    # --- Void Orders ---
-    void_orders = db.query(Order).filter(
-        Order.is_paid == True,
-        Order.cancel_reason.isnot(None),
-        Order.created_at >= start_dt,
-        Order.created_at <= end_dt
-    ).count()
+# Report and export endpoints are async and hand their work to report_lane
+# (lanes.py), keeping the shared thread pool for order taking.
 
-    return {
-        "total_paid": total_paid,
-        "total_unpaid": total_unpaid,
-        "orders_paid": len(orders_paid),
-        "orders_unpaid": len(orders_unpaid),
-        "total_discount": sum(order.discount or 0 for order in orders_paid),
-        "dine_in_count": dine_in_count,
-        "dine_in_sales": dine_in_sales,
-        "take_out_count": take_out_count,
-        "take_out_sales": take_out_sales,
-        "void_orders": void_orders
-        
-    }
+@app.get("/summary/range", response_model=SalesSummary)
+async def get_sales_summary_range(
+    start_date: str,
+    end_date: str,
+):
+    return await report_lane.run(summarize_range, _parse_day(start_date), _parse_day(end_date))
 
 
 # --- Database Backup --- #
 
 
-@app.on_event("startup")
-def auto_backup_monthly():
-    backup_folder = "backups"
-    os.makedirs(backup_folder, exist_ok=True)
-
-    today = datetime.now()
-    backup_filename = f"backup_{today.year}-{today.month:02d}.db"
-    backup_path = os.path.join(backup_folder, backup_filename)
+@app.get("/backups/")
+def get_backups():
+    return backups.backup_status()
 
-    if not os.path.exists(backup_path):
-        shutil.copyfile("pub_express.db", backup_path)
-        print(f"Monthly backup created: {backup_filename}")
-    else:
-        print(f"Monthly backup already exists for {today.year}-{today.month:02d}")
+@app.post("/backups/{schedule}")
+def create_backup(schedule: str):
+    if schedule not in backups.SCHEDULES:
+        raise HTTPException(status_code=400, detail=f"Unknown schedule. Use one of: {', '.join(backups.SCHEDULES)}")
+    try:
+        return backups.run_backup(schedule)
+    except (sqlite3.Error, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Backup failed: {e}")
 
 
 # --- Dashboard --- #
 
 
 @app.get("/dashboard/today-summary")
-def get_today_summary(db: Session = Depends(get_db)):
-    today = dt_date.today()
-    start = datetime.combine(today, datetime.min.time())
-    end = datetime.combine(today, datetime.max.time())
-
-    total_sales = db.query(func.sum(Order.total)).filter(
-        Order.is_paid == True,
-        Order.created_at.between(start, end),
-        Order.cancel_reason == None
-    ).scalar() or 0.0
-
-    total_discount = db.query(func.sum(Order.discount)).filter(
-        Order.is_paid == True,
-        Order.created_at.between(start, end),
-        Order.cancel_reason == None
-    ).scalar() or 0.0
-
-    total_orders = db.query(Order).filter(
-        Order.is_paid == True,
-        Order.created_at.between(start, end),
-        Order.cancel_reason == None
-    ).count()
-
-    # New: Count void orders
-    void_orders = db.query(Order).filter(
-        Order.cancel_reason.isnot(None),
-        Order.created_at.between(start, end)
-    ).count()
+async def get_today_summary():
+    today = business_day.today()
+    # Taken before reading, so a client resuming from it gets at worst a repeated delta, never a gap
+    last_event_id = events.bus.last_id()
+
+    summary = await report_lane.run(summarize_range, today, today, include_unpaid=False)
+    total_sales = summary["valid_sales"]
+    total_orders = summary["valid_orders"]
 
     return {
         "total_sales": round(total_sales, 2),
-        "total_discount": round(total_discount, 2),
+        "total_discount": round(summary["valid_discount"], 2),
         "total_orders": total_orders,
         "average_order_value": round(total_sales / total_orders, 2) if total_orders else 0.0,
-        "void_orders": void_orders
+        "void_orders": summary["canceled_orders"],
+        "business_date": today,
+        "last_event_id": last_event_id,
     }
 
 @app.get("/reports/top-items")
-def top_selling_items(
+async def top_selling_items(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     limit: int = 10,
-    db: Session = Depends(get_db),
 ):
-    query = db.query(
-        MenuItem.name,
-        func.sum(OrderItem.quantity).label("total_sold")
-    ).join(OrderItem.menu_item).join(OrderItem.order)
-
     if start_date and end_date:
-        start_dt = datetime.combine(datetime.strptime(start_date, "%Y-%m-%d"), time.min)
-        end_dt = datetime.combine(datetime.strptime(end_date, "%Y-%m-%d"), time.max)
-
-        query = query.filter(
-            Order.is_paid == True,
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        )
+        start_day, end_day = _parse_day(start_date), _parse_day(end_date)
     else:
-        today = dt_date.today()
-        start_dt = datetime.combine(today, datetime.min.time())
-        end_dt = datetime.combine(today, datetime.max.time())
-        query = query.filter(
-            Order.is_paid == True,
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        )
+        start_day = end_day = business_day.today()
 
-    results = query.group_by(MenuItem.name).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(limit).all()
+    return await report_lane.run(top_items, start_day, end_day, limit)
 
-    return [{"item": name, "total_sold": total_sold} for name, total_sold in results]
 
+def _item_sales(db: Session, item_id: int, day: int):
+    archive.include(db, day, day)
+    return db.query(func.sum(OrderItem.quantity), func.sum(line_revenue())) \
+        .join(OrderItem.order) \
+        .filter(
+            Order.is_paid == True,
+            OrderItem.menu_item_id == item_id,
+            Order.business_date == day,
+        ) \
+        .one()
 
 @app.get("/reports/item-sales")
-def item_sales(
+async def item_sales(
     date: str = Query(...),
     item_id: int = Query(...),
-    db: Session = Depends(get_db),
 ):
     try:
-        date_dt = datetime.strptime(date, "%Y-%m-%d")
+        day = business_day.parse(date)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format.")
 
-    start = datetime.combine(date_dt, datetime.min.time())
-    end = datetime.combine(date_dt, datetime.max.time())
-
-    total_quantity = db.query(func.sum(OrderItem.quantity)) \
-        .join(OrderItem.order) \
-        .filter(
-            Order.is_paid == True,
-            OrderItem.menu_item_id == item_id,
-            Order.created_at >= start,
-            Order.created_at <= end
-        ) \
-        .scalar() or 0
+    total_quantity, revenue = await report_lane.run(_item_sales, item_id, day)
 
     return {
         "date": date,
-        "total_sales": total_quantity
+        "total_sales": total_quantity or 0,
+        "revenue": round(revenue or 0.0, 2),
     }
 
 
-def top_selling_items(
-    start_date: Optional[str] = Query(None),
-    end_date: Optional[str] = Query(None),
-    limit: int = 10,
-    db: Session = Depends(get_db),
+@app.get("/reports/item-sales-matrix")
+async def item_sales_matrix_report(
+    start_date: str,
+    end_date: str,
+    item_ids: Optional[List[int]] = Query(None),
 ):
-    query = db.query(
-        MenuItem.name,
-        func.sum(OrderItem.quantity).label("total_sold")
-    ).join(OrderItem.menu_item).join(OrderItem.order)
+    start_day, end_day = _parse_day(start_date), _parse_day(end_date)
+    if end_day < start_day:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date.")
+    if (business_day.to_date(end_day) - business_day.to_date(start_day)).days >= MATRIX_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"The range can span at most {MATRIX_MAX_DAYS} days.")
 
-    if start_date and end_date:
-        start_dt = datetime.combine(datetime.strptime(start_date, "%Y-%m-%d"), time.min)
-        end_dt = datetime.combine(datetime.strptime(end_date, "%Y-%m-%d"), time.max)
+    return await report_lane.run(item_sales_matrix, start_day, end_day, item_ids)
 
-        query = query.filter(
-            Order.is_paid == True,
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        )
-    else:
-        # Default to today's date if not provided
-        today = dt_date.today()
-        start_dt = datetime.combine(today, datetime.min.time())
-        end_dt = datetime.combine(today, datetime.max.time())
-        query = query.filter(
-            Order.is_paid == True,
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        )
 
-    results = query.group_by(MenuItem.name).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(limit).all()
+@app.get("/reports/item-pairs")
+async def item_pairs_report(
+    item_id: int,
+    start_date: str,
+    end_date: str,
+    limit: int = Query(10, ge=1, le=100),
+    sort: str = Query("orders"),
+    min_orders: int = Query(1, ge=1),
+):
+    """Items bought together with ``item_id``, with support, confidence and lift (see baskets.py)."""
+    start_day, end_day = _parse_day(start_date), _parse_day(end_date)
+    if end_day < start_day:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date.")
+    if sort not in baskets.SORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort. Use one of: {', '.join(baskets.SORTS)}")
 
-    return [{"item": name, "total_sold": total_sold} for name, total_sold in results]
+    return await report_lane.run(baskets.item_partners, item_id, start_day, end_day, limit, sort, min_orders)
 
-@app.get("/reports/orders-xlsx")
-def export_orders_xlsx(start_date: str, end_date: str, db: Session = Depends(get_db)):
-    orders = (
-        db.query(Order)
-        .filter(Order.created_at >= start_date)
-        .filter(Order.created_at <= end_date + " 23:59:59")
-        .all()
-    )
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Orders Report"
 
-    headers = [
-        "Date", "Order #", "Order Type", "Order Item", "Comments",
-        "Quantity Sold", "Discount Type", "Discount Name", "Discount ID",
-        "Total Discount", "Total Amount", "Net Total", "Cashier"
-    ]
-    ws.append(headers)
-
-    # Styling
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="df4444", end_color="df4444", fill_type="solid")
-    thin_border = Border(
-        left=Side(style="thin"), right=Side(style="thin"),
-        top=Side(style="thin"), bottom=Side(style="thin")
-    )
+# --- Analytics (see analytics.py) --- #
+
+
+def _analytics_range(start_date: str, end_date: str):
+    start_day, end_day = _parse_day(start_date), _parse_day(end_date)
+    if end_day < start_day:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date.")
+    return start_day, end_day
+
+async def _run_analytics(fn, *args):
+    try:
+        return await report_lane.run(fn, *args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/heatmap")
+async def analytics_heatmap(
+    start_date: str,
+    end_date: str,
+    measure: str = Query("sales"),
+    type: Optional[str] = Query(None),
+    cashier: Optional[str] = Query(None),
+    discount_type: Optional[str] = Query(None),
+):
+    start_day, end_day = _analytics_range(start_date, end_date)
+    filters = {"order_type": type, "cashier": cashier, "discount_type": discount_type}
+    return await _run_analytics(analytics.heatmap, start_day, end_day, measure, filters)
 
-    for col_num, _ in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center")
-        cell.border = thin_border
-
-    item_totals = {}
-
-    for order in orders:
-        total = float(order.total or 0)
-        discount = float(order.discount or 0)
-        net_total = total - discount
-
-        first_row = True
-        for item in order.items:
-            name = item.menu_item.name
-            item_totals[name] = item_totals.get(name, 0) + item.quantity
-
-            discount_type = item.discount_person_type or ""
-            discount_name = item.discount_person_name or ""
-            discount_id = item.discount_person_id or ""
-
-            # For coupons/vouchers, reflect type as "Coupon", use code as ID
-            if discount_type.lower() in ["coupon", "voucher"]:
-                discount_type = "Coupon"
-                discount_id = item.discount_person_id or "Code"
-
-            row = [
-                order.created_at.strftime("%Y-%m-%d %H:%M") if first_row else "",
-                order.id if first_row else "",
-                order.type or "N/A" if first_row else "",
-                name,
-                item.notes or "",
-                item.quantity,
-                discount_type if first_row else "",
-                discount_name if first_row else "",
-                discount_id if first_row else "",
-                discount if first_row else "",
-                total if first_row else "",
-                net_total if first_row else "",
-                order.cashier or "" if first_row else "",
-            ]
-            ws.append(row)
-            first_row = False
-
-    # Auto width for Sheet 1
-    for column in ws.columns:
-        max_length = max(len(str(cell.value or "")) for cell in column)
-        ws.column_dimensions[get_column_letter(column[0].column)].width = max_length + 2
-
-    # === Sheet 2: Item Totals ===
-    ws2 = wb.create_sheet("Item Totals")
-    ws2.append(["Item", "Total Quantity Sold"])
-
-    for item_name, total_qty in item_totals.items():
-        ws2.append([item_name, total_qty])
-
-    for col_num in range(1, 3):
-        cell = ws2.cell(row=1, column=col_num)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="1dbfc1", end_color="1dbfc1", fill_type="solid")
-        cell.alignment = Alignment(horizontal="center")
-        cell.border = thin_border
-
-    for column in ws2.columns:
-        max_length = max(len(str(cell.value or "")) for cell in column)
-        ws2.column_dimensions[get_column_letter(column[0].column)].width = max_length + 2
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+@app.get("/analytics/item-hours")
+async def analytics_item_hours(
+    start_date: str,
+    end_date: str,
+    measure: str = Query("quantity"),
+    item_ids: Optional[List[int]] = Query(None),
+    type: Optional[str] = Query(None),
+    cashier: Optional[str] = Query(None),
+):
+    start_day, end_day = _analytics_range(start_date, end_date)
+    filters = {"order_type": type, "cashier": cashier}
+    return await _run_analytics(analytics.item_hour_matrix, start_day, end_day, measure, item_ids, filters)
+
+@app.get("/analytics/group")
+async def analytics_group(
+    start_date: str,
+    end_date: str,
+    by: List[str] = Query(...),
+    measure: str = Query("sales"),
+    type: Optional[str] = Query(None),
+    cashier: Optional[str] = Query(None),
+    discount_type: Optional[str] = Query(None),
+):
+    start_day, end_day = _analytics_range(start_date, end_date)
+    filters = {"order_type": type, "cashier": cashier, "discount_type": discount_type}
+    return await _run_analytics(analytics.group_by, by, start_day, end_day, measure, filters)
+
+@app.get("/analytics/")
+def analytics_status():
+    return analytics.status()
+
+@app.post("/analytics/rebuild")
+async def rebuild_analytics():
+    return await report_lane.run(analytics.rebuild)
+
+
+def _export_range(start_date: str, end_date: str):
+    return _parse_day(start_date), _parse_day(end_date)
+
+@app.get("/reports/orders-xlsx")
+async def export_orders_xlsx(start_date: str, end_date: str):
+    start_day, end_day = _export_range(start_date, end_date)
 
     filename = f"PubExpress_Sales_Report_{start_date}_to_{end_date}.xlsx"
-    return StreamingResponse(
-        iter([output.getvalue()]),
+    return report_lane.streaming_response(
+        lambda session_factory: stream_orders_xlsx(session_factory, start_day, end_day),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-@app.get("/dashboard/discount-usage")
-def get_discount_usage(db: Session = Depends(get_db)):
-    today = dt_date.today()
-    start = datetime.combine(today, datetime.min.time())
-    end = datetime.combine(today, datetime.max.time())
-
-    results = (
-        db.query(OrderItem.discount_person_type, func.count(OrderItem.id))
-        .join(OrderItem.order)
-        .filter(Order.created_at.between(start, end))
-        .filter(Order.is_paid == True)
-        .filter(OrderItem.discount_person_type.isnot(None))
-        .group_by(OrderItem.discount_person_type)
-        .all()
+@app.get("/reports/orders-csv")
+async def export_orders_csv(start_date: str, end_date: str):
+    start_day, end_day = _export_range(start_date, end_date)
+
+    filename = f"PubExpress_Sales_Report_{start_date}_to_{end_date}.csv"
+    return report_lane.streaming_response(
+        lambda session_factory: stream_orders_csv(session_factory, start_day, end_day),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-    return [{"type": row[0], "count": row[1]} for row in results]
+# --- Export Jobs --- #
+# Background alternative to the two endpoints above: submit, poll (or follow
+# "export" events on /events/stream), then download. See export_jobs.py.
+
+@app.post("/exports/")
+def create_export_job(data: ExportJobCreate):
+    if data.format not in export_jobs.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(export_jobs.FORMATS)}.")
+    start_day, end_day = _export_range(data.start_date, data.end_date)
+    if end_day < start_day:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date.")
+
+    job = export_jobs.submit(data.format, start_day, end_day, {"type": data.type, "cashier": data.cashier})
+    return job.to_dict()
+
+@app.get("/exports/")
+def get_export_jobs():
+    return export_jobs.status()
+
+@app.get("/exports/{job_id}")
+def get_export_job(job_id: str):
+    job = export_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job.to_dict()
+
+@app.get("/exports/{job_id}/download")
+def download_export(job_id: str):
+    job = export_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.status != "done":
+        raise HTTPException(status_code=400, detail=f"Export is {job.status}, not ready to download")
+    if not os.path.exists(job.path):
+        raise HTTPException(status_code=404, detail="Export file was pruned from the cache; submit it again")
+    return FileResponse(job.path, media_type=export_jobs.FORMATS[job.format], filename=job.filename)
+
+@app.get("/dashboard/discount-usage")
+async def get_discount_usage():
+    today = business_day.today()
+    return await report_lane.run(discount_usage, today, today)
 
 # --- Sales Report --- #
 
 @app.get("/reports/daily-sales")
-def daily_sales_report(date: Optional[dt_date] = Query(default=None), db: Session = Depends(get_db)):
-    if date is None:
-        date = dt_date.today()
+async def daily_sales_report(date: Optional[dt_date] = Query(default=None)):
+    day = business_day.today() if date is None else business_day.from_date(date)
 
-    start_datetime = datetime.combine(date, datetime.min.time())
-    end_datetime = datetime.combine(date, datetime.max.time())
+    summary = await report_lane.run(summarize_range, day, day, include_unpaid=False)
 
-    total_sales = db.query(func.sum(Order.total)) \
-                    .filter(Order.is_paid == True) \
-                    .filter(Order.created_at >= start_datetime) \
-                    .filter(Order.created_at <= end_datetime) \
-                    .scalar() or 0.0
+    return {
+        "date": business_day.iso(day),
+        "total_orders": summary["orders_paid"],
+        "total_sales": summary["total_paid"]
+    }
 
-    total_orders = db.query(func.count(Order.id)) \
-                     .filter(Order.is_paid == True) \
-                     .filter(Order.created_at >= start_datetime) \
-                     .filter(Order.created_at <= end_datetime) \
-                     .scalar()
+
+@app.get("/reports/sales-series")
+async def sales_series_report(
+    start_date: str,
+    end_date: str,
+    bucket: str = Query("day"),
+):
+    if bucket not in SERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Invalid bucket. Use one of: {', '.join(SERIES_BUCKETS)}.")
+    start_day, end_day = _parse_day(start_date), _parse_day(end_date)
+    if end_day < start_day:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date.")
 
     return {
-        "date": date.isoformat(),
-        "total_orders": total_orders,
-        "total_sales": total_sales
+        "bucket": bucket,
+        "start_date": start_date,
+        "end_date": end_date,
+        "points": await report_lane.run(sales_series, start_day, end_day, bucket),
     }
 
 
-@app.get("/reports/discount-usage")
-def discount_usage_summary(
-    db: Session = Depends(get_db),
-):
-    results = (
+def _discount_usage_all_time(db: Session):
+    archive.include(db)
+    return (
         db.query(
             OrderItem.discount_person_type,
             func.count(OrderItem.id).label("count")
@@ -437,38 +484,24 @@ def discount_usage_summary(
         .group_by(OrderItem.discount_person_type)
         .all()
     )
-    return [{"type": d_type, "count": count} for d_type, count in results]
-
-@app.get("/summary/today", response_model=SalesSummary)
-def get_today_summary(db: Session = Depends(get_db)):
-    today = dt_date.today()
-    start = datetime.combine(today, datetime.min.time())
-    end = datetime.combine(today, datetime.max.time())
-    return compute_sales_summary(start, end, db)
 
+@app.get("/reports/discount-usage")
+async def discount_usage_summary():
+    results = await report_lane.run(_discount_usage_all_time)
+    return [{"type": d_type, "count": count} for d_type, count in results]
 
-def compute_sales_summary(start_dt: datetime, end_dt: datetime, db: Session):
-    orders_paid = db.query(Order).filter(
-        Order.is_paid == True,
-        Order.created_at >= start_dt,
-        Order.created_at <= end_dt
-    ).all()
+@app.get("/reports/discount-amounts")
+async def discount_amounts_report(start_date: str, end_date: str):
+    return await report_lane.run(discount_amounts, _parse_day(start_date), _parse_day(end_date))
 
-    orders_unpaid = db.query(Order).filter(
-        Order.is_paid == False,
-        Order.created_at >= start_dt,
-        Order.created_at <= end_dt
-    ).all()
+@app.get("/summary/today", response_model=SalesSummary)
+async def get_today_sales_summary():
+    today = business_day.today()
+    return await report_lane.run(lambda db: compute_sales_summary(today, today, db))
 
-    total_paid = sum(order.total for order in orders_paid)
-    total_unpaid = sum(order.total for order in orders_unpaid)
 
-    return {
-        "total_paid": total_paid,
-        "total_unpaid": total_unpaid,
-        "orders_paid": len(orders_paid),
-        "orders_unpaid": len(orders_unpaid)
-    }
+def compute_sales_summary(start_day: int, end_day: int, db: Session):
+    return summarize_range(db, start_day, end_day)
 
 # --- Menu Endpoints --- #
 
@@ -477,16 +510,22 @@ def create_menu_item(item: MenuItemCreate, db: Session = Depends(get_db)):
     db_item = MenuItem(**item.dict())
     db.add(db_item)
     try:
+        export_jobs.bump_data_version(db, export_jobs.MENU_VERSION_KEY)
         db.commit()
         db.refresh(db_item)
+        menu_cache.invalidate()
         return db_item
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=400, detail="Menu item name already exists.")
 
 @app.get("/menu/", response_model=list[MenuItemOut])
-def get_all_menu_items(db: Session = Depends(get_db)):
-    return db.query(MenuItem).all()
+def get_all_menu_items(request: Request, db: Session = Depends(get_db)):
+    menu = menu_cache.get_menu(db)
+    headers = {"ETag": menu.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == menu.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=menu.body, media_type="application/json", headers=headers)
 
 @app.put("/menu/{item_id}", response_model=MenuItemOut)
 def update_menu_item(
@@ -501,9 +540,11 @@ def update_menu_item(
     item.name = item_update.name
     item.category = item_update.category
     item.price = item_update.price
+    export_jobs.bump_data_version(db, export_jobs.MENU_VERSION_KEY)
 
     db.commit()
     db.refresh(item)
+    menu_cache.invalidate()
     return item
 
 @app.put("/orders/{order_id}/discount")
@@ -512,11 +553,30 @@ def update_order_discount(
     discount_data: DiscountUpdate,
     db: Session = Depends(get_db),
 ):
+    """Override the order's discount by spreading it over the lines as fixed manual discounts.
+
+    Shares are weighted by line subtotal and replace every line's discount,
+    rule discounts included, so the order's discount stays the sum of its
+    line discounts (see pricing.py).
+    """
     order = db.query(Order).filter(Order.id == order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    order.discount = discount_data.discount
+    subtotal = round(sum(item.line_subtotal or 0.0 for item in order.items), 2)
+    amount = round(discount_data.discount, 2)
+    if amount > subtotal:
+        raise HTTPException(status_code=400, detail=f"Discount can't exceed the order's {subtotal:.2f} subtotal.")
+
+    shares = pricing.spread_discount(amount, [item.line_subtotal for item in order.items])
+    with rollup_update(db, order):
+        for item, share in zip(order.items, shares):
+            item.manual_discount_type = "fixed" if share else None
+            item.manual_discount_value = share
+            item.line_discount = share
+            item.discount_rule_id = None
+        order.discount = round(sum(shares), 2)
+    _order_changed(db, "discount", order)
     db.commit()
     return {"message": f"Discount updated to {discount_data.discount} for order #{order_id}"}
 
@@ -526,55 +586,148 @@ def delete_menu_item(item_id: int, db: Session = Depends(get_db)):
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     db.delete(item)
+    export_jobs.bump_data_version(db, export_jobs.MENU_VERSION_KEY)
     db.commit()
+    menu_cache.invalidate()
     return {"message": "Item deleted"}
 
+# --- Discount Rule Endpoints --- #
+
+
+def _rule_values(rule: DiscountRuleCreate) -> dict:
+    values = rule.dict()
+    for name in ("valid_from", "valid_to"):
+        if values[name]:
+            values[name] = _parse_day(values[name])
+    try:
+        pricing.check_rule(values)
+    except pricing.PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return values
+
+@app.get("/discount-rules/", response_model=list[DiscountRuleOut])
+def get_discount_rules(db: Session = Depends(get_db)):
+    return db.query(DiscountRule).order_by(DiscountRule.id).all()
+
+@app.post("/discount-rules/", response_model=DiscountRuleOut)
+def create_discount_rule(rule: DiscountRuleCreate, db: Session = Depends(get_db)):
+    db_rule = DiscountRule(**_rule_values(rule))
+    db.add(db_rule)
+    db.commit()
+    db.refresh(db_rule)
+    pricing.invalidate()
+    return db_rule
+
+@app.put("/discount-rules/{rule_id}", response_model=DiscountRuleOut)
+def update_discount_rule(rule_id: int, rule: DiscountRuleCreate, db: Session = Depends(get_db)):
+    db_rule = db.query(DiscountRule).filter(DiscountRule.id == rule_id).first()
+    if not db_rule:
+        raise HTTPException(status_code=404, detail="Discount rule not found")
+    for name, value in _rule_values(rule).items():
+        setattr(db_rule, name, value)
+    db.commit()
+    db.refresh(db_rule)
+    pricing.invalidate()
+    return db_rule
+
+@app.delete("/discount-rules/{rule_id}")
+def delete_discount_rule(rule_id: int, db: Session = Depends(get_db)):
+    """Deactivate rather than delete: sold lines keep pointing at the rule that priced them."""
+    db_rule = db.query(DiscountRule).filter(DiscountRule.id == rule_id).first()
+    if not db_rule:
+        raise HTTPException(status_code=404, detail="Discount rule not found")
+    db_rule.active = False
+    db.commit()
+    pricing.invalidate()
+    return {"message": f"Discount rule #{rule_id} deactivated"}
+
+@app.post("/pricing/quote")
+def quote_order(order_data: OrderCreate, db: Session = Depends(get_db)):
+    """Price an order without saving it, for the till to show discounts as lines are added."""
+    book = pricing.get_rule_book(db)
+    for item in order_data.items:
+        if item.menu_item_id not in book.prices:
+            raise HTTPException(status_code=404, detail=f"Menu item {item.menu_item_id} not found")
+    try:
+        lines = pricing.price_order(book, order_data.items, business_day.utcnow())
+    except pricing.PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total = round(sum(line["line_subtotal"] for line in lines), 2)
+    discount = round(sum(line["line_discount"] for line in lines), 2)
+    return {"lines": lines, "total": total, "discount": discount, "due": round(total - discount, 2)}
+
 # --- Order Endpoints --- #
 
-@app.post("/orders/", response_model=OrderOut)
-def create_order(
-    order_data: OrderCreate,
-    db: Session = Depends(get_db),
-):
-    total = 0
+
+def _order_changed(db: Session, action: str, order: Order):
+    """Journal the change for head-office sync, queue its live event and mark its day's exports stale; call before commit."""
+    journal.append(db, action, order)
+    events.order_changed(db, action, order)
+    export_jobs.bump_data_version(db, order.business_date)
+
+def _insert_order(db: Session, order_data: OrderCreate, status: Optional[str] = None) -> Order:
+    """Validate and price every line with the compiled rule book, then bulk insert the lines.
+
+    The order's discount is the sum of its line discounts; the client's
+    order-level discount is ignored (see pricing.py).
+    """
+    book = pricing.get_rule_book(db)
+    for item in order_data.items:
+        if item.menu_item_id not in book.prices:
+            raise HTTPException(status_code=404, detail=f"Menu item {item.menu_item_id} not found")
+
+    created_at = business_day.utcnow()
+    try:
+        amounts = pricing.price_order(book, order_data.items, created_at)
+    except pricing.PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     order = Order(
+        created_at=created_at,
         notes=order_data.notes,
         type=order_data.type,
-        discount=order_data.discount or 0.0,
+        discount=round(sum(line["line_discount"] for line in amounts), 2),
         cashier=order_data.cashier,
+        total=round(sum(line["line_subtotal"] for line in amounts), 2),
     )
+    if status:
+        order.status = status
     db.add(order)
     db.flush()  # flush so order.id is available
 
-    for item in order_data.items:
-        menu_item = db.query(MenuItem).filter(MenuItem.id == item.menu_item_id).first()
-        if not menu_item:
-            raise HTTPException(status_code=404, detail=f"Menu item {item.menu_item_id} not found")
+    # Save OrderItems with possible discount person details
+    if order_data.items:
+        db.execute(insert(OrderItem), [
+            {
+                "order_id": order.id,
+                "menu_item_id": item.menu_item_id,
+                "quantity": item.quantity,
+                "discount_person_name": item.discount_person_name,
+                "discount_person_id": item.discount_person_id,
+                "discount_person_type": item.discount_person_type,
+                "manual_discount_type": item.manual_discount_type,
+                "manual_discount_value": item.manual_discount_value,
+                "vat_applied": bool(item.vat_applied),
+                "notes": item.notes,
+                **line,
+            }
+            for item, line in zip(order_data.items, amounts)
+        ])
+    return order
 
-        # Calculate subtotal
-        subtotal = menu_item.price * item.quantity
-        total += subtotal
-
-        # Save OrderItem with possible discount person details
-        db_item = OrderItem(
-            order_id=order.id,
-            menu_item_id=menu_item.id,
-            quantity=item.quantity,
-            discount_person_name=item.discount_person_name,
-            discount_person_id=item.discount_person_id,
-            discount_person_type=item.discount_person_type,
-            manual_discount_type=item.manual_discount_type,
-            manual_discount_value=item.manual_discount_value,
-            notes=item.notes,
-        )
-        db.add(db_item)
+@app.post("/orders/", response_model=OrderOut)
+def create_order(
+    order_data: OrderCreate,
+    db: Session = Depends(get_db),
+):
+    order = _insert_order(db, order_data)
 
-    # Set final total and payment status
-    order.total = total
-    due = total - (order_data.discount or 0.0)
-    order.paid = order_data.paid_amount or 0.0
-    order.is_paid = order.paid >= due
+    # Set payment status
+    with rollup_update(db, order):
+        due = order.total - (order.discount or 0.0)
+        order.paid = order_data.paid_amount or 0.0
+        order.is_paid = order.paid >= due
 
+    _order_changed(db, "created", order)
     db.commit()
     db.refresh(order)
     return order
@@ -586,6 +739,8 @@ def create_empty_order(
 ):
     new_order = Order(total=0.0, is_paid=False, paid=0.0)
     db.add(new_order)
+    db.flush()
+    _order_changed(db, "created", new_order)
     db.commit()
     db.refresh(new_order)
     return new_order
@@ -600,18 +755,33 @@ def add_item_to_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    menu_item = db.query(MenuItem).filter(MenuItem.id == item_data.menu_item_id).first()
-    if not menu_item:
+    book = pricing.get_rule_book(db)
+    if item_data.menu_item_id not in book.prices:
         raise HTTPException(status_code=404, detail="Menu item not found")
-
-    order_item = OrderItem(
-        order_id=order_id,
-        menu_item_id=item_data.menu_item_id,
-        quantity=item_data.quantity,
-    )
-    db.add(order_item)
-
-    order.total += menu_item.price * item_data.quantity
+    try:
+        # Rules are judged at the time the order was opened, like the rest of its lines
+        amounts = pricing.price_line(book, pricing.pricing_context(book, order.created_at), item_data)
+    except pricing.PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with rollup_update(db, order):
+        order_item = OrderItem(
+            order_id=order_id,
+            menu_item_id=item_data.menu_item_id,
+            quantity=item_data.quantity,
+            discount_person_name=item_data.discount_person_name,
+            discount_person_id=item_data.discount_person_id,
+            discount_person_type=item_data.discount_person_type,
+            manual_discount_type=item_data.manual_discount_type,
+            manual_discount_value=item_data.manual_discount_value,
+            vat_applied=bool(item_data.vat_applied),
+            notes=item_data.notes,
+            **amounts,
+        )
+        order.items.append(order_item)
+        order.total = Order.total + order_item.line_subtotal
+        order.discount = func.coalesce(Order.discount, 0.0) + order_item.line_discount
+    _order_changed(db, "item_added", order)
     db.commit()
     db.refresh(order_item)
     return order_item
@@ -627,15 +797,24 @@ def update_order_item_quantity(
     if not order_item:
         raise HTTPException(status_code=404, detail="Order item not found")
 
-    order_item.quantity = update.quantity
-
-    # 🧠 Recalculate order total
     order = db.query(Order).filter(Order.id == order_id).first()
-    new_total = 0
-    for item in order.items:
-        new_total += item.menu_item.price * item.quantity
-
-    order.total = new_total
+    book = pricing.get_rule_book(db)
+    try:
+        # Keep the price the line was sold at; only the rules are looked up again
+        amounts = pricing.price_line(
+            book, pricing.pricing_context(book, order.created_at), order_item,
+            order_item.unit_price or 0.0, update.quantity,
+        )
+    except pricing.PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    with rollup_update(db, order):
+        # 🧠 Move the order totals by this line's change only
+        order.total = Order.total + (amounts["line_subtotal"] - (order_item.line_subtotal or 0.0))
+        order.discount = func.coalesce(Order.discount, 0.0) + (amounts["line_discount"] - (order_item.line_discount or 0.0))
+        order_item.quantity = update.quantity
+        for name, value in amounts.items():
+            setattr(order_item, name, value)
+    _order_changed(db, "quantity_changed", order)
     db.commit()
     return {"message": "Quantity updated and total recalculated"}
 
@@ -645,7 +824,9 @@ def delete_order(order_id: int, db: Session = Depends(get_db)):
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    db.delete(order)
+    _order_changed(db, "deleted", order)
+    with rollup_update(db, order):
+        db.delete(order)
     db.commit()
     return {"message": f"Order #{order_id} deleted"}
 
@@ -661,48 +842,88 @@ def delete_order_item(
     if not order_item:
         raise HTTPException(status_code=404, detail="Order item not found")
 
-    menu_item = db.query(MenuItem).filter(MenuItem.id == order_item.menu_item_id).first()
     order = db.query(Order).filter(Order.id == order_id).first()
 
-    order.total -= menu_item.price * order_item.quantity
-    db.delete(order_item)
+    with rollup_update(db, order):
+        order.total = Order.total - (order_item.line_subtotal or 0.0)
+        order.discount = func.coalesce(Order.discount, 0.0) - (order_item.line_discount or 0.0)
+        db.delete(order_item)
 
+    _order_changed(db, "item_removed", order)
     db.commit()
     return {"message": "Item removed from order"}
 
-@app.get("/orders/", response_model=List[OrderOut])
+def _encode_cursor(created_at_raw: str, order_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at_raw}|{order_id}".encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at_raw, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return created_at_raw, int(order_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+@app.get("/orders/", response_model=Union[List[OrderOut], List[OrderSummaryOut]])
 def get_orders(
+    request: Request,
     status: Optional[str] = Query(None),
     is_paid: Optional[bool] = Query(None),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    cashier: Optional[str] = Query(None),
+    receipt_number: Optional[str] = Query(None),
+    shape: str = Query("full"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
     db: Session = Depends(get_db),
 ):
-    query = db.query(Order).options(
-        joinedload(Order.items).joinedload(OrderItem.menu_item)
-    )
+    if shape not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="Invalid shape. Use 'full' or 'summary'.")
 
+    # Show all orders including canceled unless filtered by status
+    filters = []
     if status:
-        query = query.filter(Order.status == status)
+        filters.append(Order.status == status)
     if is_paid is not None:
-        query = query.filter(Order.is_paid == is_paid)
+        filters.append(Order.is_paid == is_paid)
+    if cashier:
+        filters.append(Order.cashier == cashier)
+    if receipt_number:
+        filters.append(Order.receipt_number == receipt_number)
+    start_day = _parse_day(start_date) if start_date else None
+    end_day = _parse_day(end_date) if end_date else None
+    if start_day is not None:
+        filters.append(Order.business_date >= start_day)
+    if end_day is not None:
+        filters.append(Order.business_date <= end_day)
+    if start_date or end_date:
+        # Only a date filter reaches into archived years; unfiltered lists stay on the hot tables
+        archive.include(db, start_day, end_day)
+
+    headers = {"X-Total-Count": str(db.query(func.count(Order.id)).filter(*filters).scalar())}
+
+    if cursor:
+        # Compare against the stored text so rows sharing a timestamp page correctly
+        created_at_raw, order_id = _decode_cursor(cursor)
+        filters.append(
+            tuple_(Order.created_at, Order.id) < tuple_(literal(created_at_raw, String), literal(order_id))
+        )
 
-    if not status:
-        # Show all orders including canceled unless filtered by status
-        pass
-    elif status == "void":
-        query = query.filter(Order.status == "void")
-    else:
-        query = query.filter(Order.status == status)
-    return query.all()
+    # Rows go straight from Core selects to JSON; see order_payloads.py
+    orders, last_raw = order_payloads.list_orders(db, filters, shape, limit)
+
+    if limit and len(orders) == limit:
+        headers["X-Next-Cursor"] = _encode_cursor(last_raw, orders[-1]["id"])
+
+    return json_response(request, orders, headers)
 
 @app.get("/orders/{order_id}", response_model=OrderOut)
-def get_order(order_id: int, db: Session = Depends(get_db)):
-    order = db.query(Order).options(
-        joinedload(Order.items).joinedload(OrderItem.menu_item)
-    ).filter(Order.id == order_id).first()
+def get_order(order_id: int, request: Request, db: Session = Depends(get_db)):
+    order = order_payloads.get_order(db, order_id)
 
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    return order
+    return json_response(request, order)
 
 @app.get("/orders/{order_id}/items", response_model=List[OrderItemOut])
 def get_order_items(order_id: int, db: Session = Depends(get_db)):
@@ -721,6 +942,7 @@ def save_unpaid(order_id: int, paid: float = Body(...), db: Session = Depends(ge
         raise HTTPException(status_code=400, detail="Order is already paid")
 
     order.paid = paid
+    _order_changed(db, "updated", order)
     db.commit()
     return {"message": "Order saved as unpaid", "order_id": order.id, "paid": order.paid}
 
@@ -735,35 +957,18 @@ def mark_order_paid(
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
 
-        print(f"Processing payment for Order #{order_id}")
-        print(f"Order: {order}")
-        print(f"Pay Data: {pay_data}")
+        log.debug("Processing payment", extra={"order_id": order_id, "paid": pay_data.paid, "terminal": pay_data.terminal})
 
-        order.paid = pay_data.paid
-        order.is_paid = True
-        order.status = "paid"
+        with rollup_update(db, order):
+            order.paid = pay_data.paid
+            order.is_paid = True
+            order.status = "paid"
 
-        # === SAFER RECEIPT NUMBERING ===
+        # === RECEIPT NUMBERING (atomic per-year sequence) ===
         if not order.receipt_number:
-            year = datetime.now().year
-            prefix = f"PX-{year}-"
-
-            # Get the highest existing receipt number that matches the year
-            latest_receipt = (
-                db.query(Order.receipt_number)
-                .filter(Order.receipt_number.like(f"{prefix}%"))
-                .order_by(Order.receipt_number.desc())
-                .first()
-            )
-
-            if latest_receipt and latest_receipt[0]:
-                latest_number = int(latest_receipt[0].split("-")[-1])
-                next_number = latest_number + 1
-            else:
-                next_number = 1
-
-            order.receipt_number = f"{prefix}{str(next_number).zfill(6)}"
+            order.receipt_number = next_receipt_number(db, pay_data.terminal)
 
+        _order_changed(db, "paid", order)
         db.commit()
         return {
             "message": "Order marked as paid",
@@ -771,10 +976,20 @@ def mark_order_paid(
             "receipt_number": order.receipt_number
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Error processing payment for Order #{order_id}: {e}")
+        db.rollback()
+        log.exception("Error processing payment", extra={"order_id": order_id})
         raise HTTPException(status_code=500, detail="Failed to mark order as paid")
 
+@app.post("/receipts/blocks", response_model=ReceiptBlockOut)
+def reserve_receipt_block(data: ReceiptBlockCreate, db: Session = Depends(get_db)):
+    block = reserve_block(db, data.terminal, data.size)
+    db.commit()
+    db.refresh(block)
+    return block
+
     
 
 @app.delete("/orders/{order_id}/cancel")
@@ -787,13 +1002,15 @@ def cancel_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    order.cancel_reason = cancel_data.cancel_reason or "Canceled by user"
+    with rollup_update(db, order):
+        order.cancel_reason = cancel_data.cancel_reason or "Canceled by user"
 
-    # ✅ Reset payment info
-    order.status = "void"
-    order.is_paid = False
-    order.paid = 0.0
+        # ✅ Reset payment info
+        order.status = "void"
+        order.is_paid = False
+        order.paid = 0.0
 
+    _order_changed(db, "canceled", order)
     db.commit()
     return {
         "message": f"Order #{order_id} canceled",
@@ -806,25 +1023,9 @@ def hold_order(
     order: OrderCreate,
     db: Session = Depends(get_db),
 ):
-    db_order = Order(
-        type=order.type,
-        notes=order.notes,
-        status="held",
-        cashier=order.cashier 
-    )
-    db.add(db_order)
-    db.flush() 
-
-    for item in order.items:
-        db_item = OrderItem(
-            order_id=db_order.id,
-            menu_item_id=item.menu_item_id,
-            quantity=item.quantity
-        )
-        db.add(db_item)
-
+    db_order = _insert_order(db, order, status="held")
+    _order_changed(db, "held", db_order)
     db.commit()
-    db.refresh(db_order)
     return {"message": "Order held successfully", "order_id": db_order.id}
 
 @app.post("/orders/{order_id}/restore")
@@ -838,33 +1039,60 @@ def restore_order(
     if not order.cancel_reason:
         raise HTTPException(status_code=400, detail="Order is not canceled")
 
-    order.cancel_reason = None
+    with rollup_update(db, order):
+        order.cancel_reason = None
+    _order_changed(db, "restored", order)
     db.commit()
     return {"message": f"Order #{order_id} restored"}
 
-@app.on_event("startup")
 def cleanup_orphan_order_items():
+    """Unlink order lines whose menu item is gone.
+
+    The lines stay on their orders, so totals, receipts and sales keep what
+    was sold; only the item's per-item rollup is moved off them.
+    """
     db = SessionLocal()
     try:
-        broken_items = db.query(OrderItem).filter(
-            ~OrderItem.menu_item_id.in_(
-                db.query(MenuItem.id)
-            )
-        ).all()
-
-        if broken_items:
-            count = len(broken_items)
-            print(f"Cleaning up {count} broken OrderItem(s)...")
+        menu_ids = {menu_item_id for (menu_item_id,) in db.query(MenuItem.id)}
+        orphaned = OrderItem.menu_item_id.is_not(None) & ~OrderItem.menu_item_id.in_(db.query(MenuItem.id))
+        orders = db.query(Order).filter(Order.items.any(orphaned)).all()
+
+        count = 0
+        for order in orders:
+            with rollup_update(db, order):
+                for item in order.items:
+                    if item.menu_item_id is not None and item.menu_item_id not in menu_ids:
+                        item.menu_item_id = None
+                        count += 1
+            _order_changed(db, "item_unlinked", order)
+        db.commit()
 
-            for item in broken_items:
-                db.delete(item)
+        if count:
+            log.info("Unlinked order items from deleted menu items", extra={"count": count, "orders": len(orders)})
+        else:
+            log.info("No broken order items found")
 
-            db.commit()
-            print(f"Cleanup complete.")
+    finally:
+        db.close()
 
-        else:
-            print("No broken OrderItems found. Database is clean.")
+def refresh_analytics():
+    db = ReportSession()
+    try:
+        stats = analytics.refresh(db)
+        log.info("Analytics store refreshed", extra=stats)
+    finally:
+        db.close()
 
+def backfill_rollups():
+    db = SessionLocal()
+    try:
+        # A changed rollover hour or timezone moves orders between days, so the rollups follow
+        if ensure_business_dates(db):
+            rollups_ready.clear()
+            rebuild_rollups(db)
+            log.info("Daily rollups rebuilt for the new business day settings")
+        elif ensure_rollups(db):
+            log.info("Daily rollups rebuilt from order history")
     finally:
         db.close()
 
@@ -882,8 +1110,10 @@ def delete_category(
     else:
         for item in items_to_update:
             db.delete(item)
+    export_jobs.bump_data_version(db, export_jobs.MENU_VERSION_KEY)
 
     db.commit()
+    menu_cache.invalidate()
     return {"message": f"Category '{category}' deleted and items reassigned." if reassign_to else f"Category '{category}' and its items deleted."}
 
 # --- Supervisor Management Endpoints --- #
@@ -942,7 +1172,6 @@ def delete_cashier(id: int, db: Session = Depends(get_db)):
     db.commit()
     return {"message": "Cashier deleted"}
 
-@app.on_event("startup")
 def ensure_supervisor_pin_exists():
     db = SessionLocal()
     try:
@@ -950,7 +1179,7 @@ def ensure_supervisor_pin_exists():
         if not existing:
             db.add(Supervisor(pin="1234"))  # Default PIN
             db.commit()
-            print("Default supervisor PIN (1234) created.")
+            log.info("Default supervisor PIN (1234) created")
     finally:
         db.close()
 
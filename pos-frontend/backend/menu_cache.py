@@ -0,0 +1,55 @@
+"""Read-through cache of the serialized menu.
+
+Menu writes call ``invalidate()`` after they commit, which bumps the version
+counter; the next read rebuilds the snapshot. The snapshot also carries
+price and category lookups so order creation doesn't have to query menu_items.
+"""
+from sqlalchemy.orm import Session
+from typing import NamedTuple
+from database import MenuItem
+from schemas import MenuItemOut
+import hashlib, json, threading
+
+
+class MenuSnapshot(NamedTuple):
+    version: int
+    body: bytes
+    etag: str
+    prices: dict
+    categories: dict
+
+
+_lock = threading.Lock()
+_version = 0
+_snapshot = None
+
+
+def invalidate():
+    global _version
+    with _lock:
+        _version += 1
+
+
+def get_menu(db: Session) -> MenuSnapshot:
+    global _snapshot
+    with _lock:
+        version, snapshot = _version, _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    items = db.query(MenuItem).all()
+    payload = [MenuItemOut.model_validate(item).model_dump(mode="json") for item in items]
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    snapshot = MenuSnapshot(
+        version=version,
+        body=body,
+        etag=f'"{hashlib.sha1(body).hexdigest()}"',
+        prices={item.id: item.price for item in items},
+        categories={item.id: item.category for item in items},
+    )
+
+    with _lock:
+        # Don't keep a snapshot that a concurrent write already made stale
+        if _version == version:
+            _snapshot = snapshot
+    return snapshot
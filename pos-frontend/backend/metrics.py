@@ -0,0 +1,233 @@
+"""Request and SQL instrumentation, exposed in Prometheus text format at /metrics.
+
+``MetricsMiddleware`` times every HTTP request, tracks in-flight requests
+and response sizes, and labels everything with the route template (not the
+raw path). ``instrument_engine`` hooks the SQLAlchemy cursor events so the
+SQL statement count and time are charged to the request that ran them.
+Requests slower than ``PUB_EXPRESS_SLOW_MS`` are logged with their slowest
+statements.
+"""
+from contextvars import ContextVar
+from sqlalchemy import event
+from bisect import bisect_left
+import logging, os, threading, time
+
+log = logging.getLogger("pub_express.slow")
+
+SLOW_MS = float(os.environ.get("PUB_EXPRESS_SLOW_MS", 500))
+SLOW_SQL_SHOWN = 5
+MAX_STATEMENTS = 500      # statements remembered per request for the slow log
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_seconds", "statements")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = []
+
+
+# The request whose SQL is being counted. Sync endpoints run in a worker
+# thread, which gets a copy of this context, so the same RequestStats is shared.
+current_request: ContextVar = ContextVar("current_request", default=None)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = {}        # (method, route, status) -> count
+        self.latency = {}         # (method, route) -> Histogram
+        self.sizes = {}           # (method, route) -> Histogram
+        self.sql_counts = {}      # (method, route) -> Histogram
+        self.sql_seconds = {}     # (method, route) -> float
+        self.slow = {}            # (method, route) -> count
+        self.sql_total = 0        # statements run outside any request included
+        self.sql_total_seconds = 0.0
+
+    def record(self, method, route, status, seconds, size, stats: RequestStats, slow: bool):
+        key = (method, route)
+        with self.lock:
+            self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.sizes.setdefault(key, Histogram(SIZE_BUCKETS)).observe(size)
+            self.sql_counts.setdefault(key, Histogram(SQL_COUNT_BUCKETS)).observe(stats.sql_count)
+            self.sql_seconds[key] = self.sql_seconds.get(key, 0.0) + stats.sql_seconds
+            if slow:
+                self.slow[key] = self.slow.get(key, 0) + 1
+
+    def record_sql(self, seconds):
+        with self.lock:
+            self.sql_total += 1
+            self.sql_total_seconds += seconds
+
+
+registry = Registry()
+
+
+def _labels(method, route, status=None):
+    route = route.replace("\\", "\\\\").replace('"', '\\"')
+    labels = f'method="{method}",route="{route}"'
+    return labels if status is None else f'{labels},status="{status}"'
+
+
+def render(extra_gauges=()) -> str:
+    """Everything in the registry as Prometheus text exposition (version 0.0.4)."""
+    out = []
+    with registry.lock:
+        out.append("# HELP pub_express_http_requests_total HTTP requests by route and status.")
+        out.append("# TYPE pub_express_http_requests_total counter")
+        for (method, route, status), count in sorted(registry.requests.items()):
+            out.append(f"pub_express_http_requests_total{{{_labels(method, route, status)}}} {count}")
+
+        out.append("# HELP pub_express_http_requests_in_flight Requests currently being served.")
+        out.append("# TYPE pub_express_http_requests_in_flight gauge")
+        out.append(f"pub_express_http_requests_in_flight {registry.in_flight}")
+
+        for name, help_text, table in (
+            ("pub_express_http_request_duration_seconds", "Request latency including streamed bodies.", registry.latency),
+            ("pub_express_http_response_size_bytes", "Response body size.", registry.sizes),
+            ("pub_express_http_request_sql_statements", "SQL statements run per request.", registry.sql_counts),
+        ):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} histogram")
+            for (method, route), histogram in sorted(table.items()):
+                out.extend(histogram.lines(name, _labels(method, route)))
+
+        out.append("# HELP pub_express_http_request_sql_seconds_total Time spent in SQL per route.")
+        out.append("# TYPE pub_express_http_request_sql_seconds_total counter")
+        for (method, route), seconds in sorted(registry.sql_seconds.items()):
+            out.append(f"pub_express_http_request_sql_seconds_total{{{_labels(method, route)}}} {seconds}")
+
+        out.append(f"# HELP pub_express_http_slow_requests_total Requests over {SLOW_MS:g}ms.")
+        out.append("# TYPE pub_express_http_slow_requests_total counter")
+        for (method, route), count in sorted(registry.slow.items()):
+            out.append(f"pub_express_http_slow_requests_total{{{_labels(method, route)}}} {count}")
+
+        out.append("# HELP pub_express_sql_statements_total SQL statements run, in or out of requests.")
+        out.append("# TYPE pub_express_sql_statements_total counter")
+        out.append(f"pub_express_sql_statements_total {registry.sql_total}")
+        out.append("# HELP pub_express_sql_seconds_total Time spent in SQL, in or out of requests.")
+        out.append("# TYPE pub_express_sql_seconds_total counter")
+        out.append(f"pub_express_sql_seconds_total {registry.sql_total_seconds}")
+
+    for name, help_text, samples in extra_gauges:
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            out.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+    return "\n".join(out) + "\n"
+
+
+# --- SQL Hooks --- #
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # On the statement's own context, so one that raises leaves nothing behind
+        context._pub_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._pub_query_start
+        registry.record_sql(seconds)
+        stats = current_request.get()
+        if stats is None:
+            return
+        stats.sql_count += 1
+        stats.sql_seconds += seconds
+        if len(stats.statements) < MAX_STATEMENTS:
+            stats.statements.append((seconds, statement))
+
+
+# --- Middleware --- #
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        response = {"status": 500, "size": 0, "stream": False}
+
+        async def send_and_measure(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["stream"] = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        with registry.lock:
+            registry.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            seconds = time.perf_counter() - t0
+            current_request.reset(token)
+            with registry.lock:
+                registry.in_flight -= 1
+
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            # An event stream stays open for as long as the client watches it
+            slow = seconds * 1000 >= SLOW_MS and not response["stream"]
+            registry.record(scope["method"], route_path, response["status"], seconds, response["size"], stats, slow)
+            if slow:
+                _log_slow(scope, route_path, response["status"], seconds, stats)
+
+
+def _log_slow(scope, route_path, status, seconds, stats: RequestStats):
+    slowest = sorted(stats.statements, key=lambda pair: pair[0], reverse=True)[:SLOW_SQL_SHOWN]
+    log.warning(
+        "Slow request %s %s took %.0fms",
+        scope["method"], scope["path"], seconds * 1000,
+        extra={
+            "route": route_path,
+            "status": status,
+            "sql_count": stats.sql_count,
+            "sql_ms": round(stats.sql_seconds * 1000, 1),
+            "slowest_sql": [
+                {"ms": round(s * 1000, 1), "sql": " ".join(statement.split())[:500]}
+                for s, statement in slowest
+            ],
+        },
+    )
@@ -0,0 +1,269 @@
+"""Versioned schema migrations for existing pub_express.db files.
+
+``Base.metadata.create_all`` only creates missing tables, so anything that
+changes an existing table goes here. The applied version is kept in
+SQLite's ``PRAGMA user_version``.
+"""
+from sqlalchemy import text, select, update, bindparam
+from sqlalchemy.orm import Session
+from database import (
+    Order, OrderItem, ReceiptSequence, Setting, DiscountRule,
+    DailySalesRollup, DailyItemRollup, DailyDiscountRollup,
+)
+import business_day, pricing
+import logging
+
+log = logging.getLogger("pub_express.migrations")
+
+FILL_CHUNK = 10_000
+
+
+def _create_indexes(conn, indexes):
+    # Spelled out rather than read off the models: a migration must create what it
+    # shipped with, not columns a later migration has yet to add.
+    for name, table, columns in indexes:
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+
+REPORT_INDEXES = [
+    ("ix_orders_created_at", "orders", ("created_at",)),
+    ("ix_orders_is_paid_created_at", "orders", ("is_paid", "created_at")),
+    ("ix_orders_status_is_paid", "orders", ("status", "is_paid")),
+    ("ix_order_items_order_id", "order_items", ("order_id",)),
+    ("ix_order_items_menu_item_id", "order_items", ("menu_item_id",)),
+]
+
+
+def _add_report_indexes(conn):
+    _create_indexes(conn, REPORT_INDEXES)
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _seed_receipt_sequences(conn):
+    ReceiptSequence.__table__.create(conn, checkfirst=True)
+    # PX-YYYY-NNNNNN: the prefix is the first 8 characters, the number the rest
+    conn.execute(text("""
+        INSERT INTO receipt_sequences (prefix, last_number)
+        SELECT substr(receipt_number, 1, 8), MAX(CAST(substr(receipt_number, 9) AS INTEGER))
+        FROM orders
+        WHERE receipt_number LIKE 'PX-____-%'
+        GROUP BY substr(receipt_number, 1, 8)
+        ON CONFLICT(prefix) DO UPDATE SET last_number = MAX(last_number, excluded.last_number)
+    """))
+
+
+def _add_columns(conn, model, names):
+    table = model.__table__
+    existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+    for name in names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        scalar = column.default is not None and column.default.is_scalar
+        default = f" DEFAULT {column.default.arg}" if scalar else ""
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(conn.dialect)}{default}"
+        )
+
+
+def _snapshot_line_prices(conn):
+    _add_columns(conn, OrderItem, ("unit_price", "line_subtotal", "line_discount"))
+    _add_columns(conn, DailyItemRollup, ("revenue",))
+    # Older lines never stored a price; the current menu price is the best there is.
+    # Same rule as pricing.line_discount.
+    conn.execute(text("""
+        UPDATE order_items
+        SET unit_price = (SELECT price FROM menu_items WHERE menu_items.id = order_items.menu_item_id)
+        WHERE unit_price IS NULL
+    """))
+    conn.execute(text("""
+        UPDATE order_items
+        SET line_subtotal = ROUND(unit_price * quantity, 2)
+        WHERE line_subtotal IS NULL AND unit_price IS NOT NULL
+    """))
+    conn.execute(text("""
+        UPDATE order_items
+        SET line_discount = ROUND(MAX(0, MIN(line_subtotal, CASE manual_discount_type
+            WHEN 'fixed' THEN COALESCE(manual_discount_value, 0)
+            WHEN 'percent' THEN line_subtotal * COALESCE(manual_discount_value, 0) / 100
+            ELSE 0 END)), 2)
+        WHERE line_subtotal IS NOT NULL
+    """))
+
+
+def fill_business_dates(conn, only_missing: bool = True) -> int:
+    """Compute Order.business_date from created_at, in chunks."""
+    query = select(Order.id, Order.created_at).order_by(Order.id).limit(FILL_CHUNK)
+    if only_missing:
+        query = query.where(Order.business_date.is_(None))
+    stmt = update(Order.__table__).where(Order.__table__.c.id == bindparam("order_id")).values(
+        business_date=bindparam("day")
+    )
+    # Keyset pages rather than one open cursor: the update moves rows in the
+    # business_date index that the only_missing query reads from.
+    count, last_id = 0, 0
+    while True:
+        rows = conn.execute(query.where(Order.id > last_id)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        values = [
+            {"order_id": order_id, "day": business_day.business_date_for(created_at)}
+            for order_id, created_at in rows
+            if created_at is not None
+        ]
+        if values:
+            conn.execute(stmt, values)
+        count += len(values)
+    _save_business_day_config(conn)
+    return count
+
+
+def _save_business_day_config(conn):
+    conn.execute(text("""
+        INSERT INTO settings (key, value) VALUES ('business_day_config', :value)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """), {"value": business_day.CONFIG_SIGNATURE})
+
+
+BUSINESS_DATE_INDEXES = [
+    ("ix_orders_business_date", "orders", ("business_date",)),
+    ("ix_orders_is_paid_business_date", "orders", ("is_paid", "business_date")),
+]
+
+
+def _add_business_date(conn):
+    _add_columns(conn, Order, ("business_date",))
+    _create_indexes(conn, BUSINESS_DATE_INDEXES)
+    fill_business_dates(conn)
+    # Rollups were keyed by the UTC calendar date as text; recreate them keyed by business
+    # date. Forgetting the rollups version makes startup rebuild them.
+    for model in (DailySalesRollup, DailyItemRollup, DailyDiscountRollup):
+        model.__table__.drop(conn, checkfirst=True)
+        model.__table__.create(conn)
+    conn.execute(text("DELETE FROM settings WHERE key = 'rollups_version'"))
+    conn.exec_driver_sql("ANALYZE")
+
+
+def ensure_business_dates(db: Session) -> bool:
+    """Recompute every business date if the rollover hour or timezone changed. Returns True if it did."""
+    setting = db.query(Setting).filter(Setting.key == "business_day_config").first()
+    if setting and setting.value == business_day.CONFIG_SIGNATURE:
+        return False
+    count = fill_business_dates(db.connection(), only_missing=False)
+    db.commit()
+    log.info("Business dates recomputed for %s order(s)", count, extra={"config": business_day.CONFIG_SIGNATURE})
+    return True
+
+
+# Statutory 20% for seniors and persons with disability, on the VAT-exempt price
+DEFAULT_DISCOUNT_RULES = [
+    {"name": "Senior Citizen", "kind": "person", "match": "Senior Citizen", "percent": 20.0, "vat_exempt": True},
+    {"name": "PWD", "kind": "person", "match": "PWD", "percent": 20.0, "vat_exempt": True},
+]
+
+
+def _spread_person_discounts(conn) -> int:
+    """Move pre-rule senior/PWD discounts from Order.discount onto their lines. Returns orders changed.
+
+    Until rules, a line held only its manual discount and the person discount
+    sat in Order.discount. What the order holds beyond its manual line
+    discounts is spread over its person lines with no manual discount,
+    weighted by subtotal, and credited to the matching person rule.
+    """
+    rules = {
+        match.strip().lower(): rule_id
+        for rule_id, match in conn.execute(
+            select(DiscountRule.id, DiscountRule.match).where(DiscountRule.kind == "person")
+        )
+    }
+    if not rules:
+        return 0
+    items = OrderItem.__table__
+    lines_query = (
+        select(items.c.id, items.c.order_id, items.c.line_subtotal, items.c.line_discount,
+               items.c.discount_person_type)
+        .where(items.c.order_id.in_(bindparam("order_ids", expanding=True)))
+        .order_by(items.c.order_id, items.c.id)
+    )
+    stmt = update(items).where(items.c.id == bindparam("line_id")).values(
+        line_discount=bindparam("discount"), discount_rule_id=bindparam("rule_id"),
+    )
+    orders_query = (
+        select(Order.id, Order.discount, Order.business_date)
+        .where(Order.discount > 0).order_by(Order.id).limit(FILL_CHUNK)
+    )
+    changed, days, last_id = 0, set(), 0
+    while True:
+        orders = conn.execute(orders_query.where(Order.id > last_id)).all()
+        if not orders:
+            break
+        last_id = orders[-1].id
+        lines = {}
+        for line in conn.execute(lines_query, {"order_ids": [order.id for order in orders]}):
+            lines.setdefault(line.order_id, []).append(line)
+
+        values = []
+        for order in orders:
+            order_lines = lines.get(order.id, [])
+            person = round(order.discount - sum(line.line_discount or 0.0 for line in order_lines), 2)
+            targets = [
+                line for line in order_lines
+                if not line.line_discount and (line.discount_person_type or "").strip().lower() in rules
+            ]
+            if person <= 0 or not targets:
+                continue
+            shares = pricing.spread_discount(person, [line.line_subtotal for line in targets])
+            values.extend(
+                {"line_id": line.id, "discount": share,
+                 "rule_id": rules[line.discount_person_type.strip().lower()]}
+                for line, share in zip(targets, shares) if share
+            )
+            changed += 1
+            days.add(order.business_date)
+        if values:
+            conn.execute(stmt, values)
+
+    # Cached exports of those days are stale now (see export_jobs.py)
+    days.discard(None)
+    if days:
+        conn.execute(text("""
+            INSERT INTO data_versions (business_date, version) VALUES (:day, 1)
+            ON CONFLICT(business_date) DO UPDATE SET version = version + 1
+        """), [{"day": day} for day in days])
+    return changed
+
+
+def _add_discount_rules(conn):
+    _add_columns(conn, OrderItem, ("discount_rule_id",))
+    DiscountRule.__table__.create(conn, checkfirst=True)
+    if not conn.execute(select(DiscountRule.id).limit(1)).first():
+        conn.execute(DiscountRule.__table__.insert(), [
+            {"amount": 0.0, "active": True, **rule} for rule in DEFAULT_DISCOUNT_RULES
+        ])
+    _spread_person_discounts(conn)
+
+
+def _add_vat_applied(conn):
+    _add_columns(conn, OrderItem, ("vat_applied",))
+
+
+MIGRATIONS = [
+    (1, "report indexes on orders and order_items", _add_report_indexes),
+    (2, "seed receipt sequences from existing receipts", _seed_receipt_sequences),
+    (3, "snapshot unit price, subtotal and discount on order lines", _snapshot_line_prices),
+    (4, "business_date on orders, rollups keyed by business date", _add_business_date),
+    (5, "discount rules, and the rule behind each line discount", _add_discount_rules),
+    (6, "VAT-exempt flag on order lines", _add_vat_applied),
+]
+
+
+def run_migrations(engine):
+    with engine.begin() as conn:
+        current = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for version, name, step in MIGRATIONS:
+            if version <= current:
+                continue
+            step(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+            log.info("Applied migration %s: %s", version, name)
@@ -0,0 +1,78 @@
+"""Order payloads for /orders/ built straight from Core select rows.
+
+Produces the same shapes as ``OrderOut`` / ``OrderSummaryOut`` without ORM
+hydration or response_model validation: one select for the orders and, for
+the full shape, one select for their lines joined to the menu.
+"""
+from sqlalchemy import select, cast, String
+from sqlalchemy.orm import Session
+from database import Order, OrderItem, MenuItem
+
+# Field order follows the response schemas
+ORDER_FIELDS = (
+    "id", "created_at", "total", "discount", "paid", "is_paid", "notes",
+    "cancel_reason", "type", "status", "receipt_number", "cashier", "business_date",
+)
+ITEM_FIELDS = (
+    "id", "order_id", "quantity", "unit_price", "line_subtotal", "line_discount", "discount_rule_id", "vat_applied",
+    "discount_person_name", "discount_person_id",
+    "discount_person_type", "manual_discount_type", "manual_discount_value", "notes",
+)
+MENU_FIELDS = ("name", "category", "price", "id", "image_url")
+
+
+def _columns(model, fields):
+    return [getattr(model, name) for name in fields]
+
+
+def list_orders(db: Session, conditions: list, shape: str = "full", limit: int = None):
+    """Orders matching ``conditions``, newest first.
+
+    Returns the payload list and the stored created_at text of the last
+    order (for the keyset cursor), or None when there are no rows.
+    """
+    stmt = (
+        select(*_columns(Order, ORDER_FIELDS), cast(Order.created_at, String).label("created_at_raw"))
+        .where(*conditions)
+        .order_by(Order.created_at.desc(), Order.id.desc())
+    )
+    if limit:
+        stmt = stmt.limit(limit)
+
+    orders = []
+    by_id = {}
+    last_raw = None
+    for row in db.execute(stmt):
+        order = dict(zip(ORDER_FIELDS, row))
+        last_raw = row[-1]
+        orders.append(order)
+        by_id[order["id"]] = order
+
+    if shape == "full" and orders:
+        for order in orders:
+            order["items"] = []
+
+        item_stmt = (
+            select(*_columns(OrderItem, ITEM_FIELDS), *_columns(MenuItem, MENU_FIELDS))
+            .join(MenuItem, MenuItem.id == OrderItem.menu_item_id)
+            .order_by(OrderItem.id)
+        )
+        if limit:
+            item_stmt = item_stmt.where(OrderItem.order_id.in_(list(by_id)))
+        else:
+            item_stmt = item_stmt.join(Order, Order.id == OrderItem.order_id).where(*conditions)
+
+        item_width = len(ITEM_FIELDS)
+        for row in db.execute(item_stmt):
+            item = dict(zip(ITEM_FIELDS, row[:item_width]))
+            item["menu_item"] = dict(zip(MENU_FIELDS, row[item_width:]))
+            owner = by_id.get(item["order_id"])
+            if owner is not None:
+                owner["items"].append(item)
+
+    return orders, last_raw
+
+
+def get_order(db: Session, order_id: int):
+    orders, _ = list_orders(db, [Order.id == order_id], "full", limit=1)
+    return orders[0] if orders else None
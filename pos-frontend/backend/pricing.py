@@ -0,0 +1,293 @@
+"""Order line pricing, snapshotted onto OrderItem at the moment of sale.
+
+A line's discount comes from one place, and discounts never stack:
+
+1. A manual discount on the line is the cashier's override. A "fixed" one
+   takes a flat amount off the line, a "percent" one takes a share of it.
+2. Otherwise the largest discount among the rules that apply:
+   - the "person" rule for the line's discount_person_type (senior, PWD, ...);
+   - the "coupon" rule for the code in discount_person_id, when the type is
+     Coupon or Voucher;
+   - every live "promo" for the item's category, or for all items. A promo
+     with start/end times is a happy hour.
+
+A line the cashier marks ``vat_applied`` (VAT-exempt) has the VAT taken out
+first, and the manual discount or winning rule comes off the VAT-less price,
+the way the till shows it. With neither, the VAT alone is its discount.
+
+A line never goes below zero. The rule that won is stored on the line as
+``discount_rule_id``, and the order's discount is the sum of its lines;
+senior and PWD discounts live on their lines like any other. (Lines sold
+before there were rules kept those on the order; migration 5 moved them.)
+
+The discount_rules table is compiled into a ``RuleBook``, together with the
+menu prices and categories from menu_cache. The book is rebuilt only when
+the rules or the menu change (see ``invalidate``), so pricing an order is
+one pass over its lines with no queries.
+
+    PUB_EXPRESS_VAT_RATE   VAT included in menu prices, for vat_exempt rules (default 0.12)
+"""
+from sqlalchemy.orm import Session
+from typing import NamedTuple, Optional
+from datetime import datetime
+from database import DiscountRule
+import business_day, menu_cache
+import os, re, threading
+
+VAT_RATE = float(os.environ.get("PUB_EXPRESS_VAT_RATE", 0.12))
+RULE_KINDS = ("person", "coupon", "promo")
+COUPON_TYPES = ("coupon", "voucher")
+
+
+class PricingError(ValueError):
+    pass
+
+
+# --- Manual discounts --- #
+
+
+def _vat_free(subtotal: float, vat_exempt: bool) -> float:
+    return subtotal / (1 + VAT_RATE) if vat_exempt else subtotal
+
+
+def line_discount(subtotal: float, manual_discount_type, manual_discount_value, vat_exempt: bool = False) -> float:
+    value = manual_discount_value or 0.0
+    base = _vat_free(subtotal, vat_exempt)
+    if manual_discount_type == "fixed":
+        discount = value
+    elif manual_discount_type == "percent":
+        discount = base * value / 100
+    else:
+        discount = 0.0
+    return round(max(0.0, min(subtotal, (subtotal - base) + discount)), 2)
+
+
+def spread_discount(amount: float, subtotals) -> list:
+    """Split ``amount`` over lines by subtotal, to the cent. No share goes above its line's subtotal.
+
+    Rounding leaves a few cents over or under; they're settled on lines with
+    room. An amount above the subtotals' sum is capped at it.
+    """
+    subtotals = [subtotal or 0.0 for subtotal in subtotals]
+    total = round(sum(subtotals), 2)
+    amount = min(round(amount, 2), total)
+    if amount <= 0 or not total:
+        return [0.0] * len(subtotals)
+    shares = [min(round(amount * subtotal / total, 2), subtotal) for subtotal in subtotals]
+    remaining = round(amount - sum(shares), 2)
+    for n, subtotal in enumerate(subtotals):
+        if not remaining:
+            break
+        step = min(remaining, round(subtotal - shares[n], 2)) if remaining > 0 else max(remaining, -shares[n])
+        shares[n] = round(shares[n] + step, 2)
+        remaining = round(remaining - step, 2)
+    return shares
+
+
+def _has_manual(item) -> bool:
+    return item.manual_discount_type in ("fixed", "percent") and (item.manual_discount_value or 0) > 0
+
+
+# --- Rule compilation --- #
+
+
+class Rule(NamedTuple):
+    id: int
+    name: str
+    percent: float
+    amount: float                   # off per unit
+    vat_exempt: bool
+    category: Optional[str]
+    window: Optional[tuple]         # (start minute, end minute) of the local day; may wrap past midnight
+    weekdays: Optional[frozenset]
+    valid_from: Optional[int]
+    valid_to: Optional[int]
+
+    def live(self, minute: int, weekday: int, day: int) -> bool:
+        if self.valid_from is not None and day < self.valid_from:
+            return False
+        if self.valid_to is not None and day > self.valid_to:
+            return False
+        if self.weekdays is not None and weekday not in self.weekdays:
+            return False
+        if self.window is not None:
+            start, end = self.window
+            return start <= minute < end if start <= end else (minute >= start or minute < end)
+        return True
+
+    def discount(self, subtotal: float, quantity: int, vat_exempt: bool = False) -> float:
+        base = _vat_free(subtotal, self.vat_exempt or vat_exempt)
+        discount = (subtotal - base) + base * (self.percent or 0.0) / 100 + (self.amount or 0.0) * quantity
+        return round(max(0.0, min(subtotal, discount)), 2)
+
+
+class RuleBook(NamedTuple):
+    version: tuple                  # (rules version, menu version)
+    prices: dict                    # menu item id -> price
+    categories: dict                # menu item id -> category
+    people: dict                    # lower-case person type -> Rule
+    coupons: dict                   # upper-case code -> Rule
+    promos: tuple
+
+
+def _minutes(value: str) -> int:
+    match = re.fullmatch(r"([01]?\d|2[0-3]):([0-5]\d)", value or "")
+    if not match:
+        raise PricingError(f"Invalid time {value!r}. Use HH:MM.")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def check_rule(values: dict):
+    """Raise PricingError if a rule's fields don't make sense together."""
+    if values.get("kind") not in RULE_KINDS:
+        raise PricingError(f"Invalid kind. Use one of: {', '.join(RULE_KINDS)}.")
+    if values["kind"] in ("person", "coupon") and not (values.get("match") or "").strip():
+        raise PricingError(f"A {values['kind']} rule needs a match.")
+    if bool(values.get("start_time")) != bool(values.get("end_time")):
+        raise PricingError("Give both start_time and end_time, or neither.")
+    if values.get("start_time"):
+        _minutes(values["start_time"])
+        _minutes(values["end_time"])
+    if values.get("weekdays") and not re.fullmatch(r"[0-6]+", values["weekdays"]):
+        raise PricingError("weekdays takes digits 0-6, Monday = 0.")
+    if values.get("valid_from") and values.get("valid_to") and values["valid_to"] < values["valid_from"]:
+        raise PricingError("valid_to must not be before valid_from.")
+
+
+def _compile(row: DiscountRule) -> Rule:
+    return Rule(
+        id=row.id,
+        name=row.name,
+        percent=row.percent or 0.0,
+        amount=row.amount or 0.0,
+        vat_exempt=bool(row.vat_exempt),
+        category=row.category or None,
+        window=(_minutes(row.start_time), _minutes(row.end_time)) if row.start_time and row.end_time else None,
+        weekdays=frozenset(int(day) for day in row.weekdays) if row.weekdays else None,
+        valid_from=row.valid_from,
+        valid_to=row.valid_to,
+    )
+
+
+def compile_rules(rows, menu, version=None) -> RuleBook:
+    people, coupons, promos = {}, {}, []
+    for row in rows:
+        rule = _compile(row)
+        if row.kind == "person":
+            people[row.match.strip().lower()] = rule
+        elif row.kind == "coupon":
+            coupons[row.match.strip().upper()] = rule
+        else:
+            promos.append(rule)
+    return RuleBook(
+        version=version,
+        prices=menu.prices,
+        categories=menu.categories,
+        people=people,
+        coupons=coupons,
+        promos=tuple(promos),
+    )
+
+
+_lock = threading.Lock()
+_version = 0
+_book = None
+
+
+def invalidate():
+    """Call after discount rules change and commit."""
+    global _version
+    with _lock:
+        _version += 1
+
+
+def get_rule_book(db: Session) -> RuleBook:
+    global _book
+    menu = menu_cache.get_menu(db)
+    with _lock:
+        version, book = _version, _book
+    if book is not None and book.version == (version, menu.version):
+        return book
+
+    rows = db.query(DiscountRule).filter(DiscountRule.active == True).order_by(DiscountRule.id).all()
+    book = compile_rules(rows, menu, (version, menu.version))
+    with _lock:
+        # Don't keep a book that a concurrent rule change already made stale
+        if _version == version:
+            _book = book
+    return book
+
+
+# --- Pricing --- #
+
+
+class PricingContext(NamedTuple):
+    minute: int
+    weekday: int
+    day: int
+    promos: dict                    # category (None: every item) -> promos live at this moment
+
+
+def pricing_context(book: RuleBook, at: datetime) -> PricingContext:
+    """Everything about the moment of sale that rules depend on, worked out once per order."""
+    local = business_day.to_local(at)
+    minute, weekday, day = local.hour * 60 + local.minute, local.weekday(), business_day.business_date_for(at)
+    promos = {}
+    for rule in book.promos:
+        if rule.live(minute, weekday, day):
+            promos.setdefault(rule.category, []).append(rule)
+    return PricingContext(minute, weekday, day, promos)
+
+
+def _candidates(book: RuleBook, context: PricingContext, item):
+    person_type = (item.discount_person_type or "").strip().lower()
+    if person_type in COUPON_TYPES:
+        code = (item.discount_person_id or "").strip().upper()
+        rule = book.coupons.get(code)
+        if rule is None or not rule.live(context.minute, context.weekday, context.day):
+            raise PricingError(f"Unknown or expired coupon code: {code or '(none)'}")
+        yield rule
+    elif person_type:
+        rule = book.people.get(person_type)
+        if rule is not None and rule.live(context.minute, context.weekday, context.day):
+            yield rule
+    yield from context.promos.get(book.categories.get(item.menu_item_id), ())
+    yield from context.promos.get(None, ())
+
+
+def price_line(book: RuleBook, context: PricingContext, item, unit_price: float = None, quantity: int = None) -> dict:
+    """Snapshot columns for one line.
+
+    ``item`` has the OrderItemCreate fields (an OrderItem works too);
+    ``unit_price`` defaults to the current menu price and ``quantity`` to the
+    item's own.
+    """
+    if unit_price is None:
+        unit_price = book.prices[item.menu_item_id]
+    if quantity is None:
+        quantity = item.quantity
+    subtotal = round(unit_price * quantity, 2)
+    vat_exempt = bool(item.vat_applied)
+    amounts = {
+        "unit_price": unit_price,
+        "line_subtotal": subtotal,
+        "line_discount": line_discount(subtotal, None, None, vat_exempt),
+        "discount_rule_id": None,
+    }
+
+    if _has_manual(item):
+        amounts["line_discount"] = line_discount(
+            subtotal, item.manual_discount_type, item.manual_discount_value, vat_exempt,
+        )
+        return amounts
+    for rule in _candidates(book, context, item):
+        discount = rule.discount(subtotal, quantity, vat_exempt)
+        if discount > amounts["line_discount"]:
+            amounts["line_discount"], amounts["discount_rule_id"] = discount, rule.id
+    return amounts
+
+
+def price_order(book: RuleBook, items, at: datetime) -> list:
+    """Snapshot columns for every line of an order sold at ``at``. Raises PricingError."""
+    context = pricing_context(book, at)
+    return [price_line(book, context, item) for item in items]
@@ -0,0 +1,78 @@
+"""Receipt number allocation (PX-YYYY-NNNNNN).
+
+Numbers come from a per-prefix row in ``receipt_sequences`` that is bumped
+with a single ``UPDATE ... RETURNING`` inside the paying transaction, so two
+terminals paying at once get distinct numbers, and a rolled-back payment
+hands its number back. A terminal can also reserve a block of numbers up
+front and draw from it before falling back to the shared sequence.
+"""
+from sqlalchemy import update, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from database import ReceiptSequence, ReceiptBlock
+from datetime import datetime
+from typing import Optional
+
+
+def receipt_prefix(year: Optional[int] = None) -> str:
+    return f"PX-{year or datetime.now().year}-"
+
+
+def format_receipt(prefix: str, number: int) -> str:
+    return f"{prefix}{str(number).zfill(6)}"
+
+
+def allocate_numbers(db: Session, prefix: str, count: int = 1) -> int:
+    """Atomically take ``count`` consecutive numbers and return the first one."""
+    stmt = insert(ReceiptSequence).values(prefix=prefix, last_number=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["prefix"],
+        set_={"last_number": ReceiptSequence.last_number + count},
+    ).returning(ReceiptSequence.last_number)
+    last_number = db.execute(stmt).scalar_one()
+    return last_number - count + 1
+
+
+def reserve_block(db: Session, terminal: str, size: int, prefix: Optional[str] = None) -> ReceiptBlock:
+    prefix = prefix or receipt_prefix()
+    start = allocate_numbers(db, prefix, size)
+    block = ReceiptBlock(
+        terminal=terminal,
+        prefix=prefix,
+        start_number=start,
+        end_number=start + size - 1,
+        next_number=start,
+    )
+    db.add(block)
+    db.flush()
+    return block
+
+
+def _take_from_block(db: Session, terminal: str, prefix: str) -> Optional[int]:
+    open_block = (
+        select(ReceiptBlock.id)
+        .where(
+            ReceiptBlock.terminal == terminal,
+            ReceiptBlock.prefix == prefix,
+            ReceiptBlock.next_number <= ReceiptBlock.end_number,
+        )
+        .order_by(ReceiptBlock.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    taken = db.execute(
+        update(ReceiptBlock)
+        .where(ReceiptBlock.id == open_block)
+        .values(next_number=ReceiptBlock.next_number + 1)
+        .returning(ReceiptBlock.next_number)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+    return taken - 1 if taken is not None else None
+
+
+def next_receipt_number(db: Session, terminal: Optional[str] = None) -> str:
+    prefix = receipt_prefix()
+    number = _take_from_block(db, terminal, prefix) if terminal else None
+    if number is None:
+        number = allocate_numbers(db, prefix)
+    return format_receipt(prefix, number)
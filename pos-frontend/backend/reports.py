@@ -0,0 +1,320 @@
+from sqlalchemy import func, case, and_
+from sqlalchemy.orm import Session
+from database import Order, OrderItem, MenuItem, DiscountRule, DailySalesRollup, DailyItemRollup, DailyDiscountRollup
+from datetime import datetime, timedelta
+import archive, business_day
+import threading
+
+
+# --- Sales Summary Engine --- #
+
+
+def _sum_if(condition, column):
+    return func.coalesce(func.sum(case((condition, column), else_=0.0)), 0.0)
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+# Paid-side figures kept per day in the rollup tables (see rollups.py).
+ROLLUP_FIELDS = (
+    "total_paid", "orders_paid", "total_discount",
+    "dine_in_count", "dine_in_sales", "take_out_count", "take_out_sales",
+    "void_orders", "valid_sales", "valid_discount", "valid_orders", "canceled_orders",
+)
+
+
+def summary_columns() -> list:
+    """Labeled conditional aggregates for every sales summary figure.
+
+    Covers the full ``SalesSummary`` shape plus the "valid" (paid and not
+    voided) totals the dashboard cards use.
+    """
+    total = func.coalesce(Order.total, 0.0)
+    discount = func.coalesce(Order.discount, 0.0)
+    order_type = func.lower(func.coalesce(Order.type, ""))
+
+    paid = Order.is_paid == True
+    unpaid = Order.is_paid == False
+    voided = Order.cancel_reason.isnot(None)
+    paid_valid = and_(paid, Order.cancel_reason.is_(None))
+    dine_in = and_(paid, order_type == "dine-in")
+    take_out = and_(paid, order_type == "take-out")
+
+    return [
+        _sum_if(paid, total).label("total_paid"),
+        _sum_if(unpaid, total).label("total_unpaid"),
+        _count_if(paid).label("orders_paid"),
+        _count_if(unpaid).label("orders_unpaid"),
+        _sum_if(paid, discount).label("total_discount"),
+        _count_if(dine_in).label("dine_in_count"),
+        _sum_if(dine_in, total).label("dine_in_sales"),
+        _count_if(take_out).label("take_out_count"),
+        _sum_if(take_out, total).label("take_out_sales"),
+        _count_if(and_(paid, voided)).label("void_orders"),
+        _sum_if(paid_valid, total).label("valid_sales"),
+        _sum_if(paid_valid, discount).label("valid_discount"),
+        _count_if(paid_valid).label("valid_orders"),
+        _count_if(voided).label("canceled_orders"),
+    ]
+
+
+def line_revenue():
+    """What an order line earned: its snapshotted subtotal less its line discount."""
+    return func.coalesce(OrderItem.line_subtotal, 0.0) - func.coalesce(OrderItem.line_discount, 0.0)
+
+
+def in_business_days(start_day: int, end_day: int):
+    return Order.business_date.between(start_day, end_day)
+
+
+def lines_in_business_days(db: Session, start_day: int, end_day: int):
+    """A filter on OrderItem.order_id spanning the range's orders, to go with the join on Order.
+
+    Over archive views (see archive.py) SQLite pushes a plain order_id range
+    into each volume's index, where the join alone reads every line.
+    """
+    first, last = db.query(func.min(Order.id), func.max(Order.id)).filter(in_business_days(start_day, end_day)).one()
+    return OrderItem.order_id.between(first, last) if first is not None else OrderItem.order_id.is_(None)
+
+
+def summarize_orders(db: Session, start_day: int, end_day: int) -> dict:
+    """Compute every sales summary figure for a business-date range in one SQL pass over orders."""
+    archive.include(db, start_day, end_day)
+    row = db.query(*summary_columns()).filter(in_business_days(start_day, end_day)).one()
+
+    return dict(row._mapping)
+
+
+# --- Rollup Readers --- #
+
+
+# Set by rollups.py once the rollup tables are known to be complete; until then
+# every reader below falls back to the raw orders.
+rollups_ready = threading.Event()
+
+
+def summarize_range(db: Session, start_day: int, end_day: int, include_unpaid: bool = True) -> dict:
+    """Same figures as ``summarize_orders``, served from the daily rollups once they are ready."""
+    if not rollups_ready.is_set():
+        result = summarize_orders(db, start_day, end_day)
+    else:
+        row = db.query(*[
+            func.coalesce(func.sum(getattr(DailySalesRollup, name)), 0).label(name)
+            for name in ROLLUP_FIELDS
+        ]).filter(DailySalesRollup.business_date.between(start_day, end_day)).one()
+        result = {column.name: 0 for column in summary_columns()}
+        result.update(row._mapping)
+
+        if include_unpaid:
+            archive.include(db, start_day, end_day)   # voided orders are unpaid, and can be archived
+            total_unpaid, orders_unpaid = db.query(
+                func.coalesce(func.sum(Order.total), 0.0),
+                func.count(Order.id),
+            ).filter(
+                Order.is_paid == False,
+                in_business_days(start_day, end_day),
+            ).one()
+            result["total_unpaid"] = total_unpaid
+            result["orders_unpaid"] = orders_unpaid
+
+    return {name: round(value, 2) if isinstance(value, float) else value for name, value in result.items()}
+
+
+def top_items(db: Session, start_day: int, end_day: int, limit: int = 10) -> list:
+    """Best sellers by quantity, with revenue from the snapshotted line amounts."""
+    if rollups_ready.is_set():
+        rows = (
+            db.query(DailyItemRollup.menu_item_id, func.sum(DailyItemRollup.quantity), func.sum(DailyItemRollup.revenue))
+            .filter(DailyItemRollup.business_date.between(start_day, end_day))
+            .group_by(DailyItemRollup.menu_item_id)
+        )
+    else:
+        archive.include(db, start_day, end_day)
+        rows = (
+            db.query(OrderItem.menu_item_id, func.sum(OrderItem.quantity), func.sum(line_revenue()))
+            .join(OrderItem.order)
+            .filter(Order.is_paid == True, in_business_days(start_day, end_day))
+            .group_by(OrderItem.menu_item_id)
+        )
+    totals = {menu_item_id: (quantity or 0, revenue or 0.0) for menu_item_id, quantity, revenue in rows}
+
+    # Names only for display; items since deleted from the menu are left out as before
+    names = dict(db.query(MenuItem.id, MenuItem.name).filter(MenuItem.id.in_(list(totals))))
+    ranked = sorted(
+        ((names[menu_item_id], sold, earned) for menu_item_id, (sold, earned) in totals.items()
+         if sold > 0 and menu_item_id in names),
+        key=lambda row: row[1], reverse=True,
+    )
+    return [
+        {"item": name, "total_sold": total_sold, "revenue": round(revenue, 2)}
+        for name, total_sold, revenue in ranked[:limit]
+    ]
+
+
+def discount_usage(db: Session, start_day: int, end_day: int) -> list:
+    if rollups_ready.is_set():
+        rows = (
+            db.query(DailyDiscountRollup.discount_type, func.sum(DailyDiscountRollup.count))
+            .filter(DailyDiscountRollup.business_date.between(start_day, end_day))
+            .group_by(DailyDiscountRollup.discount_type)
+        )
+    else:
+        archive.include(db, start_day, end_day)
+        rows = (
+            db.query(OrderItem.discount_person_type, func.count(OrderItem.id))
+            .join(OrderItem.order)
+            .filter(
+                Order.is_paid == True,
+                in_business_days(start_day, end_day),
+                OrderItem.discount_person_type.isnot(None),
+            )
+            .group_by(OrderItem.discount_person_type)
+        )
+
+    return [{"type": discount_type, "count": count} for discount_type, count in rows if count]
+
+
+def discount_amounts(db: Session, start_day: int, end_day: int) -> list:
+    """Paid line discounts by the rule that gave them; manual discounts have no rule."""
+    archive.include(db, start_day, end_day)
+    rows = (
+        db.query(
+            OrderItem.discount_rule_id, DiscountRule.name,
+            func.count(OrderItem.id), func.coalesce(func.sum(OrderItem.line_discount), 0.0),
+        )
+        .join(OrderItem.order)
+        .outerjoin(DiscountRule, DiscountRule.id == OrderItem.discount_rule_id)
+        .filter(
+            Order.is_paid == True,
+            in_business_days(start_day, end_day),
+            OrderItem.line_discount > 0,
+        )
+        .group_by(OrderItem.discount_rule_id, DiscountRule.name)
+        .order_by(func.sum(OrderItem.line_discount).desc())
+    )
+    return [
+        {"rule_id": rule_id, "rule": name if rule_id is not None else "Manual", "lines": lines, "amount": round(amount, 2)}
+        for rule_id, name, lines, amount in rows
+    ]
+
+
+# --- Sales Time Series --- #
+
+
+SERIES_BUCKETS = ("hour", "day", "week", "month")
+
+
+def _day_label(day: int, bucket: str) -> str:
+    value = business_day.to_date(day)
+    if bucket == "week":
+        # Monday of the ISO week the business day falls in
+        return (value - timedelta(days=value.weekday())).isoformat()
+    if bucket == "month":
+        return value.strftime("%Y-%m")
+    return value.isoformat()
+
+
+def _paid_by_day(db: Session, start_day: int, end_day: int):
+    if rollups_ready.is_set():
+        return (
+            db.query(DailySalesRollup.business_date, DailySalesRollup.total_paid, DailySalesRollup.orders_paid)
+            .filter(DailySalesRollup.business_date.between(start_day, end_day))
+        )
+    archive.include(db, start_day, end_day)
+    return (
+        db.query(Order.business_date, func.coalesce(func.sum(Order.total), 0.0), func.count(Order.id))
+        .filter(Order.is_paid == True, in_business_days(start_day, end_day))
+        .group_by(Order.business_date)
+    )
+
+
+def _paid_by_hour(db: Session, start_day: int, end_day: int):
+    """Paid totals per local clock hour. created_at is UTC, so hours are grouped in SQL and shifted here."""
+    utc_hour = func.strftime("%Y-%m-%d %H:00:00", Order.created_at)
+    archive.include(db, start_day, end_day)
+    rows = (
+        db.query(utc_hour, func.coalesce(func.sum(Order.total), 0.0), func.count(Order.id))
+        .filter(Order.is_paid == True, in_business_days(start_day, end_day))
+        .group_by(utc_hour)
+    )
+    for hour, total_sales, total_orders in rows:
+        local = business_day.to_local(datetime.strptime(hour, "%Y-%m-%d %H:%M:%S"))
+        yield local.strftime("%Y-%m-%d %H:00"), total_sales, total_orders
+
+
+def _series_labels(start_day: int, end_day: int, bucket: str) -> list:
+    if bucket == "hour":
+        cursor = business_day.local_opening(start_day)
+        closing = business_day.local_opening(end_day) + timedelta(days=1)
+        labels = []
+        while cursor < closing:
+            labels.append(cursor.strftime("%Y-%m-%d %H:00"))
+            cursor += timedelta(hours=1)
+        return labels
+    return list(dict.fromkeys(_day_label(day, bucket) for day in business_day.days_between(start_day, end_day)))
+
+
+def sales_series(db: Session, start_day: int, end_day: int, bucket: str = "day") -> list:
+    """Paid sales totals and order counts per bucket of business days, with empty buckets as zero."""
+    if bucket == "hour":
+        rows = _paid_by_hour(db, start_day, end_day)
+    else:
+        rows = ((_day_label(day, bucket), total_sales, total_orders)
+                for day, total_sales, total_orders in _paid_by_day(db, start_day, end_day))
+
+    found = {}
+    for label, total_sales, total_orders in rows:
+        sales, orders = found.get(label, (0.0, 0))
+        found[label] = (sales + (total_sales or 0.0), orders + (total_orders or 0))
+
+    points = []
+    for label in _series_labels(start_day, end_day, bucket):
+        total_sales, total_orders = found.get(label, (0.0, 0))
+        points.append({"label": label, "total_sales": round(total_sales, 2), "total_orders": total_orders})
+    return points
+
+
+# --- Item Sales Matrix --- #
+
+MATRIX_MAX_DAYS = 366  # one array slot per day per item, so the range is capped
+
+
+def item_sales_matrix(db: Session, start_day: int, end_day: int, item_ids=None) -> dict:
+    """Paid quantity per menu item per business day, as shared labels plus one array per item."""
+    days = business_day.days_between(start_day, end_day)
+    index = {day: i for i, day in enumerate(days)}
+
+    menu_query = db.query(MenuItem.id, MenuItem.name)
+    if item_ids:
+        menu_query = menu_query.filter(MenuItem.id.in_(item_ids))
+    menu = menu_query.order_by(MenuItem.id).all()
+
+    if rollups_ready.is_set():
+        query = db.query(
+            DailyItemRollup.menu_item_id, DailyItemRollup.business_date, DailyItemRollup.quantity,
+        ).filter(DailyItemRollup.business_date.between(start_day, end_day))
+        if item_ids:
+            query = query.filter(DailyItemRollup.menu_item_id.in_(item_ids))
+    else:
+        archive.include(db, start_day, end_day)
+        query = db.query(
+            OrderItem.menu_item_id, Order.business_date, func.sum(OrderItem.quantity),
+        ).join(OrderItem.order).filter(
+            Order.is_paid == True,
+            in_business_days(start_day, end_day),
+        )
+        if item_ids:
+            query = query.filter(OrderItem.menu_item_id.in_(item_ids))
+        query = query.group_by(OrderItem.menu_item_id, Order.business_date)
+
+    data = {item_id: [0] * len(days) for item_id, _ in menu}
+    for item_id, day, quantity in query:
+        if item_id in data and day in index:
+            data[item_id][index[day]] = quantity or 0
+
+    return {
+        "labels": [business_day.iso(day) for day in days],
+        "items": [{"id": item_id, "name": name, "data": data[item_id]} for item_id, name in menu],
+    }
@@ -0,0 +1,232 @@
+"""Per-day rollups of paid sales, item quantities, discount usage and item pairs.
+
+Order endpoints wrap their changes in ``rollup_update`` so the rollup rows
+move in the same transaction (and the dashboard gets the delta once it commits). ``rebuild_rollups`` backfills everything from
+the raw orders, a few days per transaction; run it by hand with ``python rollups.py rebuild``.
+
+    PUB_EXPRESS_ROLLUP_REBUILD_DAYS   business dates rebuilt per transaction (default 7)
+"""
+from sqlalchemy import func, inspect, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from contextlib import contextmanager
+from database import (
+    SessionLocal, Order, OrderItem, Setting,
+    DailySalesRollup, DailyItemRollup, DailyDiscountRollup, DailyItemPair,
+)
+from reports import summary_columns, line_revenue, lines_in_business_days, rollups_ready, ROLLUP_FIELDS
+import archive, baskets, events
+import os, sys
+
+ROLLUPS_VERSION = "5"
+# Business dates rebuilt per transaction; each holds the write lock while it runs
+REBUILD_DAYS = int(os.environ.get("PUB_EXPRESS_ROLLUP_REBUILD_DAYS", 7))
+
+
+def _is_gone(obj) -> bool:
+    state = inspect(obj)
+    return state.deleted or state.was_deleted
+
+
+def order_contribution(order: Order):
+    """What one order adds to the rollups, or None when it adds nothing."""
+    if _is_gone(order):
+        return None
+
+    paid = bool(order.is_paid)
+    canceled = order.cancel_reason is not None
+    if not paid and not canceled:
+        return None
+
+    total = order.total or 0.0
+    discount = order.discount or 0.0
+    order_type = (order.type or "").lower()
+    valid = paid and not canceled
+
+    day = {
+        "total_paid": total if paid else 0.0,
+        "orders_paid": int(paid),
+        "total_discount": discount if paid else 0.0,
+        "dine_in_count": int(paid and order_type == "dine-in"),
+        "dine_in_sales": total if paid and order_type == "dine-in" else 0.0,
+        "take_out_count": int(paid and order_type == "take-out"),
+        "take_out_sales": total if paid and order_type == "take-out" else 0.0,
+        "void_orders": int(paid and canceled),
+        "valid_sales": total if valid else 0.0,
+        "valid_discount": discount if valid else 0.0,
+        "valid_orders": int(valid),
+        "canceled_orders": int(canceled),
+    }
+
+    items, discounts = {}, {}
+    if paid:
+        for item in order.items:
+            if _is_gone(item):
+                continue
+            # Lines unlinked from a deleted menu item count towards the day, not an item
+            if item.menu_item_id is not None:
+                quantity, revenue = items.get(item.menu_item_id, (0, 0.0))
+                items[item.menu_item_id] = (
+                    quantity + (item.quantity or 0),
+                    revenue + (item.line_subtotal or 0.0) - (item.line_discount or 0.0),
+                )
+            if item.discount_person_type:
+                discounts[item.discount_person_type] = discounts.get(item.discount_person_type, 0) + 1
+
+    return order.business_date, day, items, discounts
+
+
+def order_basket(order: Order):
+    """(business date, menu item ids) for a paid, non-void order with items; else None. See baskets.py."""
+    if _is_gone(order) or not order.is_paid or order.cancel_reason is not None:
+        return None
+    items = frozenset(
+        item.menu_item_id for item in order.items if not _is_gone(item) and item.menu_item_id is not None
+    )
+    return (order.business_date, items) if items else None
+
+
+def _upsert(db: Session, table, keys: dict, values: dict):
+    stmt = insert(table.__table__).values(**keys, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: getattr(table.__table__.c, name) + stmt.excluded[name] for name in values},
+    )
+    db.execute(stmt)
+
+
+def _apply(db: Session, contribution, sign: int):
+    if contribution is None:
+        return
+    business_date, day, items, discounts = contribution
+
+    _upsert(db, DailySalesRollup, {"business_date": business_date},
+            {name: sign * value for name, value in day.items()})
+    for menu_item_id, (quantity, revenue) in items.items():
+        _upsert(db, DailyItemRollup, {"business_date": business_date, "menu_item_id": menu_item_id},
+                {"quantity": sign * quantity, "revenue": sign * revenue})
+    for discount_type, count in discounts.items():
+        _upsert(db, DailyDiscountRollup, {"business_date": business_date, "discount_type": discount_type},
+                {"count": sign * count})
+
+
+@contextmanager
+def rollup_update(db: Session, order: Order):
+    """Move the order's rollup contribution along with whatever the block changes."""
+    before = order_contribution(order)
+    basket = order_basket(order)
+    yield
+    db.flush()
+    after = order_contribution(order)
+    if before != after:
+        _apply(db, before, -1)
+        _apply(db, after, 1)
+        events.totals_changed(db, before, after)
+    baskets.apply(db, basket, order_basket(order))
+
+
+# --- Backfill --- #
+
+
+ROLLUP_TABLES = (DailySalesRollup, DailyItemRollup, DailyDiscountRollup, DailyItemPair)
+
+
+def _rebuild_days(db: Session, start_day: int, end_day: int) -> int:
+    """Replace the range's rollup rows with totals from its orders, and commit. Returns the days with orders."""
+    archive.include(db, start_day, end_day)
+    # Writing first takes the write lock, so the reads below see every committed
+    # order; changes committed after this chunk is done move its new rows as usual.
+    for table in ROLLUP_TABLES:
+        db.query(table).filter(table.business_date.between(start_day, end_day)).delete(synchronize_session=False)
+
+    day = Order.business_date.label("business_date")
+    on_day = Order.business_date.between(start_day, end_day)
+    lines = lines_in_business_days(db, start_day, end_day)
+    columns = [c for c in summary_columns() if c.name in ROLLUP_FIELDS]
+    days = db.query(day, *columns).filter(on_day).group_by(day).all()
+    db.bulk_insert_mappings(DailySalesRollup, [dict(row._mapping) for row in days])
+
+    # Totalled here rather than with GROUP BY: over archive views SQLite would
+    # materialize both sides of a grouped join and scan one per row of the other
+    items, discounts = {}, {}
+    paid_lines = db.execute(
+        select(Order.business_date, OrderItem.menu_item_id, OrderItem.quantity, line_revenue(),
+               OrderItem.discount_person_type)
+        .select_from(OrderItem)
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(on_day, lines, Order.is_paid == True)
+    )
+    for business_date, menu_item_id, quantity, revenue, discount_type in paid_lines:
+        if menu_item_id is not None:
+            key = (business_date, menu_item_id)
+            total_quantity, total_revenue = items.get(key, (0, 0.0))
+            items[key] = (total_quantity + (quantity or 0), total_revenue + revenue)
+        if discount_type is not None:
+            key = (business_date, discount_type)
+            discounts[key] = discounts.get(key, 0) + 1
+    db.bulk_insert_mappings(DailyItemRollup, [
+        {"business_date": business_date, "menu_item_id": menu_item_id, "quantity": quantity, "revenue": revenue}
+        for (business_date, menu_item_id), (quantity, revenue) in items.items()
+    ])
+    db.bulk_insert_mappings(DailyDiscountRollup, [
+        {"business_date": business_date, "discount_type": discount_type, "count": count}
+        for (business_date, discount_type), count in discounts.items()
+    ])
+
+    baskets.rebuild(db, start_day=start_day, end_day=end_day)
+    db.commit()
+    return len(days)
+
+
+def rebuild_rollups(db: Session) -> int:
+    """Recompute every rollup row from raw orders and order items, archived ones included.
+
+    Works through ``REBUILD_DAYS`` business dates at a time and commits after
+    each chunk, so the write lock is never held for long while the till is
+    serving. Reports read raw orders until the last chunk is done. Returns
+    the days that had orders.
+    """
+    rollups_ready.clear()
+    archive.include(db)
+    order_days = {day for (day,) in db.query(Order.business_date).distinct() if day is not None}
+    # Days that lost all their orders still need their old rows gone
+    stale_days = set()
+    for table in ROLLUP_TABLES:
+        stale_days.update(day for (day,) in db.query(table.business_date).distinct())
+    db.rollback()
+
+    days, count = sorted(order_days | stale_days), 0
+    for start in range(0, len(days), REBUILD_DAYS):
+        chunk = days[start:start + REBUILD_DAYS]
+        count += _rebuild_days(db, chunk[0], chunk[-1])
+
+    setting = db.query(Setting).filter(Setting.key == "rollups_version").first()
+    if setting:
+        setting.value = ROLLUPS_VERSION
+    else:
+        db.add(Setting(key="rollups_version", value=ROLLUPS_VERSION))
+
+    db.commit()
+    rollups_ready.set()
+    return count
+
+
+def ensure_rollups(db: Session) -> bool:
+    """Backfill the rollups once per schema version. Returns True if a rebuild ran."""
+    setting = db.query(Setting).filter(Setting.key == "rollups_version").first()
+    if setting and setting.value == ROLLUPS_VERSION:
+        rollups_ready.set()
+        return False
+    rebuild_rollups(db)
+    return True
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python rollups.py rebuild")
+        sys.exit(1)
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt rollups for {rebuild_rollups(db)} day(s).")
+    finally:
+        db.close()
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Optional
 from datetime import datetime
+import business_day
 
 class MenuItemBase(BaseModel):
     name: str
@@ -35,6 +36,7 @@ class OrderItemCreate(BaseModel):
     discount_person_type: Optional[str] = None
     manual_discount_type: Optional[str] = None
     manual_discount_value: Optional[float] = 0.0
+    vat_applied: Optional[bool] = False
     notes: Optional[str] = None
 
 class OrderCreate(BaseModel):
@@ -42,7 +44,7 @@ class OrderCreate(BaseModel):
     type: Optional[str] = "dine-in"
     notes: Optional[str] = None
     paid_amount: Optional[float] = 0.0
-    discount: Optional[float] = 0.0
+    discount: Optional[float] = 0.0     # ignored: the server prices discounts (see pricing.py)
     cashier: Optional[str] = None 
 
 class OrderItemOut(BaseModel):
@@ -50,6 +52,11 @@ class OrderItemOut(BaseModel):
     order_id: int
     quantity: int
     menu_item: MenuItemOut
+    unit_price: Optional[float] = None
+    line_subtotal: Optional[float] = None
+    line_discount: Optional[float] = 0.0
+    discount_rule_id: Optional[int] = None
+    vat_applied: Optional[bool] = False
     discount_person_name: Optional[str]
     discount_person_id: Optional[str]
     discount_person_type: Optional[str]
@@ -74,6 +81,25 @@ class OrderOut(BaseModel):
     status: Optional[str]
     receipt_number: Optional[str]
     cashier: Optional[str] = None 
+    business_date: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class OrderSummaryOut(BaseModel):
+    id: int
+    created_at: datetime
+    total: float
+    discount: Optional[float] = 0.0
+    paid: Optional[float] = 0.0
+    is_paid: bool
+    notes: Optional[str]
+    cancel_reason: Optional[str] = None
+    type: Optional[str]
+    status: Optional[str]
+    receipt_number: Optional[str]
+    cashier: Optional[str] = None
+    business_date: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -113,6 +139,21 @@ class UpdateQuantity(BaseModel):
 class PayData(BaseModel):
     paid: float    
     change: Optional[float] = 0
+    terminal: Optional[str] = None
+
+class ReceiptBlockCreate(BaseModel):
+    terminal: str
+    size: int = Field(50, ge=1, le=10000)
+
+class ReceiptBlockOut(BaseModel):
+    terminal: str
+    prefix: str
+    start_number: int
+    end_number: int
+    next_number: int
+
+    class Config:
+        from_attributes = True
 
 class CancelOrderRequest(BaseModel):
     cancel_reason: Optional[str] = None            
@@ -153,4 +194,37 @@ class CashierUpdate(BaseModel):
     
 
 class SettingUpdate(BaseModel):
-    value: str    
\ No newline at end of file
+    value: str    
+
+class ExportJobCreate(BaseModel):
+    format: str = "xlsx"
+    start_date: str
+    end_date: str
+    type: Optional[str] = None
+    cashier: Optional[str] = None
+
+class DiscountRuleCreate(BaseModel):
+    name: str
+    kind: str                              # person, coupon or promo
+    match: Optional[str] = None
+    category: Optional[str] = None
+    percent: float = Field(0.0, ge=0, le=100)
+    amount: float = Field(0.0, ge=0)
+    vat_exempt: bool = False
+    start_time: Optional[str] = None       # HH:MM
+    end_time: Optional[str] = None
+    weekdays: Optional[str] = None
+    valid_from: Optional[str] = None       # YYYY-MM-DD
+    valid_to: Optional[str] = None
+    active: bool = True
+
+class DiscountRuleOut(DiscountRuleCreate):
+    id: int
+
+    @field_validator("valid_from", "valid_to", mode="before")
+    @classmethod
+    def _iso_day(cls, value):
+        return business_day.iso(value) if isinstance(value, int) else value
+
+    class Config:
+        from_attributes = True
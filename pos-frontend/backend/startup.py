@@ -0,0 +1,82 @@
+"""Startup pipeline: short critical phases before serving, heavy maintenance after.
+
+Import this module first in main.py so ``BOOT_STARTED`` covers module imports.
+Every phase and background task is timed; the breakdown is logged once
+the app can serve and again when maintenance finishes, and is exposed by
+``/health/ready``.
+"""
+import time
+
+BOOT_STARTED = time.perf_counter()
+
+from contextlib import contextmanager
+import logging, threading
+
+log = logging.getLogger("pub_express.startup")
+
+
+class StartupReport:
+    def __init__(self, started: float):
+        self.started = started
+        self.phases = []
+        self.tasks = {}
+        self.ready_ms = None
+        self._lock = threading.Lock()
+
+    def _elapsed_ms(self, since: float) -> float:
+        return round((time.perf_counter() - since) * 1000, 1)
+
+    def mark(self, name: str):
+        """Record a phase that ran from the previous phase (or process start) until now."""
+        previous_end = self.started + sum(ms for _, ms in self.phases) / 1000
+        self.phases.append((name, self._elapsed_ms(previous_end)))
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, self._elapsed_ms(t0)))
+
+    def serving(self):
+        self.ready_ms = self._elapsed_ms(self.started)
+        breakdown = ", ".join(f"{name} {ms}ms" for name, ms in self.phases)
+        log.info("Ready to serve in %sms (%s)", self.ready_ms, breakdown)
+
+    def _run_tasks(self, tasks):
+        for name, task in tasks:
+            with self._lock:
+                self.tasks[name] = {"status": "running", "ms": None, "error": None}
+            t0 = time.perf_counter()
+            try:
+                task()
+                status, error = "done", None
+            except Exception as e:
+                log.exception("Startup task failed", extra={"task": name})
+                status, error = "failed", str(e)
+            with self._lock:
+                self.tasks[name] = {"status": status, "ms": self._elapsed_ms(t0), "error": error}
+
+        breakdown = ", ".join(f"{name} {info['ms']}ms ({info['status']})" for name, info in self.tasks.items())
+        log.info("Background maintenance finished: %s", breakdown)
+
+    def start_background(self, tasks):
+        with self._lock:
+            for name, _ in tasks:
+                self.tasks[name] = {"status": "pending", "ms": None, "error": None}
+        threading.Thread(target=self._run_tasks, args=(tasks,), name="startup-maintenance", daemon=True).start()
+
+    def status(self) -> dict:
+        with self._lock:
+            tasks = {name: dict(info) for name, info in self.tasks.items()}
+        return {
+            "ready": self.ready_ms is not None,
+            "ready_ms": self.ready_ms,
+            "maintenance_complete": all(t["status"] in ("done", "failed") for t in tasks.values()),
+            "phases": [{"name": name, "ms": ms} for name, ms in self.phases],
+            "maintenance": tasks,
+        }
+
+
+boot = StartupReport(BOOT_STARTED)
@@ -0,0 +1,311 @@
+"""Incremental sync of the order journal to a head-office store.
+
+A branch ships only the journal events after the sequence number that the
+store last acknowledged for it. Events go out as gzip-compressed JSON-lines
+batches. Each batch and the new acknowledgement are written in one
+transaction, so a retried push never sends an event twice. At head office,
+``consolidate`` expands the received batches into one ``hq_orders`` row per
+branch order, and consolidated reports run against that table.
+
+The store is any SQLAlchemy URL: a local SQLite file is enough for testing,
+and Postgres is the real thing.
+
+    PUB_EXPRESS_SYNC_URL        head-office store, e.g. postgresql://hq/pos (unset: sync off)
+    PUB_EXPRESS_BRANCH_ID       this branch's name in the store (default: host name)
+    PUB_EXPRESS_SYNC_BATCH      events per batch (default 500)
+    PUB_EXPRESS_SYNC_INTERVAL   seconds between automatic pushes (default 0: push by hand)
+
+    python sync.py status
+    python sync.py push [--url URL]
+    python sync.py consolidate --url URL        (run at head office)
+"""
+from sqlalchemy import (
+    create_engine, MetaData, Table, Column, Integer, String, Float, Boolean, LargeBinary, DateTime,
+    select, bindparam,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from database import SessionLocal, ReportSession, Setting
+from log_config import configure_logging
+from json_response import dumps
+import business_day, journal
+import argparse, gzip, json, logging, os, socket, sys, threading, time
+
+log = logging.getLogger("pub_express.sync")
+
+SYNC_URL = os.environ.get("PUB_EXPRESS_SYNC_URL", "")
+BRANCH_ID = os.environ.get("PUB_EXPRESS_BRANCH_ID", "") or socket.gethostname()
+BATCH_SIZE = int(os.environ.get("PUB_EXPRESS_SYNC_BATCH", 500))
+SYNC_INTERVAL = float(os.environ.get("PUB_EXPRESS_SYNC_INTERVAL", 0))
+
+# --- Head-office store --- #
+
+store_metadata = MetaData()
+
+sync_branches = Table(
+    "sync_branches", store_metadata,
+    Column("branch_id", String, primary_key=True),
+    Column("acked_seq", Integer, nullable=False, default=0),      # last event received
+    Column("applied_seq", Integer, nullable=False, default=0),    # last event consolidated into hq_orders
+    Column("updated_at", DateTime),
+)
+
+sync_batches = Table(
+    "sync_batches", store_metadata,
+    Column("branch_id", String, primary_key=True),
+    Column("first_seq", Integer, primary_key=True),
+    Column("last_seq", Integer, nullable=False),
+    Column("event_count", Integer, nullable=False),
+    Column("raw_bytes", Integer, nullable=False),
+    Column("payload", LargeBinary, nullable=False),               # gzip of JSON lines
+    Column("received_at", DateTime),
+)
+
+hq_orders = Table(
+    "hq_orders", store_metadata,
+    Column("branch_id", String, primary_key=True),
+    Column("order_id", Integer, primary_key=True),
+    Column("business_date", Integer, index=True),
+    Column("created_at", String),
+    Column("status", String),
+    Column("is_paid", Boolean),
+    Column("total", Float),
+    Column("discount", Float),
+    Column("paid", Float),
+    Column("type", String),
+    Column("cashier", String),
+    Column("receipt_number", String),
+    Column("cancel_reason", String),
+    Column("notes", String),
+    Column("lines", String),                                       # JSON list of order lines
+    Column("deleted", Boolean, nullable=False, default=False),
+    Column("last_seq", Integer, nullable=False),
+)
+
+_engines = {}
+_push_lock = threading.Lock()
+
+# Last push in this process, read by /sync/status
+last_push = {}
+
+
+def store_engine(url: str):
+    if url not in _engines:
+        engine = create_engine(url)
+        store_metadata.create_all(engine)
+        _engines[url] = engine
+    return _engines[url]
+
+
+def _upsert(conn, table, rows: list, keys: list):
+    """Insert or update ``rows`` (dicts with the same keys) in one executemany."""
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(table)
+    return conn.execute(stmt.on_conflict_do_update(
+        index_elements=keys, set_={name: stmt.excluded[name] for name in rows[0] if name not in keys},
+    ), rows)
+
+
+def _acked_seq(conn, branch_id: str) -> int:
+    return conn.execute(
+        select(sync_branches.c.acked_seq).where(sync_branches.c.branch_id == branch_id)
+    ).scalar() or 0
+
+
+# --- Branch side --- #
+
+
+def _encode(rows) -> tuple:
+    raw = b"".join(
+        dumps({"seq": seq, "order_id": order_id, "action": action, "at": created_at,
+               "data": json.loads(payload)}) + b"\n"
+        for seq, order_id, action, created_at, payload in rows
+    )
+    return gzip.compress(raw, compresslevel=6), len(raw)
+
+
+def _remember_ack(sessions, seq: int):
+    db = sessions()
+    try:
+        setting = db.query(Setting).filter(Setting.key == "sync_acked_seq").first()
+        if setting:
+            setting.value = str(seq)
+        else:
+            db.add(Setting(key="sync_acked_seq", value=str(seq)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def push(url: str = None, branch_id: str = None, batch_size: int = None, sessions=None) -> dict:
+    """Ship every journal event the store hasn't acknowledged. Raises RuntimeError if a push is running.
+
+    ``sessions`` is a session factory for the branch database (default: the app's).
+    """
+    url = url or SYNC_URL
+    branch_id = branch_id or BRANCH_ID
+    batch_size = batch_size or BATCH_SIZE
+    if not url:
+        raise ValueError("No head-office store configured (PUB_EXPRESS_SYNC_URL)")
+    if not _push_lock.acquire(blocking=False):
+        raise RuntimeError("A sync push is already running")
+
+    t0 = time.perf_counter()
+    stats = {"branch_id": branch_id, "batches": 0, "events": 0, "raw_bytes": 0, "sent_bytes": 0, "seeded": 0}
+    try:
+        store = store_engine(url)
+        with store.connect() as conn:
+            acked = _acked_seq(conn, branch_id)
+
+        if acked == 0:
+            # First push from this branch: orders older than the journal go out as snapshots
+            db = (sessions or SessionLocal)()
+            try:
+                stats["seeded"] = journal.seed(db)
+            finally:
+                db.close()
+
+        db = (sessions or ReportSession)()
+        try:
+            while True:
+                rows = journal.events_after(db, acked, batch_size)
+                db.rollback()  # end the read so the next batch sees newer events
+                if not rows:
+                    break
+                blob, raw_bytes = _encode(rows)
+                first_seq, last_seq = rows[0].seq, rows[-1].seq
+                with store.begin() as conn:
+                    if _acked_seq(conn, branch_id) != acked:
+                        raise RuntimeError(f"Store acknowledgement for {branch_id} moved during the push")
+                    conn.execute(sync_batches.insert().values(
+                        branch_id=branch_id, first_seq=first_seq, last_seq=last_seq,
+                        event_count=len(rows), raw_bytes=raw_bytes, payload=blob,
+                        received_at=business_day.utcnow(),
+                    ))
+                    _upsert(conn, sync_branches, [{
+                        "branch_id": branch_id, "acked_seq": last_seq, "updated_at": business_day.utcnow(),
+                    }], ["branch_id"])
+                acked = last_seq
+                stats["batches"] += 1
+                stats["events"] += len(rows)
+                stats["raw_bytes"] += raw_bytes
+                stats["sent_bytes"] += len(blob)
+        finally:
+            db.close()
+
+        _remember_ack(sessions or SessionLocal, acked)
+        stats["acked_seq"] = acked
+        stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        last_push.clear()
+        last_push.update(stats, finished=business_day.utcnow().isoformat())
+        log.info("Sync pushed %s event(s) in %s batch(es)", stats["events"], stats["batches"], extra=stats)
+        return stats
+    finally:
+        _push_lock.release()
+
+
+def status() -> dict:
+    db = ReportSession()
+    try:
+        local_seq = journal.last_seq(db)
+        setting = db.query(Setting).filter(Setting.key == "sync_acked_seq").first()
+    finally:
+        db.close()
+    acked = int(setting.value) if setting else 0
+    return {
+        "branch_id": BRANCH_ID,
+        "configured": bool(SYNC_URL),
+        "journal_seq": local_seq,
+        "acked_seq": acked,
+        "pending_events": max(0, local_seq - acked),
+        "last_push": last_push or None,
+    }
+
+
+def _scheduler_loop(stop: threading.Event):
+    while not stop.wait(SYNC_INTERVAL):
+        try:
+            push()
+        except Exception:
+            log.exception("Scheduled sync push failed")
+
+
+def start_scheduler():
+    """Push every PUB_EXPRESS_SYNC_INTERVAL seconds on a daemon thread, when sync is configured."""
+    if not SYNC_URL or SYNC_INTERVAL <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=_scheduler_loop, args=(stop,), name="sync-push", daemon=True).start()
+    return stop
+
+
+# --- Head-office side --- #
+
+
+def _order_row(branch_id: str, event: dict) -> dict:
+    order = event["data"]["order"]
+    return {
+        "branch_id": branch_id, "order_id": event["order_id"], "last_seq": event["seq"],
+        **{name: order.get(name) for name in (
+            "business_date", "created_at", "status", "is_paid", "total", "discount", "paid",
+            "type", "cashier", "receipt_number", "cancel_reason", "notes",
+        )},
+        "lines": json.dumps(event["data"]["items"]),
+        "deleted": False,
+    }
+
+
+def consolidate(url: str) -> dict:
+    """Apply every received batch not yet applied to hq_orders, per branch, in sequence order."""
+    store = store_engine(url)
+    applied = {}
+    with store.begin() as conn:
+        branches = conn.execute(select(sync_branches.c.branch_id, sync_branches.c.applied_seq)).all()
+    for branch_id, applied_seq in branches:
+        count = 0
+        with store.begin() as conn:
+            batches = conn.execute(
+                select(sync_batches.c.payload)
+                .where(sync_batches.c.branch_id == branch_id, sync_batches.c.last_seq > applied_seq)
+                .order_by(sync_batches.c.first_seq)
+            ).scalars().all()
+            for blob in batches:
+                latest = {}
+                for line in gzip.decompress(blob).splitlines():
+                    event = json.loads(line)
+                    if event["seq"] > applied_seq:
+                        latest[event["order_id"]] = event   # only an order's newest state matters
+                        applied_seq = event["seq"]
+                        count += 1
+                changed = [_order_row(branch_id, e) for e in latest.values() if e["action"] != "deleted"]
+                deleted = [{"oid": e["order_id"], "seq": e["seq"]} for e in latest.values() if e["action"] == "deleted"]
+                if changed:
+                    _upsert(conn, hq_orders, changed, ["branch_id", "order_id"])
+                if deleted:
+                    conn.execute(hq_orders.update().where(
+                        hq_orders.c.branch_id == branch_id, hq_orders.c.order_id == bindparam("oid"),
+                    ).values(deleted=True, last_seq=bindparam("seq")), deleted)
+            conn.execute(sync_branches.update().where(sync_branches.c.branch_id == branch_id)
+                         .values(applied_seq=applied_seq))
+        applied[branch_id] = count
+    return applied
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["status", "push", "consolidate"])
+    parser.add_argument("--url", default=SYNC_URL)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print(json.dumps(status(), indent=2))
+    elif not args.url:
+        print("Set PUB_EXPRESS_SYNC_URL or pass --url")
+        sys.exit(1)
+    elif args.command == "push":
+        stats = push(args.url)
+        print(f"Pushed {stats['events']} event(s) in {stats['batches']} batch(es): "
+              f"{stats['raw_bytes']} bytes raw, {stats['sent_bytes']} sent; acked through #{stats['acked_seq']}")
+    else:
+        for branch_id, count in consolidate(args.url).items():
+            print(f"{branch_id}: applied {count} event(s)")
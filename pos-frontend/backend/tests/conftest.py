@@ -0,0 +1,33 @@
+"""Run with ``python -m pytest tests`` from the backend folder."""
+import os, sys
+
+# The backend is a flat folder of modules imported by name, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+from database import Base, MenuItem, make_engine
+from migrations import run_migrations
+import menu_cache, pricing
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A session on a fresh, migrated database with a small menu; endpoints are called directly."""
+    engine = make_engine(f"sqlite:///{tmp_path / 'pub_express.db'}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    session.add_all([
+        MenuItem(id=1, name="Beer", category="Drinks", price=112.0),
+        MenuItem(id=2, name="Sisig", category="Food", price=224.0),
+    ])
+    session.commit()
+    # Both caches are per process and keyed by version, not by database
+    menu_cache.invalidate()
+    pricing.invalidate()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
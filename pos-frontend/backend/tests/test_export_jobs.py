@@ -0,0 +1,21 @@
+"""Cached exports are stamped with the data versions of their range and of the menu."""
+from schemas import MenuItemUpdate, OrderCreate, OrderItemCreate, PayData
+from export_jobs import data_stamp
+import main
+
+
+def test_order_changes_move_only_their_day(db):
+    order = main.create_order(OrderCreate(items=[OrderItemCreate(menu_item_id=1, quantity=1)]), db)
+    day = order.business_date
+    created = data_stamp(db, day, day)
+    assert created > 0
+
+    main.mark_order_paid(order.id, PayData(paid=500), db)
+    assert data_stamp(db, day, day) > created
+    assert data_stamp(db, day + 1, day + 1) == 0
+
+
+def test_menu_changes_move_every_range(db):
+    before = data_stamp(db, 20200101, 20200101)
+    main.update_menu_item(1, MenuItemUpdate(name="Pale Pilsen", category="Drinks", price=120.0), db)
+    assert data_stamp(db, 20200101, 20200101) > before
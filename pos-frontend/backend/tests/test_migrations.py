@@ -0,0 +1,105 @@
+"""Upgrading a pub_express.db made by the original release through every migration."""
+from sqlalchemy import inspect
+from database import Base, Order, OrderItem, make_engine
+from migrations import MIGRATIONS, run_migrations
+import sqlite3
+
+# The schema create_all made before there were any migrations (user_version 0)
+BASELINE_SCHEMA = """
+CREATE TABLE menu_items (
+    id INTEGER NOT NULL, name VARCHAR NOT NULL, category VARCHAR NOT NULL, price FLOAT NOT NULL,
+    image_url VARCHAR, PRIMARY KEY (id), UNIQUE (name)
+);
+CREATE INDEX ix_menu_items_id ON menu_items (id);
+CREATE TABLE orders (
+    id INTEGER NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, total FLOAT, discount FLOAT,
+    paid FLOAT, is_paid BOOLEAN, type VARCHAR, notes VARCHAR, cancel_reason VARCHAR, status VARCHAR,
+    receipt_number VARCHAR, cashier VARCHAR, PRIMARY KEY (id), UNIQUE (receipt_number)
+);
+CREATE INDEX ix_orders_id ON orders (id);
+CREATE TABLE supervisors (id INTEGER NOT NULL, pin VARCHAR NOT NULL, PRIMARY KEY (id));
+CREATE INDEX ix_supervisors_id ON supervisors (id);
+CREATE TABLE cashiers (id INTEGER NOT NULL, name VARCHAR NOT NULL, pin VARCHAR NOT NULL, PRIMARY KEY (id));
+CREATE INDEX ix_cashiers_id ON cashiers (id);
+CREATE TABLE settings (
+    id INTEGER NOT NULL, "key" VARCHAR NOT NULL, value VARCHAR, PRIMARY KEY (id), UNIQUE ("key")
+);
+CREATE INDEX ix_settings_id ON settings (id);
+CREATE TABLE order_items (
+    id INTEGER NOT NULL, order_id INTEGER, menu_item_id INTEGER, quantity INTEGER,
+    discount_person_name VARCHAR, discount_person_id VARCHAR, discount_person_type VARCHAR,
+    manual_discount_type VARCHAR, manual_discount_value FLOAT, notes VARCHAR, PRIMARY KEY (id),
+    FOREIGN KEY(order_id) REFERENCES orders (id), FOREIGN KEY(menu_item_id) REFERENCES menu_items (id)
+);
+CREATE INDEX ix_order_items_id ON order_items (id);
+
+INSERT INTO menu_items (id, name, category, price) VALUES (1, 'Beer', 'Drinks', 100.0);
+INSERT INTO orders (id, created_at, total, discount, paid, is_paid, type, status, receipt_number)
+    VALUES (1, '2024-03-01 12:30:00', 200.0, 10.0, 200.0, 1, 'dine-in', 'paid', 'PX-2024-000041');
+INSERT INTO order_items (id, order_id, menu_item_id, quantity, manual_discount_type, manual_discount_value)
+    VALUES (1, 1, 1, 2, 'fixed', 10.0);
+-- Senior discount on the order only, next to a manual line discount
+INSERT INTO orders (id, created_at, total, discount, paid, is_paid, type, status)
+    VALUES (2, '2024-03-02 19:00:00', 300.0, 33.0, 300.0, 1, 'dine-in', 'paid');
+INSERT INTO order_items (id, order_id, menu_item_id, quantity, manual_discount_type, manual_discount_value)
+    VALUES (2, 2, 1, 1, 'fixed', 5.0);
+INSERT INTO order_items (id, order_id, menu_item_id, quantity, discount_person_type, discount_person_name)
+    VALUES (3, 2, 1, 2, 'Senior Citizen', 'Lola');
+"""
+
+
+def _baseline_db(tmp_path):
+    path = tmp_path / "pub_express.db"
+    raw = sqlite3.connect(path)
+    raw.executescript(BASELINE_SCHEMA)
+    raw.close()
+    return make_engine(f"sqlite:///{path}")
+
+
+def test_baseline_db_upgrades_through_every_migration(tmp_path):
+    engine = _baseline_db(tmp_path)
+    try:
+        # What startup does
+        Base.metadata.create_all(bind=engine)
+        run_migrations(engine)
+
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA user_version").scalar() == MIGRATIONS[-1][0]
+            order = conn.exec_driver_sql("SELECT business_date FROM orders WHERE id = 1").one()
+            line = conn.exec_driver_sql(
+                "SELECT unit_price, line_subtotal, line_discount FROM order_items WHERE id = 1"
+            ).one()
+            last_receipt = conn.exec_driver_sql(
+                "SELECT last_number FROM receipt_sequences WHERE prefix = 'PX-2024-'"
+            ).scalar()
+            person_lines = conn.exec_driver_sql(
+                "SELECT i.id, i.line_discount, r.name FROM order_items i "
+                "LEFT JOIN discount_rules r ON r.id = i.discount_rule_id WHERE i.order_id = 2 ORDER BY i.id"
+            ).all()
+        assert order.business_date is not None
+        # The 28.00 beyond the manual 5.00 moves onto the senior line
+        assert [tuple(row) for row in person_lines] == [(2, 5.0, None), (3, 28.0, "Senior Citizen")]
+        assert tuple(line) == (100.0, 200.0, 10.0)
+        assert last_receipt == 41
+
+        # Same columns and indexes as a database created from scratch
+        inspector = inspect(engine)
+        for model in (Order, OrderItem):
+            table = model.__table__
+            assert {column["name"] for column in inspector.get_columns(table.name)} == set(table.c.keys())
+            present = {index["name"] for index in inspector.get_indexes(table.name)}
+            assert {index.name for index in table.indexes} <= present
+    finally:
+        engine.dispose()
+
+
+def test_migrations_are_idempotent_on_a_current_db(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'pub_express.db'}")
+    try:
+        Base.metadata.create_all(bind=engine)
+        run_migrations(engine)
+        run_migrations(engine)
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA user_version").scalar() == MIGRATIONS[-1][0]
+    finally:
+        engine.dispose()
@@ -0,0 +1,86 @@
+"""Order edits keep the order's discount equal to the sum of its line discounts."""
+from fastapi import HTTPException
+from database import Order
+from schemas import DiscountUpdate, OrderCreate, OrderItemCreate, UpdateQuantity
+import main
+import pytest
+
+
+def _check_discount(db, order_id):
+    db.expire_all()
+    order = db.get(Order, order_id)
+    assert order.discount == pytest.approx(sum(item.line_discount for item in order.items), abs=0.005)
+    return order
+
+
+def _open_order(db):
+    return main.create_order(OrderCreate(items=[
+        OrderItemCreate(menu_item_id=1, quantity=1),
+        OrderItemCreate(menu_item_id=2, quantity=2, discount_person_type="Senior Citizen"),
+    ]), db)
+
+
+def test_discount_override_is_spread_over_the_lines(db):
+    order = _open_order(db)
+    main.update_order_discount(order.id, DiscountUpdate(discount=100), db)
+
+    order = _check_discount(db, order.id)
+    assert order.discount == 100
+    # 112 of a 560 subtotal is a fifth of it
+    assert [item.line_discount for item in order.items] == [20.0, 80.0]
+    assert all(item.manual_discount_type == "fixed" and item.discount_rule_id is None for item in order.items)
+
+
+def test_override_rounding_is_settled_on_lines_with_room(db):
+    order = main.create_order(OrderCreate(items=[
+        OrderItemCreate(menu_item_id=1, quantity=1),
+        OrderItemCreate(menu_item_id=1, quantity=1),
+        OrderItemCreate(menu_item_id=1, quantity=1),
+        OrderItemCreate(menu_item_id=2, quantity=1, discount_person_type="Senior Citizen"),
+    ]), db)
+    # Subtotals of 1, 1, 1 and 0.01: the small line can't take its rounded share
+    for item, price in zip(order.items, (1.0, 1.0, 1.0, 0.01)):
+        item.unit_price = item.line_subtotal = price
+        item.line_discount = 0.0
+    zero = main.add_item_to_order(order.id, OrderItemCreate(menu_item_id=1, quantity=1), db)
+    zero.line_subtotal, zero.line_discount, zero.discount_rule_id = 0.0, 0.05, 1
+    order.total, order.discount = 3.01, 0.05
+    db.commit()
+
+    main.update_order_discount(order.id, DiscountUpdate(discount=2), db)
+
+    order = _check_discount(db, order.id)
+    assert order.discount == 2.0
+    assert all(item.line_discount <= item.line_subtotal for item in order.items)
+    # The zero-subtotal line loses its old rule discount too
+    assert (order.items[-1].line_discount, order.items[-1].discount_rule_id) == (0.0, None)
+
+
+def test_edits_after_an_override_move_the_discount_by_line(db):
+    order = _open_order(db)
+    main.update_order_discount(order.id, DiscountUpdate(discount=33.33), db)
+    _check_discount(db, order.id)
+
+    senior = main.add_item_to_order(
+        order.id, OrderItemCreate(menu_item_id=1, quantity=1, discount_person_type="PWD"), db,
+    )
+    order = _check_discount(db, order.id)
+    assert order.discount == pytest.approx(33.33 + senior.line_discount)
+
+    first = order.items[0]
+    share = first.line_discount
+    main.update_order_item_quantity(order.id, first.id, UpdateQuantity(quantity=3), db)
+    order = _check_discount(db, order.id)
+    # The override is a fixed amount on the line, so more units don't grow it
+    assert order.items[0].line_discount == share
+
+    main.delete_order_item(order.id, first.id, db)
+    _check_discount(db, order.id)
+
+
+def test_override_larger_than_the_order_is_rejected(db):
+    order = _open_order(db)
+    with pytest.raises(HTTPException) as error:
+        main.update_order_discount(order.id, DiscountUpdate(discount=1000), db)
+    assert error.value.status_code == 400
+    _check_discount(db, order.id)
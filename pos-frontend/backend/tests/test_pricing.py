@@ -0,0 +1,51 @@
+"""Server-side line pricing, and the order totals it leaves behind."""
+from schemas import OrderCreate, OrderItemCreate
+import business_day, main, pricing
+import pytest
+
+
+def _quote(db, **fields):
+    return main.quote_order(OrderCreate(items=[OrderItemCreate(menu_item_id=1, quantity=2, **fields)]), db)
+
+
+def test_plain_line_has_no_discount(db):
+    assert _quote(db)["discount"] == 0.0
+
+
+def test_vat_applied_takes_out_the_vat(db):
+    # 2 x 112 with 12% VAT included: 200 before VAT
+    assert _quote(db, vat_applied=True)["discount"] == 24.0
+
+
+def test_vat_applied_manual_discount_comes_off_the_vat_less_price(db):
+    # What the till charges: 200 less 10% is 180
+    quote = _quote(db, vat_applied=True, manual_discount_type="percent", manual_discount_value=10)
+    assert quote["due"] == 180.0
+    quote = _quote(db, vat_applied=True, manual_discount_type="fixed", manual_discount_value=30)
+    assert quote["due"] == 170.0
+
+
+def test_senior_rule_is_vat_exempt_with_or_without_the_flag(db):
+    # 20% off the VAT-less 200, and the VAT itself: 224 - 160
+    for vat_applied in (False, True):
+        quote = _quote(db, vat_applied=vat_applied, discount_person_type="Senior Citizen")
+        assert quote["discount"] == 64.0
+
+
+def test_created_order_matches_its_quote(db):
+    order_data = OrderCreate(items=[
+        OrderItemCreate(menu_item_id=1, quantity=2, vat_applied=True),
+        OrderItemCreate(menu_item_id=2, quantity=1, manual_discount_type="percent", manual_discount_value=50),
+    ])
+    quote = main.quote_order(order_data, db)
+    order = main.create_order(order_data, db)
+
+    assert (order.total, order.discount) == (quote["total"], quote["discount"])
+    assert [item.vat_applied for item in order.items] == [True, False]
+    assert order.discount == round(sum(item.line_discount for item in order.items), 2)
+
+
+def test_unknown_coupon_is_rejected(db):
+    item = OrderItemCreate(menu_item_id=1, quantity=1, discount_person_type="Coupon", discount_person_id="NOPE")
+    with pytest.raises(pricing.PricingError):
+        pricing.price_order(pricing.get_rule_book(db), [item], business_day.utcnow())
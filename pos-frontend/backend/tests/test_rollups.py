@@ -0,0 +1,83 @@
+"""Rollups kept by rollup_update match a rebuild, whatever the rebuild's chunk size."""
+from database import MenuItem, Order, DailySalesRollup, DailyItemRollup, DailyDiscountRollup, DailyItemPair
+from schemas import OrderCreate, OrderItemCreate, PayData
+from sqlalchemy import and_
+from sqlalchemy.orm import sessionmaker
+from benchmarks.seed import seed
+import main, rollups
+import pytest
+
+TABLES = (DailySalesRollup, DailyItemRollup, DailyDiscountRollup, DailyItemPair)
+
+
+def _snapshot(db):
+    db.expire_all()
+    snapshot = {}
+    for table in TABLES:
+        columns = table.__table__.columns
+        values = [column for column in columns if not column.primary_key]
+        # Live updates leave zeroed rows behind where a rebuild writes none
+        rows = db.query(*columns).filter(~and_(*(column == 0 for column in values))).all()
+        snapshot[table.__tablename__] = sorted(
+            tuple(round(value, 2) if isinstance(value, float) else value for value in row) for row in rows
+        )
+    return snapshot
+
+
+@pytest.fixture
+def history(db):
+    db.query(MenuItem).delete()
+    db.commit()
+    seed(db.get_bind(), orders=400, days=20, menu_items=2)
+    main.menu_cache.invalidate()
+    return db
+
+
+@pytest.mark.parametrize("chunk_days", [1, 3, 1000])
+def test_rebuild_in_chunks_matches_a_full_rebuild(history, monkeypatch, chunk_days):
+    monkeypatch.setattr(rollups, "REBUILD_DAYS", 1000)
+    rollups.rebuild_rollups(history)
+    full = _snapshot(history)
+
+    # A day whose orders are all gone must lose its rows too
+    history.add(DailySalesRollup(business_date=19990101, total_paid=5.0, orders_paid=1))
+    history.commit()
+    monkeypatch.setattr(rollups, "REBUILD_DAYS", chunk_days)
+    rollups.rebuild_rollups(history)
+    assert _snapshot(history) == full
+    assert rollups.rollups_ready.is_set()
+
+
+def test_live_updates_match_a_rebuild(history):
+    rollups.rebuild_rollups(history)
+    order = main.create_order(OrderCreate(items=[
+        OrderItemCreate(menu_item_id=1, quantity=2),
+        OrderItemCreate(menu_item_id=2, quantity=1, discount_person_type="PWD"),
+    ]), history)
+    main.mark_order_paid(order.id, PayData(paid=10_000), history)
+    live = _snapshot(history)
+
+    rollups.rebuild_rollups(history)
+    assert _snapshot(history) == live
+
+
+def test_unlinking_lines_of_a_deleted_item_keeps_the_sale(history, monkeypatch):
+    order = main.create_order(OrderCreate(items=[
+        OrderItemCreate(menu_item_id=1, quantity=2),
+        OrderItemCreate(menu_item_id=2, quantity=1),
+    ]), history)
+    main.mark_order_paid(order.id, PayData(paid=10_000), history)
+    total = order.total
+    rollups.rebuild_rollups(history)
+    history.query(MenuItem).filter(MenuItem.id == 2).delete()
+    history.commit()
+
+    monkeypatch.setattr(main, "SessionLocal", sessionmaker(bind=history.get_bind()))
+    main.cleanup_orphan_order_items()
+    live = _snapshot(history)
+    order = history.get(Order, order.id)
+    assert order.total == total
+    assert [item.menu_item_id for item in order.items] == [1, None]
+
+    rollups.rebuild_rollups(history)
+    assert _snapshot(history) == live
@@ -0,0 +1,28 @@
+import { ref } from "vue";
+import api from "./axios";
+
+// Server-sent change feed (backend events.py). EventSource reconnects by itself
+// and resumes from the last event id it saw.
+export function openEventStream(since) {
+  const url = new URL("/events/stream", api.defaults.baseURL);
+  if (since) url.searchParams.set("since", since);
+  return new EventSource(url);
+}
+
+// Bumped on every order change (or resync), so cached order lists know they are stale
+export const orderChanges = ref(0);
+let orderStream = null;
+
+export function watchOrderChanges() {
+  if (orderStream) return;
+  orderStream = openEventStream();
+  const bump = () => {
+    orderChanges.value += 1;
+  };
+  orderStream.addEventListener("order", bump);
+  orderStream.addEventListener("reset", bump);
+}
+
+export function orderFeedLive() {
+  return orderStream !== null && orderStream.readyState === EventSource.OPEN;
+}